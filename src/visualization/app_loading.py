@@ -0,0 +1,71 @@
+# Lazy data loading for the Dash app factories
+#
+# The apps are created without reading any data, so importing them (or starting
+# a WSGI worker) is fast. The data is loaded once: by the first request that
+# needs it, or ahead of time by a warm-up thread started with the app. The
+# memory used by each loading stage is reported when it is done.
+
+import logging
+import threading
+import time
+
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+class LazyData:
+    """
+    A value loaded once, on first use, from whichever thread asks first.
+
+    Parameters
+    ----------
+    name : str
+        used when reporting the load time
+    load : callable
+        returns the value
+    on_load : callable, optional
+        called with the value before it is handed out (e.g. to register callbacks that depend on it)
+    report_memory : bool
+        log the memory used by each pipeline stage so far once loaded (see instrumentation.py)
+    """
+
+    def __init__(self, name, load, on_load=None, report_memory=True):
+        self.name = name
+        self.load = load
+        self.on_load = on_load
+        self.report_memory = report_memory
+        self._value = None
+        self._lock = threading.Lock()
+        self._warm_up_lock = threading.Lock()  # (the load holds _lock)
+        self._warm_up_thread = None
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    start_time = time.perf_counter()
+                    value = self.load()
+                    if self.on_load is not None:
+                        self.on_load(value)
+                    self._value = value
+                    logger.info("Loaded %s data in %.2fs", self.name, time.perf_counter() - start_time)
+                    if self.report_memory:
+                        logger.info(instrumentation.get_memory_report())
+        return self._value
+
+    def warm_up(self):
+        """Start loading in a background thread (once; later calls return the same thread)."""
+        with self._warm_up_lock:
+            if self._warm_up_thread is None:
+                self._warm_up_thread = threading.Thread(target=self.get, name=self.name + '-warm-up', daemon=True)
+                self._warm_up_thread.start()
+        return self._warm_up_thread
+
+
+def report_startup(name, start_time):
+    logger.info("Created %s app in %.2fs", name, time.perf_counter() - start_time)
@@ -0,0 +1,143 @@
+// Clientside callbacks of visualize-donor-data-scatterplot.py
+//
+// The figure is assembled here from the trace in the 'scatter-trace' store and
+// the axis types, so toggling Linear/Log only changes the layout and never
+// reaches the server. In clientside mode the indicator columns of every age
+// category also arrive once in the 'scatter-data' store, as base64 encoded
+// little-endian float32 arrays, and the trace is built here too. Traces built on
+// the server pack their arrays as {dtype, bdata[, shape]} typed arrays (see
+// figure_encoding.py), which are unpacked here before plotting.
+
+(function () {
+    // Decoded arrays, by store contents and then by "<age category>/<column>"
+    let decodedData = null;
+    let decoded = {};
+
+    // The last server trace and its unpacked copy
+    let packedTrace = null;
+    let unpackedTrace = null;
+
+    const typedArrays = {float32: Float32Array, float64: Float64Array, int32: Int32Array};
+
+    function decodeBytes(encoded) {
+        return Uint8Array.from(atob(encoded), function (character) {
+            return character.charCodeAt(0);
+        });
+    }
+
+    function decodeValues(encoded) {
+        return new Float32Array(decodeBytes(encoded).buffer);
+    }
+
+    function isTypedArray(value) {
+        return value !== null && typeof value === 'object' && typeof value.dtype === 'string' &&
+            typeof value.bdata === 'string';
+    }
+
+    function decodeTypedArray(packed) {
+        const values = new typedArrays[packed.dtype](decodeBytes(packed.bdata).buffer);
+        if (!packed.shape) {
+            return values;
+        }
+        // 2D arrays (heatmap z) as a list of rows
+        const rows = [];
+        for (let row = 0; row < packed.shape[0]; row++) {
+            rows.push(Array.from(values.subarray(row * packed.shape[1], (row + 1) * packed.shape[1])));
+        }
+        return rows;
+    }
+
+    function unpackTrace(trace) {
+        if (trace !== packedTrace) {
+            packedTrace = trace;
+            unpackedTrace = Object.assign({}, trace);
+            Object.keys(trace).forEach(function (key) {
+                if (isTypedArray(trace[key])) {
+                    const values = decodeTypedArray(trace[key]);
+                    // plotly.js only reads hover text from plain arrays
+                    unpackedTrace[key] = key === 'text' ? Array.from(values) : values;
+                }
+            });
+        }
+        return unpackedTrace;
+    }
+
+    function getValues(data, ageValue, column) {
+        const category = data.categories[ageValue];
+        if (!category || !(column in category.columns)) {
+            return new Float32Array(0);
+        }
+        if (decodedData !== data) {
+            decodedData = data;
+            decoded = {};
+        }
+        const key = ageValue + '/' + column;
+        if (!(key in decoded)) {
+            decoded[key] = decodeValues(category.columns[column]);
+        }
+        return decoded[key];
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        scatterplot: {
+            update_trace: function (xaxisColumnName, yaxisColumnName, ageValue, data) {
+                const text = data.indicators.indexOf(yaxisColumnName) >= 0
+                    ? Array.from(getValues(data, ageValue, data.age_column)) : [];
+
+                return {
+                    x: getValues(data, ageValue, xaxisColumnName),
+                    y: getValues(data, ageValue, yaxisColumnName),
+                    text: text,
+                    mode: 'markers',
+                    marker: {
+                        size: 10,
+                        opacity: 0.5,
+                        line: {width: 0.5, color: 'white'}
+                    }
+                };
+            },
+
+            update_density_axes: function (xaxisType, yaxisType, ageValue, displays) {
+                // Only density heatmaps are binned differently on log axes
+                if (displays[ageValue] !== 'density') {
+                    return window.dash_clientside.no_update;
+                }
+                return [xaxisType === 'Log', yaxisType === 'Log'];
+            },
+
+            update_selection_density_axes: function (xaxisType, yaxisType, trace) {
+                // The display of a cohort selection is only known from its trace
+                if (!trace || trace.type !== 'heatmap') {
+                    return window.dash_clientside.no_update;
+                }
+                return [xaxisType === 'Log', yaxisType === 'Log'];
+            },
+
+            update_figure: function (trace, xaxisType, yaxisType, xaxisColumnName, yaxisColumnName) {
+                return {
+                    data: trace ? [unpackTrace(trace)] : [],
+                    layout: {
+                        xaxis: {
+                            title: xaxisColumnName,
+                            type: xaxisType === 'Linear' ? 'linear' : 'log'
+                        },
+                        yaxis: {
+                            title: yaxisColumnName,
+                            type: yaxisType === 'Linear' ? 'linear' : 'log'
+                        },
+                        margin: {l: 40, b: 40, t: 10, r: 0},
+                        hovermode: 'closest'
+                    }
+                };
+            },
+
+            update_point_count: function (ageValue, data) {
+                const category = data.categories[ageValue];
+                if (!category) {
+                    return 'Showing all 0 donors';
+                }
+                return category.text;
+            }
+        }
+    });
+})();
@@ -0,0 +1,1168 @@
+# Dash app factory for the donor barplot
+#
+# The figure is created in plotly, with Dash as a wrapper; see
+# visualize-donor-data-barplot.py for the origins of the figure code.
+#
+# `create_app(config)` builds the app without reading any data. The summary
+# table is loaded on the first callback (or by a warm-up thread), and modules
+# that import pandas are only imported by the loader, so creating the app (and
+# starting a worker) stays cheap.
+#
+# The traces and layouts are plain dicts in plotly's figure schema: building
+# graph_objs validates every property on assignment, which took most of the
+# figure build time. tests/test_barplot_app.py checks them against the schema.
+
+import logging
+import os
+import threading
+import time
+
+import dash
+import dash_core_components as dcc
+import dash_html_components as html
+from dash.dependencies import Input, Output
+
+import app_loading
+import cohort_filters
+import figure_encoding
+import http_caching
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+default_config = dict(
+    # './data/2019-07-17-aggregate-cgm-stats.csv.gz', or a columnar store converted from it with
+    # convert-donor-stats.py, which loads much faster
+    file_path=None,
+
+    # Derived frames are cached here, keyed by the file contents and the configuration
+    # (None: data_cache.default_cache_dir)
+    cache_dir=None,
+
+    #List of metrics to include
+    metrics=['Percent below 54'
+             , 'Percent in range (70-180)'
+             , 'Percent between 180-250'
+             , 'Percent above 250'
+             , 'Average'
+             , 'Standard Deviation'
+             , "Coefficient of Variation"
+             , "Glucose Management Index"
+             , "Percent below 40"
+             , "Percent below 70"
+             , "Percent above 140"
+             , "Percent above 180"
+             , "Percent above 300"
+             , "Percent above 400"
+             , 'Percent between 40-54'
+             , 'Percent between 54-70'
+             , 'Percent between 70-140'
+             , 'Percent between 250-400'
+             , 'Episodes < 40, Average Duration'
+             , 'Episodes < 54, Average Duration'
+             , 'Episodes < 70, Average Duration'],
+
+    #Groupings to summarize each metric by
+    groupings=['Age Category', 'Years Living With Category', 'Age and Years Living With Category'],
+
+    # Summarize with exact percentiles ('exact'), or with mergeable quantile sketches built in
+    # parallel over file chunks ('approximate'), which keeps memory bounded for very large files
+    summary_mode='exact',
+    sketch_rank_error=None,  # None: quantile_sketch.default_rank_error
+    summary_workers=os.cpu_count(),
+    # Rows per chunk read (None: ingest.default_chunk_size)
+    chunk_size=None,
+
+    # Memory budget of the process (bytes, or e.g. '4G'). Loading plans that would not fit are
+    # replaced with chunked ones (summary_mode 'approximate' instead of 'exact', fewer workers,
+    # smaller chunks); if even those do not fit, create_app raises a MemoryError. See memory_budget.py
+    max_memory=None,
+
+    # Log how far the approximate percentiles are from the exact ones (recomputes the exact table)
+    report_sketch_error=False,
+
+    # With summary_mode = 'incremental' the sketched cohort state is kept on disk, and files of new or
+    # updated donors dropped into delta_dir are folded in while the app is running (write them under
+    # a '.tmp' or '.part' name and rename them when complete; see incremental_summary.py)
+    incremental_state_dir=None,  # None: donor-stats-state next to the cache directory
+    delta_dir=None,
+    delta_check_seconds=10,
+
+    # Column identifying donors, so that a donor sent again in a delta replaces its earlier row
+    donor_key_column=None,
+
+    # Build only the selected metric's traces on the server (True), or ship every metric's
+    # traces to the browser and switch between them with plotly buttons (False)
+    use_callbacks=True,
+
+    # Serve the layout serialized and compressed (gzip, brotli) once, and give JSON responses
+    # content-hash ETags so that unchanged layouts are revalidated with an empty 304. The layout is
+    # compressed with warm_up (or see wsgi.py), or else in the background after the first request;
+    # layout_brotli_quality=None picks a lower quality for large layouts (see http_caching.py)
+    http_caching=True,
+    layout_brotli_quality=None,
+
+    # Keep every cohort's sorted metric values (exact summary mode only), so that the edges of the
+    # outer band can be picked with a slider and looked up per cohort instead of recomputed
+    band_control=True,
+
+    # Bootstrap confidence intervals of the cohort medians and band edges (exact summary mode only),
+    # drawn as error bars; 0 leaves them out. The default band's are computed when the summaries are
+    # built (under a second for every metric and grouping of 200k donors on one CPU at 1000 resamples)
+    # and the others once per band edge picked. See bootstrap.py
+    bootstrap_resamples=1000,
+    confidence_level=0.95,
+
+    # Multi-select filters of the donors by filter_dimensions (age bin, ylw bin, donor category, or any
+    # other categorical donor column); the summaries of a selection are rebuilt from its donors, found
+    # through bitmaps of the rows of every value (see cohort_bitmaps.py). Exact summary mode only
+    cohort_filters=False,
+    filter_dimensions=['Age Category', 'Years Living With Category', 'category'],
+
+    # Record latency histograms of the pipeline stages and callbacks (served at /metrics) and add
+    # Server-Timing headers to callback responses; see instrumentation.py
+    instrument=True,
+
+    # Load the data in a background thread as soon as the app is created
+    warm_up=False,
+)
+
+
+# Rename columns (with what want to show up on the graph)
+def get_column_names():
+    import ingest
+
+    return dict({'age': 'Age (Years)', 'ylw': 'Years Living With'}, **ingest.metric_catalog)
+
+
+def prepare_user_stats(user_stats_df):
+    user_stats_df["cv"] = 1 / user_stats_df["cv"]
+    return user_stats_df.rename(columns=get_column_names())
+
+
+def read_user_stats_chunks(file_path, config):
+    import ingest
+
+    # Read only the columns needed for the metrics, chunk by chunk, with compact dtypes
+    columns = [ingest.age_column, ingest.ylw_column] + ingest.get_raw_metric_columns(config['metrics'])
+    key_columns = [config['donor_key_column']] if config['donor_key_column'] else []
+    dimension_columns = get_dimension_columns(config)
+    chunks = ingest.read_chunks(file_path, columns + key_columns + dimension_columns,
+                                config['chunk_size'] or ingest.default_chunk_size,
+                                string_columns=key_columns, categorical_columns=dimension_columns)
+    chunks = (prepare_user_stats(chunk) for chunk in chunks)
+
+    #Add columns to metrics_df for age category and years living with category and age/years living with category (and their labels)
+    return ingest.add_cohorts(chunks, age_column='Age (Years)', ylw_column='Years Living With')
+
+
+@instrumentation.timed('barplot.read_user_stats')
+def read_user_stats(file_path, config):
+    import ingest
+
+    return ingest.concat_chunks(read_user_stats_chunks(file_path, config))
+
+
+def get_sketch_rank_error(config):
+    import quantile_sketch
+
+    return config['sketch_rank_error'] or quantile_sketch.default_rank_error
+
+
+def build_approximate_summary_frames(file_path, config):
+    import quantile_sketch
+    from summary_metrics import build_summary_metrics_table
+
+    # Sketch each chunk in a process pool; no donor level frame is kept
+    metrics = config['metrics']
+    summaries = quantile_sketch.summarize_chunks(read_user_stats_chunks(file_path, config), metrics,
+                                                 get_sketch_rank_error(config), config['summary_workers'])
+    summary_metrics_table = quantile_sketch.build_approximate_summary_metrics_table(summaries, metrics,
+                                                                                    config['groupings'])
+
+    if config['report_sketch_error']:
+        exact_table = build_summary_metrics_table(read_user_stats(file_path, config), metrics, config['groupings'])
+        logger.info("Sketch percentile error:\n%s",
+                    quantile_sketch.compare_summary_tables(summary_metrics_table, exact_table, metrics,
+                                                           config['groupings']).to_string())
+
+    return dict(summary_metrics_table=summary_metrics_table)
+
+
+@instrumentation.timed('barplot.build_summary_frames')
+def build_summary_frames(file_path, config):
+    from summary_metrics import build_summary_metrics_table
+
+    if config['summary_mode'] == 'approximate':
+        return build_approximate_summary_frames(file_path, config)
+
+    metrics = config['metrics']
+    groupings = config['groupings']
+    user_stats_df = read_user_stats(file_path, config)
+
+    #Summarize every metric for every grouping in one pass (one row per cohort)
+    frames = {}
+    with instrumentation.time_stage('barplot.summarize'):
+        if keeps_cohort_values(config):
+            summary_metrics_table, cohort_values = build_summary_metrics_table(user_stats_df, metrics, groupings,
+                                                                               keep_values=True)
+        else:
+            summary_metrics_table = build_summary_metrics_table(user_stats_df, metrics, groupings)
+
+    if config['bootstrap_resamples']:
+        import bootstrap
+
+        with instrumentation.time_stage('barplot.bootstrap'):
+            intervals = bootstrap.bootstrap_cohort_values(cohort_values, interval_percentiles,
+                                                          resamples=config['bootstrap_resamples'],
+                                                          confidence=config['confidence_level'],
+                                                          workers=config['summary_workers'])
+        summary_metrics_table = bootstrap.add_interval_columns(summary_metrics_table, intervals, interval_percentiles)
+    if config['band_control']:
+        frames.update(cohort_values.to_frames())
+
+    # Keep only the categorized columns the summaries are built from (and the cohort filters use)
+    columns = ['Age (Years)', 'Years Living With'] + groupings + ['Age', 'dAge (years since diagnosis)', 'Age & dAge']
+    columns += [column for column in get_dimension_columns(config) if column not in columns]
+    user_stats_df = user_stats_df[columns + metrics]
+
+    return dict(frames, user_stats_df=user_stats_df, summary_metrics_table=summary_metrics_table)
+
+
+def get_cache_config(config):
+    import cohorts
+
+    return dict(app='barplot',
+                metrics=config['metrics'],
+                groupings=config['groupings'],
+                age_bin_edges=cohorts.default_age_bin_edges,
+                ylw_bin_edges=cohorts.default_ylw_bin_edges,
+                summary_mode=config['summary_mode'],
+                sketch_rank_error=get_sketch_rank_error(config),
+                bootstrap_resamples=config['bootstrap_resamples'],
+                confidence_level=config['confidence_level'],
+                dimension_columns=get_dimension_columns(config))
+
+
+def apply_memory_budget(config):
+    """
+    Return `config` with a loading plan that fits in its `max_memory` budget (see memory_budget.py).
+
+    Raises MemoryError if even chunked ingestion cannot fit.
+    """
+    import data_cache
+    import ingest
+    import memory_budget
+
+    max_memory = memory_budget.parse_memory_size(config['max_memory'])
+    available = max_memory - instrumentation.get_rss()
+    cache_dir = config['cache_dir'] or data_cache.default_cache_dir
+    file_path = config['file_path']
+
+    # A cached summary table is all there is to load
+    if config['summary_mode'] != 'incremental' \
+            and data_cache.is_cached(file_path, get_cache_config(config), ['summary_metrics_table'], cache_dir):
+        return config
+
+    columns = 2 + len(config['metrics']) + len(get_dimension_columns(config))
+    rows = memory_budget.estimate_rows(file_path)
+    if config['summary_mode'] == 'exact':
+        needed = memory_budget.get_in_memory_bytes(rows, columns)
+        if keeps_cohort_values(config):
+            # The sorted float32 values of every metric for every grouping
+            needed += rows * len(config['metrics']) * len(config['groupings']) * 4
+        if needed <= available:
+            return config
+        logger.warning("Summarizing ~%s donors exactly needs ~%s, over the %s left of the memory budget; "
+                       "summarizing approximately, chunk by chunk", "{:,}".format(rows),
+                       instrumentation.format_bytes(needed), instrumentation.format_bytes(available))
+        # Keep no donor level frame, and do not re-read the whole file to report the sketch error
+        config = dict(config, summary_mode='approximate', report_sketch_error=False)
+        if data_cache.is_cached(file_path, get_cache_config(config), ['summary_metrics_table'], cache_dir):
+            return config
+
+    chunk_size = config['chunk_size'] or ingest.default_chunk_size
+    # Incremental mode applies the chunks in this process
+    workers = (config['summary_workers'] or 1) if config['summary_mode'] == 'approximate' else 1
+    planned_chunk_size, planned_workers = memory_budget.plan_chunks(available, columns, chunk_size, workers)
+    if (planned_chunk_size, planned_workers) != (chunk_size, workers):
+        logger.warning("Reading chunks of %s rows with %s summary workers to fit the memory budget",
+                       "{:,}".format(planned_chunk_size), planned_workers)
+    return dict(config, chunk_size=planned_chunk_size, summary_workers=planned_workers)
+
+
+def keeps_cohort_values(config):
+    # Sorted cohort values are kept for the band control and the bootstrap, in exact mode only
+    return bool(config['band_control'] or config['bootstrap_resamples']) and config['summary_mode'] == 'exact'
+
+
+def has_band_control(config):
+    return config['band_control'] and config['summary_mode'] == 'exact' and config['use_callbacks']
+
+
+def has_cohort_filters(config):
+    # Selections are summarized from the donor frame, which only exact mode keeps
+    return config['cohort_filters'] and config['summary_mode'] == 'exact' and config['use_callbacks']
+
+
+def get_dimension_columns(config):
+    # Donor columns read for the cohort filters (the age and ylw bins are cohort columns already)
+    import cohort_bitmaps
+
+    return cohort_bitmaps.get_categorical_columns(config['filter_dimensions']) if has_cohort_filters(config) else []
+
+
+# The cohort labels show the number of donors with this metric
+count_metric = 'Glucose Management Index'
+
+
+def place_value(number):
+    return ("{:,}".format(float(number)))
+
+
+@instrumentation.timed('barplot.format_summary_metrics_table')
+def format_summary_metrics_table(summary_metrics_table):
+    import cohorts
+
+    # Oldest cohorts first so they are drawn at the bottom of the y axis
+    summary_metrics_table = summary_metrics_table.iloc[::-1].reset_index(drop=True)
+
+    #Add Labels
+    summary_metrics_table = cohorts.add_cohort_labels(summary_metrics_table)
+    for label in ['Age', 'dAge (years since diagnosis)', 'Age & dAge']:
+        summary_metrics_table[label] = summary_metrics_table[label].astype(object)
+
+    count_column = count_metric + '.count'
+    summary_metrics_table[count_column] = summary_metrics_table[count_column].apply(place_value).astype(str).apply(lambda x: x.split('.')[0])
+
+    summary_metrics_table['Age'] = "<b>" + summary_metrics_table['Age'] + " </b><br>(n=" + summary_metrics_table[count_column].astype(str) +')'
+    summary_metrics_table['dAge (years since diagnosis)'] = "<b>" + summary_metrics_table['dAge (years since diagnosis)'] + "   </b><br>(n=" + summary_metrics_table[count_column].astype(str) +')'
+    summary_metrics_table['Age & dAge'] ="<b>" +  summary_metrics_table['Age & dAge'] + "   </b>    (n=" + summary_metrics_table[count_column].astype(str) +')'
+
+    # Round all values to two decimals
+    summary_metrics_table = summary_metrics_table.round(1)
+
+    return summary_metrics_table
+
+
+class BarplotData:
+    """
+    The formatted summary_metrics_table, kept up to date with applied deltas in incremental mode.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.summary_state = None
+        self.cohort_values = None  # summary_metrics.CohortValues, with the band control
+        self.donors = None  # the donor frame as a columnar.ColumnStore, with the cohort filters
+        self.cohort_index = None  # cohort_bitmaps.BitmapIndex of the donors, with the cohort filters
+        self.summary_metrics_table = format_summary_metrics_table(self.load_summary_metrics_table())
+        self.last_delta_check = time.time()
+        self._refresh_lock = threading.Lock()
+        # (metric, percentile) -> confidence intervals of the band edge in the formatted table rows
+        self._band_intervals = {}
+        self._band_intervals_lock = threading.Lock()
+
+    def read_chunks(self, file_path):
+        return read_user_stats_chunks(file_path, self.config)
+
+    def get_incremental_state_dir(self):
+        import data_cache
+
+        return self.config['incremental_state_dir'] or os.path.join(
+            os.path.dirname(self.config['cache_dir'] or data_cache.default_cache_dir), 'donor-stats-state')
+
+    def load_incremental_summary_metrics_table(self):
+        import incremental_summary
+        import quantile_sketch
+
+        metrics = self.config['metrics']
+        self.summary_state = incremental_summary.SummaryState.open(
+            self.get_incremental_state_dir(), metrics, get_sketch_rank_error(self.config),
+            self.config['donor_key_column'])
+        if self.summary_state.needs_seed:
+            # First start (or first with these settings): seed the state from the full file
+            self.summary_state.apply_chunks(self.read_chunks(self.config['file_path']))
+            self.summary_state.save()
+        incremental_summary.refresh_state(self.summary_state, self.config['delta_dir'], self.read_chunks)
+        return quantile_sketch.build_approximate_summary_metrics_table(self.summary_state.summaries, metrics,
+                                                                       self.config['groupings'])
+
+    def load_summary_metrics_table(self):
+        import data_cache
+
+        if self.config['summary_mode'] == 'incremental':
+            return self.load_incremental_summary_metrics_table()
+
+        from summary_metrics import CohortValues
+
+        file_path = self.config['file_path']
+        cache_config = get_cache_config(self.config)
+        cache_dir = self.config['cache_dir'] or data_cache.default_cache_dir
+
+        def build_frames(path):
+            return build_summary_frames(path, self.config)
+
+        names = ['summary_metrics_table'] + (['cohort_counts'] if has_band_control(self.config) else [])
+        frames = data_cache.load_or_build_frames(file_path, cache_config, build_frames, names, cache_dir=cache_dir)
+        # The sorted values and the donors are memory mapped: only the cohorts, metrics and donors looked up
+        # are paged in
+        store_names = (['cohort_values'] if has_band_control(self.config) else []) \
+            + (['user_stats_df'] if has_cohort_filters(self.config) else [])
+        if store_names:
+            stores = data_cache.load_or_build_frames(file_path, cache_config, build_frames, store_names,
+                                                     cache_dir=cache_dir, as_stores=True)
+        if has_band_control(self.config):
+            self.cohort_values = CohortValues.from_frames(stores['cohort_values'], frames['cohort_counts'])
+        if has_cohort_filters(self.config):
+            import cohort_bitmaps
+
+            self.donors = stores['user_stats_df']
+            self.cohort_index = cohort_bitmaps.BitmapIndex.from_frame(self.donors, self.config['filter_dimensions'])
+        return frames['summary_metrics_table']
+
+    def get_band_table(self, metric, band):
+        """
+        The summary table with the `metric` columns of the `band` percentiles (e.g. (5, 95)) added, as
+        `format_summary_metrics_table` would have them: an index lookup per cohort in the sorted values.
+        """
+        columns = [get_band_column(metric, edge) for edge in band]
+        if all(column in self.summary_metrics_table for column in columns):
+            return self.summary_metrics_table
+        # Rows are reversed and values rounded in the formatted table
+        with instrumentation.time_stage('barplot.band_percentiles'):
+            values = self.cohort_values.percentiles(metric, [edge / 100 for edge in band])[:, ::-1].round(1)
+        return self.summary_metrics_table.assign(**dict(zip(columns, values)))
+
+    def get_intervals(self, cohort_values, metric, percentiles):
+        # Bootstrap confidence intervals of percentiles of a metric in every cohort (row) of cohort_values
+        import bootstrap
+
+        with instrumentation.time_stage('barplot.bootstrap'):
+            return bootstrap.bootstrap_cohort_values(cohort_values, percentiles, [metric],
+                                                     self.config['bootstrap_resamples'],
+                                                     self.config['confidence_level'], workers=1)[metric]
+
+    def add_band_intervals(self, band_table, metric, band):
+        """
+        A `get_band_table` table with the confidence intervals of the `band` edges added (those it does not have yet).
+        """
+        import numpy as np
+
+        import bootstrap
+
+        percentiles = [edge / 100 for edge in band
+                       if bootstrap.get_interval_columns(metric, edge / 100)[1] not in band_table]
+        if not percentiles:
+            return band_table
+        intervals = np.stack([self.get_band_intervals(metric, percentile) for percentile in percentiles], axis=1)
+        return bootstrap.add_interval_columns(band_table, {metric: intervals}, percentiles)
+
+    def get_band_intervals(self, metric, percentile):
+        # The sorted values do not change once loaded, so each band edge is bootstrapped only the first time
+        # it is picked
+        key = metric, percentile
+        with self._band_intervals_lock:
+            if key not in self._band_intervals:
+                # Rows are reversed and values rounded in the formatted table
+                self._band_intervals[key] = self.get_intervals(self.cohort_values, metric,
+                                                               [percentile])[:, 0, ::-1].round(1)
+            return self._band_intervals[key]
+
+    def get_selection_table(self, metric, band, selection, combine, grouping):
+        """
+        The summary table of `metric` over the donors of a cohort selection (see `cohort_bitmaps.BitmapIndex.select`),
+        with the `band` percentiles and the confidence intervals, formatted as `add_band_intervals` returns it.
+
+        Only the cohorts of `grouping` are summarized; the rows of the other groupings are left out.
+        """
+        import bootstrap
+        from summary_metrics import build_summary_metrics_table, default_percentiles
+
+        # Only the selected donors' values of the metric (and of the metric the cohort sizes are labelled with)
+        # are read
+        metrics = [metric] + ([count_metric] if metric != count_metric else [])
+        with instrumentation.time_stage('barplot.select_donors'):
+            rows = self.cohort_index.select(selection, combine).to_rows()
+            donors = self.donors.take(rows, [grouping] + metrics)
+
+        percentiles = sorted(set(default_percentiles) | {edge / 100 for edge in band})
+        with instrumentation.time_stage('barplot.summarize_selection'):
+            summary_metrics_table = build_summary_metrics_table(donors, metrics, [grouping], percentiles,
+                                                                keep_values=bool(self.config['bootstrap_resamples']))
+        if self.config['bootstrap_resamples']:
+            summary_metrics_table, cohort_values = summary_metrics_table
+            interval_percentiles = [band[0] / 100, .5, band[1] / 100]
+            summary_metrics_table = bootstrap.add_interval_columns(
+                summary_metrics_table, {metric: self.get_intervals(cohort_values, metric, interval_percentiles)},
+                interval_percentiles)
+        # The labels are made from every grouping's codes
+        groupings = self.config['groupings']
+        summary_metrics_table = summary_metrics_table.reindex(
+            columns=groupings + [column for column in summary_metrics_table.columns if column not in groupings])
+        return format_summary_metrics_table(summary_metrics_table)
+
+    def refresh(self):
+        # Pick up applied deltas (incremental mode only), at most every delta_check_seconds
+        if self.config['summary_mode'] != 'incremental' \
+                or time.time() - self.last_delta_check < self.config['delta_check_seconds']:
+            return
+        import incremental_summary
+        import quantile_sketch
+
+        with self._refresh_lock:
+            self.last_delta_check = time.time()
+            if incremental_summary.refresh_state(self.summary_state, self.config['delta_dir'], self.read_chunks):
+                self.summary_metrics_table = format_summary_metrics_table(
+                    quantile_sketch.build_approximate_summary_metrics_table(self.summary_state.summaries,
+                                                                            self.config['metrics'],
+                                                                            self.config['groupings']))
+
+
+# Create Visualization
+
+# Metrics
+y_metrics = ['Age'
+    , 'dAge (years since diagnosis)'
+    , 'Age & dAge']
+
+# The grouping whose cohorts each y metric labels
+y_metric_groupings = {'Age': 'Age Category',
+                      'dAge (years since diagnosis)': 'Years Living With Category',
+                      'Age & dAge': 'Age and Years Living With Category'}
+
+x_metrics = ['Percent in range (70-180)'
+    , 'Percent below 54'
+    , "Percent below 70"
+    , "Percent above 180"
+    , 'Percent above 250'
+    , 'Average'
+    , 'Standard Deviation'
+             # , "Coefficient of Variation"
+    , "Glucose Management Index"
+    , "Percent below 40"
+    , "Percent above 140"
+    , "Percent above 300"
+    , "Percent above 400"
+    , 'Percent between 40-54'
+    , 'Percent between 54-70'
+    , 'Percent between 70-140'
+    , 'Percent between 180-250'
+    , 'Percent between 250-400'
+    , 'Episodes < 40, Average Duration'
+    , 'Episodes < 54, Average Duration'
+    , 'Episodes < 70, Average Duration']
+
+# Set values for x-axis max based on metrics
+x_axis_range = dict(zip(x_metrics,
+                        [(0, 105)
+                            , (0, 3.1)
+                            , (0, 10.1)
+                            , (0, 105)
+                            , (0, 105)
+                            , (99, 241)
+                            , (0, 105)
+                         # , (0, 10.1)
+                            , (4, 10.1)
+                            , (0, 1.1)
+                            , (0, 105)
+                            , (0, 32)
+                            , (0, 4.1)
+                            , (0, 5.1)
+                            , (0, 10.1)
+                            , (0, 105)
+                            , (0, 61)
+                            , (0, 61)
+                            , (0, 40.1)
+                            , (0, 40.1)
+                            , (0, 62)]))
+
+# Set values for x-axis max based on metrics
+x_axis_label = dict(zip(x_metrics,
+                        ['Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'mg/dl'
+                            , 'mg/dl'
+                         # , ''
+                            , ''
+                            , 'Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'Percent of Time (%)'
+                            , 'Minutes'
+                            , 'Minutes'
+                            , 'Minutes']))
+
+# Starting Metrics (i.e. which metrics are pre-selected)
+y_starting_metric = 'Age'
+x_starting_metric = 'Percent in range (70-180)'
+
+# Move starting metrics to beginning of list
+y_metrics.insert(0, y_metrics.pop(y_metrics.index(y_starting_metric)))
+x_metrics.insert(0, x_metrics.pop(x_metrics.index(x_starting_metric)))
+
+# Dimensions
+graph_width = 1000
+graph_height = 550
+
+# Colors
+median_dot_color = '#9886cf'
+color_iqr = "#ccc3e8"
+color_10_to_90 = '#e6e2f4'
+
+# Percentiles of the outer band's edges, and the band slider's marks (the inner band is 25-75)
+default_band = (10, 90)
+band_marks = [0, 2.5, 5, 10, 25, 75, 90, 95, 97.5, 100]
+
+# Percentiles whose confidence intervals are computed with the summaries: the median and the default band edges
+interval_percentiles = [default_band[0] / 100, .5, default_band[1] / 100]
+interval_color = '#5a5a5a'
+color_min_max = '#f6f3fb'
+background_color = 'white'
+
+# Font
+font_color = "#281946"
+font_name = 'Raleway'
+font_size = 14
+
+# Median Dot Size
+median_dot_sizes = [17, 21, 4]
+
+width = [.3, .25, .3]
+starting_width = width[0]
+
+
+#### Create Helper Functions ####
+def get_visibility(metric):
+    if metric == x_starting_metric:
+        return True
+    else:
+        return False
+
+
+# def create_min(summary_metrics_table, metric):
+#     bar_trace = go.Bar(
+#       showlegend = False,
+#       visible = get_visibility(metric),
+#       x = summary_metrics_table[metric + ".min"],
+#       y = summary_metrics_table[y_starting_metric],
+#       hoverinfo="skip",
+#       orientation = 'h',
+#       width = starting_width,
+#       textposition = 'inside',
+#       marker = dict(
+#          color='white'
+#       ),
+#       opacity=0
+#     )
+#     bar_trace.yaxis = "y"
+#     bar_trace.xaxis = "x"
+#     return bar_trace
+
+def get_band_column(metric, edge):
+    # The summary table column of a percentile, e.g. 'Average.2.5%'
+    return "{}.{:g}%".format(metric, edge)
+
+
+def create_10(summary_metrics_table, metric, band=default_band):
+    bar_trace = dict(
+        type='bar',
+        showlegend=False,
+        name="100% of Data",
+        legendgroup="legend2",
+        visible=get_visibility(metric),
+        x=summary_metrics_table[get_band_column(metric, band[0])],
+        y=summary_metrics_table[y_starting_metric],
+        hoverinfo='skip',
+        orientation='h',
+        width=starting_width,
+        textposition='inside',
+        marker=dict(
+            color='white'
+        ),
+        opacity=0
+    )
+    bar_trace["yaxis"] = "y"
+    bar_trace["xaxis"] = "x"
+    return bar_trace
+
+
+def create_25(summary_metrics_table, metric, band=default_band):
+    bar_trace = dict(
+        type='bar',
+        showlegend=True,
+        legendgroup="legend2",
+        name="{:g}% of Data".format(band[1] - band[0]),
+        visible=get_visibility(metric),
+        x=summary_metrics_table[metric + ".25%"] - summary_metrics_table[get_band_column(metric, band[0])],
+        y=summary_metrics_table[y_starting_metric],
+        hoverinfo="skip",
+        orientation='h',
+        width=starting_width,
+        textposition='inside',
+        marker=dict(
+            color=color_10_to_90
+        )
+    )
+    bar_trace["yaxis"] = "y"
+    bar_trace["xaxis"] = "x"
+    return bar_trace
+
+
+def get_interval_error_bars(summary_metrics_table, metric, percentile, thickness):
+    # Error bars from a percentile to the ends of its confidence interval, if the table has it
+    import bootstrap
+
+    low, high = bootstrap.get_interval_columns(metric, percentile)
+    if high not in summary_metrics_table:
+        return None
+    values = summary_metrics_table["{}.{:g}%".format(metric, 100 * percentile)]
+    return dict(
+        type='data',
+        symmetric=False,
+        array=summary_metrics_table[high] - values,
+        arrayminus=values - summary_metrics_table[low],
+        color=interval_color,
+        thickness=thickness,
+        width=3
+    )
+
+
+def create_median(summary_metrics_table, metric, band=default_band):
+    scatter_trace = dict(
+        type='scatter',
+        legendgroup="legend1",
+        name="Median",
+        showlegend=True,
+        visible=get_visibility(metric),
+        x=summary_metrics_table[metric + ".50%"],
+        y=summary_metrics_table[y_starting_metric],
+        hoverinfo="x",
+        mode='markers',
+        marker=dict(
+            color=median_dot_color,
+            size=median_dot_sizes[0],
+            symbol='square',
+        )
+    )
+    error_bars = get_interval_error_bars(summary_metrics_table, metric, .5, thickness=1.5)
+    if error_bars is not None:
+        scatter_trace['error_x'] = error_bars
+    scatter_trace["yaxis"] = "y"
+    scatter_trace["xaxis"] = "x"
+    return scatter_trace
+
+
+def create_band_edge(summary_metrics_table, metric, edge):
+    # Invisible markers at an outer band edge, carrying the edge's confidence interval as error bars
+    scatter_trace = dict(
+        type='scatter',
+        showlegend=False,
+        visible=get_visibility(metric),
+        x=summary_metrics_table[get_band_column(metric, edge)],
+        y=summary_metrics_table[y_starting_metric],
+        hoverinfo='skip',
+        mode='markers',
+        marker=dict(
+            color=interval_color,
+            opacity=0
+        ),
+        error_x=get_interval_error_bars(summary_metrics_table, metric, edge / 100, thickness=1)
+    )
+    scatter_trace["yaxis"] = "y"
+    scatter_trace["xaxis"] = "x"
+    return scatter_trace
+
+
+def create_75(summary_metrics_table, metric, band=default_band):
+    bar_trace = dict(
+        type='bar',
+        legendgroup="legend2",
+        name="50% of Data",
+        showlegend=True,
+        visible=get_visibility(metric),
+        x=summary_metrics_table[metric + ".75%"] - summary_metrics_table[metric + ".25%"],
+        y=summary_metrics_table[y_starting_metric],
+        hoverinfo="skip",
+        orientation='h',
+        width=starting_width,
+        textposition='inside',
+        marker=dict(
+            color=color_iqr
+        )
+    )
+    bar_trace["yaxis"] = "y"
+    bar_trace["xaxis"] = "x"
+    return bar_trace
+
+
+def create_90(summary_metrics_table, metric, band=default_band):
+    bar_trace = dict(
+        type='bar',
+        legendgroup="legend2",
+        name="75%-{:g}%".format(band[1]),
+        showlegend=False,
+        visible=get_visibility(metric),
+        x=summary_metrics_table[get_band_column(metric, band[1])] - summary_metrics_table[metric + ".75%"],
+        y=summary_metrics_table[y_starting_metric],
+        hoverinfo="skip",
+        orientation='h',
+        width=starting_width,
+        textposition='inside',
+        marker=dict(
+            color=color_10_to_90
+        )
+    )
+    bar_trace["yaxis"] = "y"
+    bar_trace["xaxis"] = "x"
+    return bar_trace
+
+
+# def create_max(summary_metrics_table, metric):
+#     bar_trace=go.Bar(
+#       legendgroup= "legend2",
+#       name = "100% of Data",
+#       showlegend=False,
+#       visible= get_visibility(metric),
+#       x = summary_metrics_table[metric+ ".max"] - summary_metrics_table[metric+ ".90%"],
+#       y = summary_metrics_table[y_starting_metric],
+#       hoverinfo="skip",
+#       orientation = 'h',
+#       width = starting_width,
+#       textposition = 'inside',
+#       marker = dict(
+#                 color = color_min_max
+#       )
+#     )
+#     bar_trace.yaxis = "y"
+#     bar_trace.xaxis = "x"
+#     return bar_trace
+
+
+# One trace per builder is drawn for the selected metric, in this (stacking) order; the builders
+# take the outer band's percentiles, whose columns must be in the table (see BarplotData.get_band_table)
+trace_builders = [create_10, create_25, create_75, create_90, create_median]
+
+
+@instrumentation.timed('barplot.create_traces')
+def create_traces(summary_metrics_table, x_metric, y_metric, band=default_band):
+    # Build only the traces for the selected x and y metrics
+    y_index = y_metrics.index(y_metric)
+    traces = [create_trace(summary_metrics_table, x_metric, band) for create_trace in trace_builders]
+    # Confidence intervals of the band edges, when they are in the table
+    traces += [create_band_edge(summary_metrics_table, x_metric, edge) for edge in band
+               if get_interval_error_bars(summary_metrics_table, x_metric, edge / 100, thickness=1) is not None]
+    for trace in traces:
+        trace['visible'] = True
+        trace['y'] = summary_metrics_table[y_metric]
+        if trace['type'] == 'bar':
+            trace['width'] = width[y_index]
+        else:
+            trace['marker']['size'] = median_dot_sizes[y_index]
+    return traces
+
+
+def get_x_axis_attributes(metric):
+    attributes = dict(rangemode='tozero',
+                      range=x_axis_range[metric],
+                      tickfont=dict(family=font_name, size=font_size, color=font_color),
+                      showgrid=True,
+                      gridwidth=1.5,
+                      gridcolor="#EDEDED",
+                      domain=[0, 1],
+                      zeroline=True,
+                      title=x_axis_label[metric],
+                      showline=False,
+                      zerolinecolor="#EDEDED",
+                      zerolinewidth=1.5,
+                      ticks='',
+                      showticklabels=True,
+                      side='bottom'
+                      )
+    return attributes
+
+
+def get_y_axis_attributes(domain_start, domain_end):
+    attributes = dict(
+        tickfont=dict(family=font_name, size=font_size, color=font_color),
+        domain=[domain_start, domain_end],
+        autorange=True,
+        showgrid=False,
+        zeroline=False,
+        showline=False,
+        ticks='',
+        showticklabels=True,
+        overlaying="y"
+    )
+    return attributes
+
+
+def create_x_button(metric):
+    visibility_list = [False] * (len(x_metrics))
+    true_index = x_metrics.index(metric)
+    visibility_list[true_index] = True
+    button = dict(label=metric,
+                  method='update',
+                  args=[{'visible': visibility_list * len(trace_builders)},
+                        {"xaxis": get_x_axis_attributes(metric)}])
+    return button
+
+
+def create_y_button(summary_metrics_table, metric, marker_size, width):
+    # print([summary_metrics_table[metric]])
+    button = dict(args=[{"y": [summary_metrics_table[metric]], "marker.size": marker_size, "width": width}],
+                  label=metric,
+                  method='restyle'
+                  )
+    return button
+
+
+def create_layout(x_metric):
+    layout = dict(
+        title=dict(
+            text="CGM Distributions",
+            x=.6,
+            y=.85,
+        ),
+        # yaxis_title="Years", #I think this looked cluttered, but could add back in as needed
+        width=graph_width,
+        font=dict(family='Raleway', size=font_size, color=font_color),
+        # Nunito is what is used on Tidepool website; this is close
+        height=graph_height,
+        margin=dict(
+            pad=20
+        ),
+        autosize=False,
+        barmode='stack',
+        dragmode=False,
+        legend=dict(
+            x=1.1,
+            y=.8,
+            traceorder="reversed",
+            font=dict(
+                family="Raleway",
+                size=12,
+                color="black"
+            ),
+            bgcolor="white",
+            bordercolor="white",
+            borderwidth=2
+        ),
+        plot_bgcolor=background_color,
+        xaxis=dict(get_x_axis_attributes(x_metric), title=dict(text=x_axis_label[x_metric])),
+        yaxis=get_y_axis_attributes(0, .8),
+        yaxis2=get_y_axis_attributes(0, .8)
+    )
+    return layout
+
+
+@instrumentation.timed('barplot.create_static_figure')
+def create_static_figure(summary_metrics_table):
+    # Every metric's traces, switched between with plotly buttons
+    traces = []
+    x_buttons = []
+    y_buttons = []
+
+    #### Create Buttons ####
+
+    # y buttons
+    for index in range(0, len(y_metrics)):
+        y_buttons.append(create_y_button(summary_metrics_table, y_metrics[index], median_dot_sizes[index],
+                                         width[index]))
+
+    # x buttons
+    for metric in x_metrics:
+        x_buttons.append(create_x_button(metric))
+
+    #### Add Traces for Various Elements ####
+
+    # Min bar
+    # for metric in x_metrics:
+    #   traces.append(create_min(summary_metrics_table, metric))
+
+    # 10% bar
+    for metric in x_metrics:
+        traces.append(create_10(summary_metrics_table, metric))
+
+    # 25% bar
+    for metric in x_metrics:
+        traces.append(create_25(summary_metrics_table, metric))
+
+    # 75% bar
+    for metric in x_metrics:
+        traces.append(create_75(summary_metrics_table, metric))
+
+    # 90% bar
+    for metric in x_metrics:
+        traces.append(create_90(summary_metrics_table, metric))
+
+    #  #for metric in x_metrics:
+    # for metric in x_metrics:
+    #   traces.append(create_max(summary_metrics_table, metric))
+
+    # Median Point
+    for metric in x_metrics:
+        traces.append(create_median(summary_metrics_table, metric))
+
+    #### Create Update Menus ####
+    updatemenus = list([
+        dict(
+            active=0,
+            buttons=y_buttons,
+            direction='down',
+            pad={'r': 8, 't': 10},
+            showactive=True,
+            x=-.7,
+            xanchor='left',
+            y=.5,
+            yanchor='top'
+        ),
+        dict(
+            active=0,
+            buttons=x_buttons,
+            direction='down',
+            pad={'r': 0, 't': 0},
+            showactive=True,
+            x=0.29,
+            xanchor='left',
+            y=.96,
+            yanchor='top'
+        ),
+    ])
+
+    layout = create_layout(x_starting_metric)
+    layout['updatemenus'] = updatemenus
+
+    #### Plot Figures ####
+    return dict(data=traces, layout=layout)
+
+
+def create_app(config=None):
+    """
+    Create the barplot app for `config` (see `default_config`) without loading any data.
+
+    The summary table is loaded by the first request that needs it, or in the
+    background right away if `warm_up` is set; `app.data.get()` returns it. With a
+    `max_memory` budget the loading plan is fitted to it first (the file's size is
+    projected from its first rows), and a MemoryError is raised if it cannot fit.
+    """
+    start_time = time.perf_counter()
+    config = dict(default_config, **(config or {}))
+    if config['max_memory']:
+        config = apply_memory_budget(config)
+
+    app = dash.Dash(__name__, suppress_callback_exceptions=True)
+    app.data = app_loading.LazyData('barplot', lambda: BarplotData(config))
+
+    if config['use_callbacks']:
+        # Edges of the outer band, looked up per cohort from the sorted values (exact mode)
+        band_slider = [html.Div([
+            html.Label("Outer band (percentiles)"),
+            dcc.RangeSlider(
+                id='band',
+                min=0,
+                max=100,
+                step=0.5,
+                value=list(default_band),
+                marks={edge: '{:g}'.format(edge) for edge in band_marks},
+                allowCross=False
+            )
+        ], style={'width': '70%', 'margin-top': '20px'})] if has_band_control(config) else []
+
+        #### Create Dropdowns ####
+        def create_callback_layout():
+            # The options of the cohort filters come from the donors, so with them the layout waits for the data
+            filter_controls = [cohort_filters.create_filter_controls(app.data.get().cohort_index)] \
+                if has_cohort_filters(config) else []
+            return html.Div([
+                html.Div([
+                    dcc.Dropdown(
+                        id='y-metric',
+                        options=[{'label': metric, 'value': metric} for metric in y_metrics],
+                        value=y_starting_metric,
+                        clearable=False
+                    )
+                ], style={'width': '25%', 'display': 'inline-block'}),
+                html.Div([
+                    dcc.Dropdown(
+                        id='x-metric',
+                        options=[{'label': metric, 'value': metric} for metric in x_metrics],
+                        value=x_starting_metric,
+                        clearable=False
+                    )
+                ], style={'width': '40%', 'display': 'inline-block', 'margin-left': '5%'}),
+            ] + band_slider + filter_controls + [
+                dcc.Graph(id='barplot')
+            ])
+
+        app.layout = create_callback_layout if has_cohort_filters(config) else create_callback_layout()
+
+        inputs = [Input('x-metric', 'value'), Input('y-metric', 'value')]
+        if has_band_control(config):
+            inputs.append(Input('band', 'value'))
+        if has_cohort_filters(config):
+            inputs += cohort_filters.get_filter_inputs(config['filter_dimensions'])
+
+        def update_barplot(x_metric, y_metric, band, *filter_values):
+            # filter_values: the filters' combine mode and values, with the cohort filters
+            data = app.data.get()
+            data.refresh()
+            # The outer band always contains the inner (25-75) one
+            band = (min(band[0], 25), max(band[1], 75))
+            if has_cohort_filters(config):
+                selection, combine = cohort_filters.get_selection(config['filter_dimensions'], *filter_values)
+            else:
+                selection, combine = {}, 'and'
+            # Summaries of a cohort selection are rebuilt from its donors; otherwise the band edges are looked
+            # up in the sorted values, and only their confidence intervals (if any) are computed
+            if selection:
+                summary_metrics_table = data.get_selection_table(x_metric, band, selection, combine,
+                                                                 y_metric_groupings[y_metric])
+            else:
+                summary_metrics_table = data.get_band_table(x_metric, band)
+                if config['bootstrap_resamples']:
+                    summary_metrics_table = data.add_band_intervals(summary_metrics_table, x_metric, band)
+            return dict(data=create_traces(summary_metrics_table, x_metric, y_metric, band),
+                        layout=create_layout(x_metric))
+
+        if has_band_control(config):
+            figure_encoding.register_callback(app, Output('barplot', 'figure'), inputs)(update_barplot)
+        else:
+            # Without the band control the band is the default one
+            @figure_encoding.register_callback(app, Output('barplot', 'figure'), inputs)
+            def update_default_band_barplot(x_metric, y_metric, *filter_values):
+                return update_barplot(x_metric, y_metric, default_band, *filter_values)
+
+    else:
+        figures = []
+
+        def serve_layout():
+            if not figures:
+                figures.append(create_static_figure(app.data.get().summary_metrics_table))
+            return html.Div([
+                dcc.Graph(figure=figures[0])
+            ])
+
+        app.layout = serve_layout
+
+    # The layout is fixed once the data is loaded: serve it serialized and compressed once
+    app.precompressed_layout = http_caching.precompress_layout(app, 'barplot', config['layout_brotli_quality']) \
+        if config['http_caching'] else None
+    if config['http_caching']:
+        http_caching.add_etags(app.server)
+
+    if config['instrument']:
+        instrumentation.instrument_app(app, label_inputs={'barplot.figure': ['x-metric', 'y-metric']})
+
+    app_loading.report_startup('barplot', start_time)
+    if config['warm_up']:
+        (app.precompressed_layout or app.data).warm_up()
+    return app
@@ -0,0 +1,236 @@
+# Benchmarks of the donor visualizations on synthetic data
+#
+# Usage: python benchmark.py [--donors 10000 100000 ...] [--output results.json] [--baseline previous.json]
+#
+# Each pipeline stage of both apps (reading, binning, summarizing, building and
+# encoding figures, loading the app data, serving the layout and callbacks) is
+# timed on synthetic files of each size (see synthetic_donor_stats.py; files are
+# written once and reused). Every app and size runs in a fresh process, so the
+# peak RSS recorded after each stage belongs to that run only. The results are
+# written as JSON; with --baseline, stages that got slower (or payloads that got
+# larger) than a previous run by more than --tolerance are reported, and the
+# exit status is 1.
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import synthetic_donor_stats
+from instrumentation import get_peak_rss
+
+default_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'data', '.interim', 'synthetic-donor-stats')
+default_tolerance = 0.2
+# Stages this much slower or less are timing noise, whatever the ratio
+default_min_slowdown_seconds = 0.05
+
+
+class StageTimer:
+    """
+    Records the time, peak RSS and (optionally) payload size of each stage of a run.
+    """
+
+    def __init__(self, app_name, donors):
+        self.app_name = app_name
+        self.donors = donors
+        self.results = []
+
+    @contextlib.contextmanager
+    def stage(self, name, calls=1):
+        # The block can set record['payload_bytes']; seconds and payload bytes are per call
+        record = dict(app=self.app_name, donors=self.donors, stage=name, calls=calls)
+        start_time = time.perf_counter()
+        yield record
+        record['seconds'] = (time.perf_counter() - start_time) / calls
+        if 'payload_bytes' in record:
+            record['payload_bytes'] //= calls
+        record['peak_rss_bytes'] = get_peak_rss()
+        self.results.append(record)
+        print("{app} ({donors:,} donors) {stage}: {seconds:.4f}s".format(**record))
+
+
+def post_callback(client, output, inputs):
+    """Request a Dash callback through a Flask test client; `inputs` are (id, property, value)."""
+    component_id, component_property = output.split('.')
+    body = dict(output=output, outputs=dict(id=component_id, property=component_property), changedPropIds=[],
+                inputs=[dict(id=input_id, property=input_property, value=value)
+                        for input_id, input_property, value in inputs])
+    response = client.post('/_dash-update-component', json=body)
+    assert response.status_code == 200, response.status_code
+    return response
+
+
+def benchmark_barplot(file_path, donors, cache_dir):
+    import barplot_app
+    import cohorts
+    import figure_encoding
+    import ingest
+    from summary_metrics import build_summary_metrics_table
+
+    config = dict(file_path=file_path, cache_dir=cache_dir)
+    metrics = barplot_app.default_config['metrics']
+    timer = StageTimer('barplot', donors)
+
+    with timer.stage('read'):
+        columns = [ingest.age_column, ingest.ylw_column] + ingest.get_raw_metric_columns(metrics)
+        user_stats_df = ingest.concat_chunks(ingest.read_chunks(file_path, columns))
+    with timer.stage('bin'):
+        user_stats_df = cohorts.add_cohort_columns(barplot_app.prepare_user_stats(user_stats_df),
+                                                   age_column='Age (Years)', ylw_column='Years Living With')
+    with timer.stage('summarize'):
+        summary_metrics_table = build_summary_metrics_table(user_stats_df, metrics,
+                                                            barplot_app.default_config['groupings'])
+    del user_stats_df
+    with timer.stage('format'):
+        summary_metrics_table = barplot_app.format_summary_metrics_table(summary_metrics_table)
+    with timer.stage('build static figure'):
+        figure = barplot_app.create_static_figure(summary_metrics_table)
+    with timer.stage('encode static figure') as record:
+        record['payload_bytes'] = len(figure_encoding.dumps(figure))
+
+    with timer.stage('load app data (cold cache)'):
+        barplot_app.create_app(config).data.get()
+    with timer.stage('load app data (warm cache)'):
+        app = barplot_app.create_app(config)
+        app.data.get()
+
+    client = app.server.test_client()
+    with timer.stage('layout') as record:
+        record['payload_bytes'] = len(client.get('/_dash-layout').data)
+    client.get('/_dash-dependencies')
+    with timer.stage('callback', calls=len(barplot_app.x_metrics)) as record:
+        record['payload_bytes'] = sum(len(post_callback(client, 'barplot.figure',
+                                                        [('x-metric', 'value', x_metric),
+                                                         ('y-metric', 'value', barplot_app.y_starting_metric),
+                                                         ('band', 'value', list(barplot_app.default_band))]).data)
+                                      for x_metric in barplot_app.x_metrics)
+    return timer.results
+
+
+def benchmark_scatterplot(file_path, donors, cache_dir):
+    import scatterplot_app
+
+    # Server callbacks without memoization, so that every callback does the work
+    config = dict(file_path=file_path, cache_dir=cache_dir, callback_mode='server', figure_cache_bytes=0)
+    timer = StageTimer('scatterplot', donors)
+
+    with timer.stage('read and format'):
+        scatterplot_app.read_and_format_data(file_path, scatterplot_app.default_config['category'])
+
+    with timer.stage('load app data (cold cache)'):
+        scatterplot_app.create_app(config).data.get()
+    with timer.stage('load app data (warm cache)'):
+        app = scatterplot_app.create_app(config)
+        data = app.data.get()
+
+    client = app.server.test_client()
+    with timer.stage('layout') as record:
+        record['payload_bytes'] = len(client.get('/_dash-layout').data)
+    client.get('/_dash-dependencies')
+    age_categories = [age_category for age_category, rows in data.age_slices.items() if rows.stop > rows.start]
+    with timer.stage('callback', calls=len(age_categories)) as record:
+        record['payload_bytes'] = sum(len(post_callback(client, 'scatter-trace.data',
+                                                        [('xaxis-column', 'value', 'mean'),
+                                                         ('yaxis-column', 'value', 'gmi'),
+                                                         ('age--slider', 'value', int(age_category)),
+                                                         ('density-axes', 'data', None)]).data)
+                                      for age_category in age_categories)
+    return timer.results
+
+
+app_benchmarks = dict(barplot=benchmark_barplot, scatterplot=benchmark_scatterplot)
+
+
+def run_benchmark(app_name, file_path, donors):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        return app_benchmarks[app_name](file_path, donors, cache_dir)
+
+
+def get_environment():
+    import numpy as np
+    import pandas as pd
+
+    return dict(python=platform.python_version(), platform=platform.platform(), processor=platform.processor(),
+                cpu_count=os.cpu_count(), numpy=np.__version__, pandas=pd.__version__)
+
+
+def run_benchmarks(donor_counts, app_names=tuple(app_benchmarks), data_dir=default_data_dir,
+                   seed=synthetic_donor_stats.default_seed):
+    """
+    Benchmark `app_names` on synthetic files of each of `donor_counts` donors, each run in a fresh process.
+
+    Returns
+    -------
+    dict
+        environment (versions and machine) and results (one record per app, file size and stage)
+    """
+    results = []
+    for donors in donor_counts:
+        start_time = time.perf_counter()
+        file_path = synthetic_donor_stats.get_donor_stats_file(data_dir, donors, seed)
+        print("Synthetic file of {:,} donors ready in {:.2f}s".format(donors, time.perf_counter() - start_time))
+        for app_name in app_names:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                results += pool.submit(run_benchmark, app_name, file_path, donors).result()
+    return dict(environment=get_environment(), seed=seed, results=results)
+
+
+def compare_results(baseline, current, tolerance=default_tolerance,
+                    min_slowdown_seconds=default_min_slowdown_seconds):
+    """
+    Match the records of two runs by (app, donors, stage) and flag regressions beyond `tolerance`.
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per stage in both runs, with the time and payload ratios (current / baseline)
+    """
+    import pandas as pd
+
+    keys = ['app', 'donors', 'stage']
+    comparison = pd.merge(pd.DataFrame(baseline['results']), pd.DataFrame(current['results']), on=keys,
+                          suffixes=('_baseline', ''))
+    comparison['seconds_ratio'] = comparison['seconds'] / comparison['seconds_baseline']
+    if 'payload_bytes' in comparison:
+        comparison['payload_ratio'] = comparison['payload_bytes'] / comparison['payload_bytes_baseline']
+    else:
+        comparison['payload_ratio'] = float('nan')
+    slower = ((comparison['seconds_ratio'] > 1 + tolerance)
+              & (comparison['seconds'] - comparison['seconds_baseline'] > min_slowdown_seconds))
+    comparison['regression'] = slower | (comparison['payload_ratio'] > 1 + tolerance)
+    return comparison[keys + ['seconds_baseline', 'seconds', 'seconds_ratio', 'payload_ratio', 'regression']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the donor visualizations on synthetic data")
+    parser.add_argument('--donors', type=int, nargs='+', default=synthetic_donor_stats.default_donor_counts)
+    parser.add_argument('--apps', nargs='+', choices=list(app_benchmarks), default=list(app_benchmarks))
+    parser.add_argument('--data-dir', default=default_data_dir)
+    parser.add_argument('--seed', type=int, default=synthetic_donor_stats.default_seed)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help="results of a previous run to compare with")
+    parser.add_argument('--tolerance', type=float, default=default_tolerance)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.donors, args.apps, args.data_dir, args.seed)
+    with open(args.output, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print("Wrote {}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            comparison = compare_results(json.load(baseline_file), results, args.tolerance)
+        print(comparison.to_string(index=False))
+        if comparison['regression'].any():
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
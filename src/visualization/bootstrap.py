@@ -0,0 +1,153 @@
+# Bootstrap confidence intervals of cohort percentiles
+#
+# Intervals are percentile-bootstrap intervals of the `describe` percentiles
+# (e.g. the median) of every cohort and metric, computed from the sorted cohort
+# values kept by `summary_metrics.CohortValues`. Because a cohort's values are
+# sorted, the resamples are vectorized two ways:
+#
+# - small cohorts: a (resamples x n) matrix of random indices into the sorted
+#   values, sorted along its rows, is a batch of sorted resamples, so each
+#   percentile is read off at fixed index columns;
+# - large cohorts, where the index matrix would be too big: the k-th smallest
+#   of n uniform draws is Beta(k, n - k + 1) distributed, and the k-th smallest
+#   resampled value is the sorted value at floor(n U) for that draw U, so the
+#   two order statistics a percentile interpolates between are drawn directly,
+#   the next one as U + (1 - U) Beta(1, n - k). That is O(resamples) per
+#   percentile whatever the cohort size, and follows the same distribution.
+#
+# Metrics are spread over a process pool.
+
+import concurrent.futures
+import os
+
+import numpy as np
+import pandas as pd
+
+from summary_metrics import percentile_label
+
+default_resamples = 2000
+default_confidence = 0.95
+# Cohorts up to this size are resampled with index matrices
+index_matrix_max_size = 512
+# Elements per index matrix batch
+index_batch_size = 2 ** 22
+
+
+def get_interval_columns(metric, percentile):
+    """The summary table columns of the confidence interval of a percentile, e.g. 'Average.50% CI low'."""
+    label = "{}.{}".format(metric, percentile_label(percentile))
+    return label + ' CI low', label + ' CI high'
+
+
+def resample_sorted_percentiles(sorted_values, percentiles, resamples, random_state):
+    """
+    Bootstrap distribution of percentiles (in [0, 1]) of a cohort's sorted, NaN-free values.
+
+    Returns an array of shape (resamples, len(percentiles)), interpolated as `describe` does.
+    """
+    n = len(sorted_values)
+    if n == 0:
+        return np.full((resamples, len(percentiles)), np.nan)
+    positions = np.asarray(percentiles, dtype=float) * (n - 1)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, n - 1)
+    fraction = positions - lower
+
+    if n <= index_matrix_max_size:
+        lower_indices = np.empty((resamples, len(percentiles)), dtype=np.int64)
+        upper_indices = np.empty((resamples, len(percentiles)), dtype=np.int64)
+        batch = max(index_batch_size // n, 1)
+        for start in range(0, resamples, batch):
+            indices = random_state.randint(0, n, size=(min(batch, resamples - start), n))
+            indices.sort(axis=1)
+            lower_indices[start:start + batch] = indices[:, lower]
+            upper_indices[start:start + batch] = indices[:, upper]
+    else:
+        # Order statistics k = lower + 1 and k + 1 of n uniform draws, for every percentile
+        k = lower + 1
+        lower_uniform = random_state.beta(k, n - k + 1, size=(resamples, len(percentiles)))
+        gap = random_state.beta(1, np.maximum(n - k, 1), size=(resamples, len(percentiles)))
+        upper_uniform = np.where(upper > lower, lower_uniform + (1 - lower_uniform) * gap, lower_uniform)
+        lower_indices = np.minimum((n * lower_uniform).astype(np.int64), n - 1)
+        upper_indices = np.minimum((n * upper_uniform).astype(np.int64), n - 1)
+
+    lower_values = sorted_values[lower_indices]
+    return lower_values + (sorted_values[upper_indices] - lower_values) * fraction
+
+
+def bootstrap_metric(values, starts, counts, percentiles, resamples=default_resamples,
+                     confidence=default_confidence, seed=0):
+    """
+    Confidence intervals of `percentiles` of one metric in every cohort.
+
+    `values`, `starts` and `counts` are one metric's `summary_metrics.CohortValues` arrays.
+    Returns an array of shape (2, len(percentiles), cohorts): the low and high ends, NaN for empty cohorts.
+    """
+    random_state = np.random.RandomState(seed)
+    alpha = (1 - confidence) / 2
+    intervals = np.full((2, len(percentiles), len(counts)), np.nan)
+    for row, (start, count) in enumerate(zip(starts, counts)):
+        if count == 0:
+            continue
+        resampled = resample_sorted_percentiles(np.asarray(values[start:start + count], dtype=np.float64),
+                                                percentiles, resamples, random_state)
+        intervals[:, :, row] = np.quantile(resampled, [alpha, 1 - alpha], axis=0)
+    return intervals
+
+
+def bootstrap_cohort_values(cohort_values, percentiles, metrics=None, resamples=default_resamples,
+                            confidence=default_confidence, seed=0, workers=None):
+    """
+    Confidence intervals of `percentiles` of every metric (or `metrics`) in every cohort.
+
+    Parameters
+    ----------
+    cohort_values : summary_metrics.CohortValues
+    percentiles : list of float
+        in [0, 1], e.g. [.5] for the median
+    workers : int, optional
+        processes to spread the metrics over (None: one per CPU; 1: this process)
+
+    Returns
+    -------
+    dict
+        metric -> array of shape (2, len(percentiles), cohorts), see `bootstrap_metric`
+    """
+    metrics = metrics or cohort_values.metrics
+    workers = min(workers or os.cpu_count() or 1, len(metrics))
+    # Every metric gets its own random stream, so results do not depend on the number of workers
+    tasks = {metric: (cohort_values.values[metric], cohort_values.starts, cohort_values.counts[metric],
+                      percentiles, resamples, confidence, [seed, index])
+             for index, metric in enumerate(metrics)}
+
+    if workers <= 1:
+        return {metric: bootstrap_metric(*task) for metric, task in tasks.items()}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # (memory maps are sent as plain arrays)
+        futures = {metric: executor.submit(bootstrap_metric, np.asarray(task[0]), *task[1:])
+                   for metric, task in tasks.items()}
+        return {metric: future.result() for metric, future in futures.items()}
+
+
+def add_interval_columns(summary_metrics_table, intervals, percentiles):
+    """
+    Copy of the summary table with the `get_interval_columns` of every metric in `intervals` (as returned by
+    `bootstrap_cohort_values`), each pair right after its percentile's column when that is in the table.
+    """
+    interval_columns = {}
+    after_column = {}  # percentile column -> its interval columns
+    for metric, metric_intervals in intervals.items():
+        for index, percentile in enumerate(percentiles):
+            columns = get_interval_columns(metric, percentile)
+            for end, column in enumerate(columns):
+                interval_columns[column] = metric_intervals[end, index]
+            after_column["{}.{}".format(metric, percentile_label(percentile))] = list(columns)
+
+    order = []
+    for column in summary_metrics_table.columns:
+        if column not in interval_columns:
+            order += [column] + after_column.pop(column, [])
+    order += [column for columns in after_column.values() for column in columns]
+    return pd.concat([summary_metrics_table.drop(columns=[column for column in summary_metrics_table
+                                                          if column in interval_columns]),
+                      pd.DataFrame(interval_columns, index=summary_metrics_table.index)], axis=1)[order]
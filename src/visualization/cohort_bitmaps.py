@@ -0,0 +1,330 @@
+# Compressed bitmap index of donor cohorts
+#
+# Every value of every categorical dimension of a donor frame (age bin, ylw bin,
+# donor category, ...) gets a bitmap of the rows that have it, built once at
+# load time. A cohort selection (e.g. ages 7-14 or 14-25, and category
+# 'age-ylw') is then resolved with bitmap ANDs and ORs instead of scanning the
+# frame, and only the selected rows are ever read.
+#
+# Bitmaps are compressed in the style of Roaring bitmaps: rows are split into
+# containers of 2^16 and each container is kept as whichever is smallest,
+#
+# - nothing, when no row of the container is set,
+# - `True`, when every row is set (the frames are sorted by age category, so
+#   most age bitmap containers are empty or full),
+# - a sorted uint16 array of the set rows, when at most `array_max_size` are, or
+# - a bitset of 1024 little-endian uint64 words,
+#
+# and the set operations work container by container, skipping empty and full ones.
+
+import numpy as np
+
+import instrumentation
+
+container_bits = 16
+container_size = 1 << container_bits
+# Containers with more rows set than this are bitsets (an array would be larger)
+array_max_size = 4096
+
+# Dimensions binned from a numeric donor column when the frame does not have them:
+# name -> (column, name of the bin edges in cohorts)
+binned_dimensions = {
+    'Age Category': ('age', 'default_age_bin_edges'),
+    'Years Living With Category': ('ylw', 'default_ylw_bin_edges'),
+}
+
+
+def _count_words(words):
+    # (faster here than byte lookup tables or bit tricks on the words)
+    return np.count_nonzero(np.unpackbits(words.view(np.uint8)))
+
+
+def _get_valid_words(size):
+    # Bitset of the first `size` rows of a container
+    valid = np.zeros(container_size, dtype=bool)
+    valid[:size] = True
+    return np.packbits(valid, bitorder='little').view('<u8')
+
+
+def _to_words(container, size):
+    if container is True:
+        return _get_valid_words(size)
+    if container.dtype == np.uint16:
+        mask = np.zeros(container_size, dtype=bool)
+        mask[container] = True
+        return np.packbits(mask, bitorder='little').view('<u8')
+    return container
+
+
+def _compress_words(words, size):
+    # The smallest container holding a bitset's rows (None if it has none)
+    count = _count_words(words)
+    if count == 0:
+        return None
+    if count == size:
+        return True
+    if count <= array_max_size:
+        return np.flatnonzero(np.unpackbits(words.view(np.uint8), bitorder='little')).astype(np.uint16)
+    return words
+
+
+def _compress_mask(mask):
+    # The smallest container holding the rows of a boolean mask (at most container_size long)
+    count = np.count_nonzero(mask)
+    if count == 0:
+        return None
+    if count == len(mask):
+        return True
+    if count <= array_max_size:
+        return np.flatnonzero(mask).astype(np.uint16)
+    padded = np.zeros(container_size, dtype=bool)
+    padded[:len(mask)] = mask
+    return np.packbits(padded, bitorder='little').view('<u8')
+
+
+class Bitmap:
+    """
+    A compressed set of row positions in [0, size); see the module description for the containers.
+
+    `&` (and), `|` (or) and `~` (not) combine bitmaps of the same size; `len` is the number of rows set.
+    """
+
+    def __init__(self, size, containers=None):
+        self.size = size
+        self.containers = containers or {}  # container key -> True, uint16 rows or uint64 words
+
+    @classmethod
+    def from_mask(cls, mask):
+        """The rows where a boolean array is True."""
+        mask = np.asarray(mask, dtype=bool)
+        containers = {}
+        for key, start in enumerate(range(0, len(mask), container_size)):
+            container = _compress_mask(mask[start:start + container_size])
+            if container is not None:
+                containers[key] = container
+        return cls(len(mask), containers)
+
+    @classmethod
+    def from_rows(cls, rows, size):
+        """The given row positions (any order)."""
+        mask = np.zeros(size, dtype=bool)
+        mask[rows] = True
+        return cls.from_mask(mask)
+
+    @classmethod
+    def full(cls, size):
+        """Every row."""
+        return ~cls(size)
+
+    def get_container_size(self, key):
+        return min(container_size, self.size - key * container_size)
+
+    def __len__(self):
+        count = 0
+        for key, container in self.containers.items():
+            if container is True:
+                count += self.get_container_size(key)
+            elif container.dtype == np.uint16:
+                count += len(container)
+            else:
+                count += _count_words(container)
+        return count
+
+    def _check_size(self, other):
+        if self.size != other.size:
+            raise ValueError("Bitmaps of {} and {} rows cannot be combined".format(self.size, other.size))
+
+    def __and__(self, other):
+        self._check_size(other)
+        containers = {}
+        for key in self.containers.keys() & other.containers.keys():
+            container, other_container = self.containers[key], other.containers[key]
+            if container is True or other_container is True:
+                containers[key] = other_container if container is True else container
+                continue
+            if container.dtype == np.uint16 and other_container.dtype == np.uint16:
+                container = np.intersect1d(container, other_container, assume_unique=True)
+            elif container.dtype == np.uint16 or other_container.dtype == np.uint16:
+                # Keep the array's rows whose bits are set in the bitset
+                rows, words = (container, other_container) if container.dtype == np.uint16 \
+                    else (other_container, container)
+                container = rows[(words[rows >> 6] >> (rows & 63).astype(np.uint64)) & np.uint64(1) == 1]
+            else:
+                container = _compress_words(container & other_container, self.get_container_size(key))
+            if container is not None and (container is True or len(container)):
+                containers[key] = container
+        return Bitmap(self.size, containers)
+
+    def __or__(self, other):
+        self._check_size(other)
+        containers = dict(self.containers)
+        for key, other_container in other.containers.items():
+            container = containers.get(key)
+            if container is None or other_container is True:
+                containers[key] = other_container
+            elif container is not True:
+                size = self.get_container_size(key)
+                if container.dtype == np.uint16 and other_container.dtype == np.uint16 \
+                        and len(container) + len(other_container) <= array_max_size:
+                    containers[key] = np.union1d(container, other_container)
+                    if len(containers[key]) == size:
+                        containers[key] = True
+                else:
+                    containers[key] = _compress_words(_to_words(container, size) | _to_words(other_container, size),
+                                                      size)
+        return Bitmap(self.size, containers)
+
+    def __invert__(self):
+        containers = {}
+        for key in range((self.size + container_size - 1) // container_size):
+            size = self.get_container_size(key)
+            container = self.containers.get(key)
+            if container is None:
+                containers[key] = True
+            elif container is not True:
+                container = _compress_words(~_to_words(container, size) & _get_valid_words(size), size)
+                if container is not None:
+                    containers[key] = container
+        return Bitmap(self.size, containers)
+
+    def to_rows(self):
+        """The sorted row positions set, as int64."""
+        rows = []
+        for key in sorted(self.containers):
+            container = self.containers[key]
+            if container is True:
+                positions = np.arange(self.get_container_size(key), dtype=np.int64)
+            elif container.dtype == np.uint16:
+                positions = container.astype(np.int64)
+            else:
+                positions = np.flatnonzero(np.unpackbits(container.view(np.uint8), bitorder='little'))
+            rows.append(positions + key * container_size)
+        return np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+
+    def to_mask(self):
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.to_rows()] = True
+        return mask
+
+    @property
+    def nbytes(self):
+        return sum(0 if container is True else container.nbytes for container in self.containers.values())
+
+
+def get_dimension_codes(frame, dimension):
+    """
+    Codes (-1 for missing) and categories of a dimension of a donor frame (a dataframe or a
+    `columnar.ColumnStore`): its categorical column, or, for `binned_dimensions`, the bins of its column.
+    """
+    import pandas as pd
+
+    import cohorts
+
+    if dimension in frame.columns:
+        categorical = pd.Categorical(frame[dimension] if isinstance(frame, pd.DataFrame) else frame.series(dimension))
+        return categorical.codes, list(categorical.categories)
+    if dimension not in binned_dimensions:
+        raise ValueError("The donor data has no {!r} column to filter by".format(dimension))
+    column, bin_edges_name = binned_dimensions[dimension]
+    values = frame[column].to_numpy() if isinstance(frame, pd.DataFrame) else frame.column(column)
+    bin_edges = getattr(cohorts, bin_edges_name)
+    return cohorts.get_bin_positions(values, bin_edges), list(range(1, len(bin_edges) + 2))
+
+
+def get_value_labels(dimension, values):
+    """Display labels of a dimension's values: bin labels for the binned dimensions, the values otherwise."""
+    import cohorts
+
+    if dimension in binned_dimensions:
+        labels = cohorts.get_bin_labels(getattr(cohorts, binned_dimensions[dimension][1]))
+        return [labels[int(value) - 1] for value in values]
+    return [str(value) for value in values]
+
+
+def get_categorical_columns(dimensions):
+    """The donor columns of the dimensions that are not binned (read as categoricals and kept in the frames)."""
+    return [dimension for dimension in dimensions if dimension not in binned_dimensions]
+
+
+class BitmapIndex:
+    """
+    One `Bitmap` per value of every dimension of a donor frame.
+
+    Parameters
+    ----------
+    size : int
+        rows of the frame
+    bitmaps : dict
+        dimension -> {value -> Bitmap}, values in category order
+    """
+
+    def __init__(self, size, bitmaps):
+        self.size = size
+        self.bitmaps = bitmaps
+
+    @classmethod
+    @instrumentation.timed('cohort_bitmaps.build_index')
+    def from_frame(cls, frame, dimensions):
+        """Index the `dimensions` of a donor frame or store (see `get_dimension_codes`)."""
+        bitmaps = {}
+        for dimension in dimensions:
+            codes, categories = get_dimension_codes(frame, dimension)
+            codes = np.asarray(codes)
+            bitmaps[dimension] = {_to_json_value(value): Bitmap.from_mask(codes == code)
+                                  for code, value in enumerate(categories)}
+        return cls(len(frame), bitmaps)
+
+    @property
+    def dimensions(self):
+        return list(self.bitmaps)
+
+    def get_values(self, dimension, non_empty=True):
+        return [value for value, bitmap in self.bitmaps[dimension].items() if not non_empty or bitmap.containers]
+
+    def get_options(self, dimension):
+        """Dropdown options ({'label', 'value'}) of a dimension's values that have donors."""
+        values = self.get_values(dimension)
+        return [dict(label=label, value=value) for label, value in zip(get_value_labels(dimension, values), values)]
+
+    def any_of(self, dimension, values):
+        """Rows with any of `values` in `dimension`."""
+        result = Bitmap(self.size)
+        for value in values:
+            if value in self.bitmaps[dimension]:
+                result = result | self.bitmaps[dimension][value]
+        return result
+
+    def select(self, selection, combine='and'):
+        """
+        The rows of a cohort selection.
+
+        Parameters
+        ----------
+        selection : dict
+            dimension -> values; a row matches a dimension if it has any of its values, and
+            dimensions without values are left out
+        combine : str
+            'and': rows matching every dimension selected; 'or': rows matching any of them
+
+        Returns
+        -------
+        Bitmap
+            every row if nothing is selected
+        """
+        with instrumentation.time_stage('cohort_bitmaps.select'):
+            matches = [self.any_of(dimension, values) for dimension, values in selection.items() if values]
+            if not matches:
+                return Bitmap.full(self.size)
+            result = matches[0]
+            for match in matches[1:]:
+                result = result & match if combine == 'and' else result | match
+            return result
+
+    @property
+    def nbytes(self):
+        return sum(bitmap.nbytes for bitmaps in self.bitmaps.values() for bitmap in bitmaps.values())
+
+
+def _to_json_value(value):
+    # Values come back from the browser as JSON
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,76 @@
+# Multi-select cohort filter controls shared by the apps
+#
+# One multi-select dropdown per dimension of a `cohort_bitmaps.BitmapIndex` plus
+# a radio button choosing how the dimensions combine: a donor matches a dimension
+# if it has any of the values picked there, and matches the selection if it
+# matches every dimension picked ('and') or any of them ('or'). Dimensions with
+# nothing picked are left out, so an empty selection is every donor.
+#
+# The callbacks get the combine mode followed by the dropdown values, in the
+# order of `get_filter_inputs`; `get_selection` turns them back into the
+# selection `BitmapIndex.select` takes.
+
+import re
+
+import dash_core_components as dcc
+import dash_html_components as html
+from dash.dependencies import Input
+
+combine_id = 'filter-combine'
+
+# Dropdown placeholders of the dimensions (others show their column name)
+dimension_labels = {
+    'Age Category': 'Age',
+    'Years Living With Category': 'Years living with diabetes',
+    'category': 'Donor category',
+}
+
+
+def get_filter_id(dimension):
+    """Component id of a dimension's dropdown, e.g. 'filter-age-category'."""
+    return 'filter-' + re.sub('[^a-z0-9]+', '-', dimension.lower()).strip('-')
+
+
+def get_filter_inputs(dimensions):
+    return [Input(combine_id, 'value')] + [Input(get_filter_id(dimension), 'value') for dimension in dimensions]
+
+
+def get_selection(dimensions, combine, *values):
+    """The (selection, combine) of the callback values of `get_filter_inputs`."""
+    selection = {dimension: list(dimension_values) for dimension, dimension_values in zip(dimensions, values)
+                 if dimension_values}
+    return selection, combine or 'and'
+
+
+def normalize_selection(selection, combine):
+    """A hashable key of a selection, the same whatever order the values were picked in (for response caches)."""
+    key = tuple((dimension, tuple(sorted(values, key=str))) for dimension, values in sorted(selection.items()))
+    # How single dimensions combine makes no difference
+    return key, combine if len(key) > 1 else 'and'
+
+
+def create_filter_controls(index, selection=None):
+    """
+    The dropdowns of every dimension of a `cohort_bitmaps.BitmapIndex`, with the values of `selection` picked.
+    """
+    selection = selection or {}
+    dropdowns = [html.Div([
+        dcc.Dropdown(
+            id=get_filter_id(dimension),
+            options=index.get_options(dimension),
+            value=selection.get(dimension, []),
+            multi=True,
+            placeholder=dimension_labels.get(dimension, dimension)
+        )
+    ], style={'width': '{:g}%'.format(90 / len(index.dimensions)), 'display': 'inline-block',
+              'margin-right': '1%', 'vertical-align': 'top'})
+        for dimension in index.dimensions]
+
+    return html.Div(dropdowns + [
+        dcc.RadioItems(
+            id=combine_id,
+            options=[{'label': 'Match all', 'value': 'and'}, {'label': 'Match any', 'value': 'or'}],
+            value='and',
+            labelStyle={'display': 'inline-block'}
+        )
+    ], style={'margin-top': '10px'})
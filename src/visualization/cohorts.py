@@ -0,0 +1,140 @@
+# Cohort binning shared by the donor barplot and scatterplot apps
+#
+# Donors are binned by age and by years living with diabetes (ylw) using
+# vectorized bin-edge lookups. Cohort codes are 1-based and ascend with the bin
+# (1 = youngest / newest diagnosis), and both codes and labels are stored as
+# ordered pandas categoricals.
+
+import numpy as np
+import pandas as pd
+
+# Upper bin edges; a value falls in the first bin whose edge it is strictly below
+default_age_bin_edges = [7, 14, 25, 50]
+default_ylw_bin_edges = [1, 5]
+
+# Combined age x ylw codes are age_code * age_ylw_multiplier + ylw_code
+age_ylw_multiplier = 10
+
+
+def get_bin_labels(bin_edges):
+    """Return display labels for the bins defined by `bin_edges` (e.g. '0 - 7', ..., '> 50')."""
+    lower_edges = [0] + list(bin_edges)
+    labels = ["{:g} - {:g}".format(lower, upper) for lower, upper in zip(lower_edges[:-1], lower_edges[1:])]
+    labels.append("> {:g}".format(lower_edges[-1]))
+    return labels
+
+
+def get_bin_positions(values, bin_edges):
+    """
+    Vectorized bin lookup.
+
+    Returns the 0-based bin position of every value as int8, with -1 for missing values.
+    """
+    values = np.asarray(values, dtype=float)
+    positions = np.searchsorted(np.asarray(bin_edges, dtype=float), values, side='right').astype(np.int8)
+    positions[np.isnan(values)] = -1
+    return positions
+
+
+def get_category(values, bin_edges):
+    """Return the 1-based cohort codes of `values` as an ordered categorical."""
+    categories = list(range(1, len(bin_edges) + 2))
+    return pd.Categorical.from_codes(get_bin_positions(values, bin_edges), categories=categories, ordered=True)
+
+
+def get_age_ylw_categories(age_bin_edges=default_age_bin_edges, ylw_bin_edges=default_ylw_bin_edges):
+    """Return every combined age x ylw code, in order."""
+    return [age_code * age_ylw_multiplier + ylw_code
+            for age_code in range(1, len(age_bin_edges) + 2)
+            for ylw_code in range(1, len(ylw_bin_edges) + 2)]
+
+
+def get_age_ylw_labels(age_bin_edges=default_age_bin_edges, ylw_bin_edges=default_ylw_bin_edges):
+    """Return the labels matching `get_age_ylw_categories`."""
+    return [age_label + " & " + ylw_label
+            for age_label in get_bin_labels(age_bin_edges)
+            for ylw_label in get_bin_labels(ylw_bin_edges)]
+
+
+def get_age_ylw_category(age_values, ylw_values,
+                         age_bin_edges=default_age_bin_edges, ylw_bin_edges=default_ylw_bin_edges):
+    """Return the combined age x ylw cohort codes as an ordered categorical."""
+    age_positions = get_bin_positions(age_values, age_bin_edges).astype(np.int16)
+    ylw_positions = get_bin_positions(ylw_values, ylw_bin_edges).astype(np.int16)
+    positions = age_positions * (len(ylw_bin_edges) + 1) + ylw_positions
+    positions[(age_positions < 0) | (ylw_positions < 0)] = -1
+    return pd.Categorical.from_codes(positions, categories=get_age_ylw_categories(age_bin_edges, ylw_bin_edges),
+                                     ordered=True)
+
+
+def get_labels(codes, categories, labels):
+    """
+    Map cohort codes (any of `categories`, or NaN) to their labels as an ordered categorical.
+    """
+    codes = pd.Series(np.asarray(codes, dtype=float))
+    positions = pd.Categorical(codes, categories=categories).codes
+    return pd.Categorical.from_codes(positions, categories=labels, ordered=True)
+
+
+def add_cohort_columns(df, age_column='age', ylw_column='ylw',
+                       age_bin_edges=default_age_bin_edges, ylw_bin_edges=default_ylw_bin_edges):
+    """
+    Add cohort codes and labels for age, ylw and age x ylw to a donor dataframe.
+
+    Adds 'Age Category', 'Years Living With Category', 'Age and Years Living With Category'
+    (codes) and 'Age', 'dAge (years since diagnosis)', 'Age & dAge' (labels).
+    """
+    age_category = get_category(df[age_column], age_bin_edges)
+    ylw_category = get_category(df[ylw_column], ylw_bin_edges)
+    age_ylw_category = get_age_ylw_category(df[age_column], df[ylw_column], age_bin_edges, ylw_bin_edges)
+
+    df['Age Category'] = age_category
+    df['Years Living With Category'] = ylw_category
+    df['Age and Years Living With Category'] = age_ylw_category
+
+    df['Age'] = age_category.rename_categories(get_bin_labels(age_bin_edges))
+    df['dAge (years since diagnosis)'] = ylw_category.rename_categories(get_bin_labels(ylw_bin_edges))
+    df['Age & dAge'] = age_ylw_category.rename_categories(get_age_ylw_labels(age_bin_edges, ylw_bin_edges))
+
+    return df
+
+
+def add_cohort_labels(table, age_bin_edges=default_age_bin_edges, ylw_bin_edges=default_ylw_bin_edges):
+    """
+    Add the 'Age', 'dAge (years since diagnosis)' and 'Age & dAge' labels to a table of cohort codes
+    (e.g. a summary table with one row per cohort and NaN codes for other groupings).
+    """
+    n_age_bins = len(age_bin_edges) + 1
+    n_ylw_bins = len(ylw_bin_edges) + 1
+    table['Age'] = get_labels(table['Age Category'], list(range(1, n_age_bins + 1)),
+                              get_bin_labels(age_bin_edges))
+    table['dAge (years since diagnosis)'] = get_labels(table['Years Living With Category'],
+                                                       list(range(1, n_ylw_bins + 1)),
+                                                       get_bin_labels(ylw_bin_edges))
+    table['Age & dAge'] = get_labels(table['Age and Years Living With Category'],
+                                     get_age_ylw_categories(age_bin_edges, ylw_bin_edges),
+                                     get_age_ylw_labels(age_bin_edges, ylw_bin_edges))
+    return table
+
+
+def sort_by_cohort(df, column):
+    """
+    Stable-sort donor rows by a cohort code column, so that each cohort is a contiguous block of rows.
+
+    Rows without a cohort come first; the index is reset.
+    """
+    order = np.argsort(np.asarray(df[column].cat.codes), kind='mergesort')
+    return df.iloc[order].reset_index(drop=True)
+
+
+def get_cohort_slices(category):
+    """
+    Map every cohort code to the slice of rows it occupies in a frame sorted with `sort_by_cohort`.
+
+    Cohorts without donors get an empty slice.
+    """
+    positions = np.asarray(pd.Series(category).cat.codes)
+    categories = pd.Series(category).cat.categories
+    starts = np.searchsorted(positions, np.arange(len(categories)), side='left')
+    ends = np.searchsorted(positions, np.arange(len(categories)), side='right')
+    return {code: slice(int(start), int(end)) for code, start, end in zip(categories, starts, ends)}
@@ -0,0 +1,253 @@
+# Columnar on-disk format for dataframes
+#
+# A frame is stored as a directory with one `.npy` file per column and a
+# `schema.json` describing the columns. Categorical (and string) columns are
+# stored as integer codes plus their categories, so loading a column is a single
+# `np.load`. The index is not stored.
+#
+# `ColumnStore` opens such a directory lazily: a column file is only memory
+# mapped when the column is first accessed, so a reader only touches the pages
+# of the columns (and rows) it uses.
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+schema_file_name = 'schema.json'
+
+
+def _to_json_values(values):
+    return [value.item() if isinstance(value, np.generic) else value for value in values]
+
+
+def save_frame(df, directory):
+    """
+    Save a dataframe as one `.npy` per column plus a JSON schema.
+
+    Numeric columns keep their dtype; categorical and object columns are stored
+    as categorical codes and come back as categoricals.
+    """
+    os.makedirs(directory, exist_ok=True)
+    columns = []
+    for position, name in enumerate(df.columns):
+        series = df[name]
+        column = dict(name=name, file="{:04d}.npy".format(position))
+        if pd.api.types.is_numeric_dtype(series.dtype) and not isinstance(series.dtype, pd.CategoricalDtype):
+            column['kind'] = 'numeric'
+            values = series.to_numpy()
+        else:
+            categorical = series.astype('category').cat
+            column['kind'] = 'categorical'
+            column['categories'] = _to_json_values(categorical.categories)
+            column['ordered'] = bool(categorical.ordered)
+            values = categorical.codes.to_numpy()
+        np.save(os.path.join(directory, column['file']), values, allow_pickle=False)
+        columns.append(column)
+
+    with open(os.path.join(directory, schema_file_name), 'w') as schema_file:
+        json.dump(dict(columns=columns, rows=len(df)), schema_file)
+
+
+def save_chunks(chunks, directory, metadata=None):
+    """
+    Save a frame arriving as chunks (with the same columns) without holding it in memory.
+
+    Numeric columns keep the dtype of the first chunk; categorical and object
+    columns are stored as int32 codes into the categories seen across all chunks.
+    `metadata` (a JSON-serializable dict) is stored in the schema.
+    """
+    os.makedirs(directory, exist_ok=True)
+    temporary_dir = tempfile.mkdtemp(dir=directory, prefix='.chunks')
+    columns = None
+    rows = 0
+    for chunk in chunks:
+        if columns is None:
+            columns = []
+            for position, name in enumerate(chunk.columns):
+                column = dict(name=name, file="{:04d}.npy".format(position))
+                if pd.api.types.is_numeric_dtype(chunk[name].dtype) \
+                        and not isinstance(chunk[name].dtype, pd.CategoricalDtype):
+                    column.update(kind='numeric', dtype=chunk[name].dtype.str)
+                else:
+                    column.update(kind='categorical', dtype=np.dtype(np.int32).str, ordered=False,
+                                  categories=[], codes={})
+                columns.append(column)
+
+        for column in columns:
+            series = chunk[column['name']]
+            if column['kind'] == 'numeric':
+                values = series.to_numpy(dtype=column['dtype'])
+            else:
+                # Re-code against the categories seen so far
+                chunk_categories = series.astype('category').cat
+                for category in _to_json_values(chunk_categories.categories):
+                    if category not in column['codes']:
+                        column['codes'][category] = len(column['categories'])
+                        column['categories'].append(category)
+                mapping = np.array([column['codes'][category]
+                                    for category in _to_json_values(chunk_categories.categories)] + [-1],
+                                   dtype=np.int32)
+                values = mapping[chunk_categories.codes.to_numpy()]
+            with open(os.path.join(temporary_dir, column['file']), 'ab') as raw_file:
+                values.tofile(raw_file)
+        rows += len(chunk)
+
+    # Turn the raw column files into `.npy` files
+    for column in columns or []:
+        column.pop('codes', None)
+        raw_path = os.path.join(temporary_dir, column['file'])
+        values = np.lib.format.open_memmap(os.path.join(directory, column['file']), mode='w+',
+                                           dtype=column.pop('dtype'), shape=(rows,))
+        if rows:
+            values[:] = np.memmap(raw_path, dtype=values.dtype, mode='r', shape=(rows,))
+        values.flush()
+        del values
+    shutil.rmtree(temporary_dir, ignore_errors=True)
+
+    with open(os.path.join(directory, schema_file_name), 'w') as schema_file:
+        json.dump(dict(columns=columns or [], rows=rows, metadata=metadata or {}), schema_file)
+
+
+def save_sorted_chunks(get_chunks, directory, sort_column):
+    """
+    Save a frame arriving as chunks, stably sorted by the codes of a categorical column, without
+    holding it in memory (like saving `cohorts.sort_by_cohort` of the concatenated chunks).
+
+    `get_chunks(columns)` must yield the same rows every time it is called: it is called with
+    [sort_column] to count the rows of every code, then with None for the chunks of every column,
+    whose rows are written to their sorted positions. Categorical columns must have the same
+    categories in every chunk.
+    """
+    counts = None
+    for chunk in get_chunks([sort_column]):
+        codes = chunk[sort_column].cat.codes.to_numpy()
+        chunk_counts = np.bincount(codes + 1, minlength=len(chunk[sort_column].cat.categories) + 1)
+        counts = chunk_counts if counts is None else counts + chunk_counts
+    rows = int(counts.sum()) if counts is not None else 0
+    # Next free row of every code (missing, -1, first)
+    next_rows = np.concatenate([[0], np.cumsum(counts)[:-1]]) if counts is not None else None
+
+    os.makedirs(directory, exist_ok=True)
+    columns = []
+    arrays = {}
+    for chunk in get_chunks(None):
+        if not columns:
+            for position, name in enumerate(chunk.columns):
+                column = dict(name=name, file="{:04d}.npy".format(position))
+                if isinstance(chunk[name].dtype, pd.CategoricalDtype):
+                    column.update(kind='categorical', categories=_to_json_values(chunk[name].cat.categories),
+                                  ordered=bool(chunk[name].cat.ordered))
+                    dtype = chunk[name].cat.codes.dtype
+                else:
+                    column['kind'] = 'numeric'
+                    dtype = chunk[name].dtype
+                columns.append(column)
+                arrays[name] = np.lib.format.open_memmap(os.path.join(directory, column['file']), mode='w+',
+                                                         dtype=dtype, shape=(rows,))
+
+        # Row of the output each chunk row goes to: the next free rows of its code, in chunk order
+        codes = chunk[sort_column].cat.codes.to_numpy().astype(np.int64) + 1
+        order = np.argsort(codes, kind='mergesort')
+        sorted_codes = codes[order]
+        group_starts = np.searchsorted(sorted_codes, sorted_codes, side='left')
+        targets = np.empty(len(codes), dtype=np.int64)
+        targets[order] = next_rows[sorted_codes] + np.arange(len(codes)) - group_starts
+        next_rows += np.bincount(codes, minlength=len(next_rows))
+
+        for column in columns:
+            series = chunk[column['name']]
+            values = series.cat.codes.to_numpy() if column['kind'] == 'categorical' else series.to_numpy()
+            arrays[column['name']][targets] = values
+            # Written back now, the mapped pages can be dropped instead of piling up as dirty memory
+            arrays[column['name']].flush()
+    del arrays
+
+    with open(os.path.join(directory, schema_file_name), 'w') as schema_file:
+        json.dump(dict(columns=columns, rows=rows), schema_file)
+
+
+def is_frame_directory(path):
+    """True if `path` is a frame saved with `save_frame` or `save_chunks`."""
+    return os.path.isfile(os.path.join(path, schema_file_name))
+
+
+def read_schema(directory):
+    with open(os.path.join(directory, schema_file_name)) as schema_file:
+        return json.load(schema_file)
+
+
+def load_frame(directory, columns=None, mmap_mode=None):
+    """
+    Load a frame saved with `save_frame`, optionally only some of its columns.
+    """
+    return ColumnStore(directory, mmap_mode).frame(columns)
+
+
+class ColumnStore:
+    """
+    Lazy, memory-mapped access to a frame saved with `save_frame` or `save_chunks`.
+
+    Columns are mapped on first access; `column` returns the mapped array itself
+    (categorical codes for categorical columns), so no data is copied until it is
+    sliced into a dataframe with `frame`.
+    """
+
+    def __init__(self, directory, mmap_mode='r'):
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+        self.schema = read_schema(directory)
+        self._columns = {column['name']: column for column in self.schema['columns']}
+        self._arrays = {}
+
+    def __len__(self):
+        return self.schema['rows']
+
+    @property
+    def columns(self):
+        return [column['name'] for column in self.schema['columns']]
+
+    @property
+    def metadata(self):
+        return self.schema.get('metadata', {})
+
+    def column(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.directory, self._columns[name]['file']),
+                                         mmap_mode=self.mmap_mode, allow_pickle=False)
+        return self._arrays[name]
+
+    def series(self, name, start=0, stop=None):
+        return self._decode(name, self.column(name)[start:stop])
+
+    def _decode(self, name, values):
+        column = self._columns[name]
+        if column['kind'] == 'categorical':
+            values = pd.Categorical.from_codes(values, categories=column['categories'], ordered=column['ordered'])
+        return values
+
+    def frame(self, columns=None, start=0, stop=None):
+        """Rows `start:stop` of `columns` (all by default, in store order) as a dataframe."""
+        names = [name for name in self.columns if columns is None or name in columns]
+        return pd.DataFrame({name: self.series(name, start, stop) for name in names}, columns=names)
+
+    def take(self, rows, columns=None):
+        """The rows at positions `rows` (e.g. of a cohort selection) of `columns` as a dataframe."""
+        names = [name for name in self.columns if columns is None or name in columns]
+        return pd.DataFrame({name: self._decode(name, self.column(name)[rows]) for name in names}, columns=names)
+
+    def iter_chunks(self, columns=None, chunk_size=250000):
+        for start in range(0, len(self), chunk_size):
+            yield self.frame(columns, start, start + chunk_size)
+
+
+def get_directory_size(directory):
+    """Total size in bytes of the files below `directory`."""
+    size = 0
+    for root, _, files in os.walk(directory):
+        for file_name in files:
+            size += os.path.getsize(os.path.join(root, file_name))
+    return size
@@ -0,0 +1,19 @@
+# Convert an aggregate-cgm-stats CSV into a columnar, memory-mapped store
+#
+# Usage: python convert-donor-stats.py <aggregate-cgm-stats.csv.gz> <store directory>
+#
+# The store directory can then be passed to the visualizations in place of the
+# CSV file; they map only the columns they display instead of parsing the text.
+
+# Import Packages
+import sys
+import time
+
+import ingest
+
+file_path = sys.argv[1]  # './data/2019-07-17-aggregate-cgm-stats.csv.gz'
+store_dir = sys.argv[2]  # './data/.interim/2019-07-17-aggregate-cgm-stats'
+
+start_time = time.time()
+rows = ingest.convert_to_store(file_path, store_dir)
+print("Converted {} rows of {} to {} in {:.2f}s".format(rows, file_path, store_dir, time.time() - start_time))
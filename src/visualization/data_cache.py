@@ -0,0 +1,212 @@
+# Persistent cache of the frames derived from an aggregate-cgm-stats file
+#
+# Each snapshot is a directory of columnar frames (see `columnar.py`) named after
+# a cache key: the content hash of the input file plus the binning/metric
+# configuration that produced it. Changing either produces a new key. Snapshots
+# are evicted least-recently-used first once the cache grows past a byte budget.
+#
+# Snapshots can also be opened as memory-mapped `columnar.ColumnStore`s, so that
+# several processes (e.g. WSGI workers) share one copy of the data through the
+# page cache. A lock per key makes sure only one of them builds a missing snapshot.
+#
+# Frames too large to build in memory can be written to the snapshot directly,
+# by a function that takes the frame's directory (see `save_frames`).
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import columnar
+
+logger = logging.getLogger(__name__)
+
+default_cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 '..', '..', 'data', '.interim', 'donor-stats-cache')
+default_max_cache_bytes = 2 * 1024 ** 3
+
+# Bump when the layout of the cached frames changes
+cache_format_version = 3
+
+fingerprints_file_name = 'fingerprints.json'
+hash_block_size = 1024 ** 2
+
+
+def hash_file(file_path):
+    """Content hash (blake2b) of a file, read in blocks."""
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(hash_block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_file_fingerprint(file_path, cache_dir=default_cache_dir):
+    """
+    Content hash of `file_path`.
+
+    Hashes are remembered per (path, size, mtime) in the cache directory so that an
+    unchanged file is not re-read on every start. A columnar store is identified
+    by its schema, which records the hash of the file it was converted from.
+    """
+    file_path = os.path.abspath(file_path)
+    if columnar.is_frame_directory(file_path):
+        file_path = os.path.join(file_path, columnar.schema_file_name)
+    stat = os.stat(file_path)
+    fingerprints_path = os.path.join(cache_dir, fingerprints_file_name)
+
+    fingerprints = {}
+    if os.path.exists(fingerprints_path):
+        with open(fingerprints_path) as fingerprints_file:
+            fingerprints = json.load(fingerprints_file)
+
+    known = fingerprints.get(file_path)
+    if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known['hash']
+
+    file_hash = hash_file(file_path)
+    fingerprints[file_path] = dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns, hash=file_hash)
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=cache_dir, delete=False) as fingerprints_file:
+        json.dump(fingerprints, fingerprints_file)
+    os.replace(fingerprints_file.name, fingerprints_path)
+
+    return file_hash
+
+
+def get_cache_key(file_path, config, cache_dir=default_cache_dir):
+    """Cache key for the frames built from `file_path` with `config` (any JSON-serializable object)."""
+    key_hash = hashlib.blake2b(digest_size=16)
+    key_hash.update(get_file_fingerprint(file_path, cache_dir).encode())
+    key_hash.update(json.dumps([cache_format_version, config], sort_keys=True, default=str).encode())
+    return key_hash.hexdigest()
+
+
+def get_frame_dirs(cache_dir, key, names):
+    snapshot_dir = os.path.join(cache_dir, key)
+    return {name: os.path.join(snapshot_dir, name) for name in names}
+
+
+def is_cached(file_path, config, names, cache_dir=default_cache_dir):
+    """True if the named frames derived from `file_path` with `config` are cached."""
+    frame_dirs = get_frame_dirs(cache_dir, get_cache_key(file_path, config, cache_dir), names)
+    return all(columnar.is_frame_directory(frame_dir) for frame_dir in frame_dirs.values())
+
+
+def load_frames(cache_dir, key, names, as_stores=False):
+    """
+    Load the named frames of a snapshot, or return None if any of them is not cached.
+
+    With `as_stores`, return read-only memory-mapped `columnar.ColumnStore`s instead of dataframes.
+    """
+    snapshot_dir = os.path.join(cache_dir, key)
+    frame_dirs = get_frame_dirs(cache_dir, key, names)
+    if not all(columnar.is_frame_directory(frame_dir) for frame_dir in frame_dirs.values()):
+        return None
+
+    # Mark as recently used for eviction
+    os.utime(snapshot_dir)
+    if as_stores:
+        return {name: columnar.ColumnStore(frame_dir, mmap_mode='r') for name, frame_dir in frame_dirs.items()}
+    return {name: columnar.load_frame(frame_dir) for name, frame_dir in frame_dirs.items()}
+
+
+def save_frames(cache_dir, key, frames, max_bytes=default_max_cache_bytes):
+    """
+    Save a snapshot of frames and evict old snapshots beyond `max_bytes`.
+
+    `frames` maps names to dataframes, or to functions writing the frame to the directory they
+    are given (e.g. with `columnar.save_sorted_chunks`), for frames too large to build in memory.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    snapshot_dir = os.path.join(cache_dir, key)
+
+    # Write to a temporary directory first so readers never see a partial snapshot
+    temporary_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.' + key)
+    for name, df in frames.items():
+        if callable(df):
+            df(os.path.join(temporary_dir, name))
+        else:
+            columnar.save_frame(df, os.path.join(temporary_dir, name))
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.replace(temporary_dir, snapshot_dir)
+
+    evict_snapshots(cache_dir, max_bytes, keep=[key])
+
+
+def evict_snapshots(cache_dir, max_bytes=default_max_cache_bytes, keep=()):
+    """
+    Delete least-recently-used snapshots until the cache is at most `max_bytes`.
+
+    Returns the keys of the evicted snapshots.
+    """
+    snapshots = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_dir() and not entry.name.startswith('.'):
+            snapshots.append((entry.stat().st_mtime, entry.name, columnar.get_directory_size(entry.path)))
+
+    total_bytes = sum(size for _, _, size in snapshots)
+    evicted = []
+    for _, key, size in sorted(snapshots):
+        if total_bytes <= max_bytes:
+            break
+        if key in keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total_bytes -= size
+        evicted.append(key)
+
+    return evicted
+
+
+def load_or_build_frames(file_path, config, build_frames, names,
+                         cache_dir=default_cache_dir, max_bytes=default_max_cache_bytes, as_stores=False):
+    """
+    Return the named frames derived from `file_path`, building and caching them on a miss.
+
+    Parameters
+    ----------
+    file_path : str
+        input aggregate-cgm-stats file
+    config : dict
+        everything besides the file contents that the frames depend on (bin edges, metrics, ...)
+    build_frames : callable
+        called with `file_path`; returns a dict of name -> dataframe (or frame writer, see
+        `save_frames`) containing at least `names`
+    names : list of str
+        frames to return
+    as_stores : bool
+        return memory-mapped `columnar.ColumnStore`s (shared between processes) instead of dataframes
+
+    Returns
+    -------
+    dict
+        name -> dataframe (or store) for `names`
+    """
+    start_time = time.time()
+    key = get_cache_key(file_path, config, cache_dir)
+    frames = load_frames(cache_dir, key, names, as_stores)
+    if frames is not None:
+        logger.info("Loaded cached %s in %.2fs", ", ".join(names), time.time() - start_time)
+        return frames
+
+    # One process builds a missing snapshot; the others wait for it and load it
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, '.' + key + '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        frames = load_frames(cache_dir, key, names, as_stores)
+        if frames is not None:
+            logger.info("Loaded %s cached by another process in %.2fs", ", ".join(names), time.time() - start_time)
+            return frames
+
+        frames = build_frames(file_path)
+        save_frames(cache_dir, key, frames, max_bytes)
+    os.remove(lock_file.name)
+    logger.info("Built and cached %s in %.2fs", ", ".join(frames), time.time() - start_time)
+    if as_stores or any(callable(frames[name]) for name in names):
+        return load_frames(cache_dir, key, names, as_stores)
+    return {name: frames[name] for name in names}
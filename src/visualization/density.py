@@ -0,0 +1,68 @@
+# 2D density aggregation for large scatterplots
+#
+# Above a point threshold, sending one marker per donor makes the payload (and
+# the browser) grow with the population. Instead the x/y values are binned into
+# a fixed grid on the server, uniformly in value space for linear axes and in
+# log10 space for log axes, so the heatmap cells line up with the chosen axes.
+
+import numpy as np
+
+default_bins = 100
+
+
+def get_bin_edges(values, log=False, bins=default_bins):
+    """
+    Equal-width bin edges spanning `values` (finite and, for log axes, positive values only).
+
+    Edges are in log10 space when `log` is True. Returns None if there are no usable values.
+    """
+    if log:
+        values = np.log10(values[values > 0])
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return None
+    low, high = float(values.min()), float(values.max())
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    return np.linspace(low, high, bins + 1)
+
+
+def get_bin_positions(values, edges, log=False):
+    """Vectorized bin lookup on equal-width edges; -1 for values outside the edges or unusable on the axis."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = np.log10(values) if log else np.asarray(values, dtype=float)
+        positions = np.floor((scaled - edges[0]) / (edges[1] - edges[0]))
+    bins = len(edges) - 1
+    # The maximum falls on the last edge; keep it in the last bin
+    positions[scaled == edges[-1]] = bins - 1
+    valid = np.isfinite(positions) & (positions >= 0) & (positions < bins)
+    return np.where(valid, positions, -1).astype(np.int64)
+
+
+def get_bin_centers(edges, log=False):
+    centers = (edges[:-1] + edges[1:]) / 2
+    return 10 ** centers if log else centers
+
+
+def histogram2d(x, y, x_log=False, y_log=False, bins=default_bins):
+    """
+    Count (x, y) pairs on a `bins` x `bins` grid honoring the axis types.
+
+    Returns
+    -------
+    tuple
+        (counts, x_centers, y_centers): counts has shape (len(y_centers), len(x_centers)),
+        as a heatmap expects; all are empty if no pair can be placed on the axes
+    """
+    x_edges = get_bin_edges(x, x_log, bins)
+    y_edges = get_bin_edges(y, y_log, bins)
+    if x_edges is None or y_edges is None:
+        return np.zeros((0, 0), dtype=np.int64), np.empty(0), np.empty(0)
+
+    x_positions = get_bin_positions(x, x_edges, x_log)
+    y_positions = get_bin_positions(y, y_edges, y_log)
+    valid = (x_positions >= 0) & (y_positions >= 0)
+    cells = y_positions[valid] * bins + x_positions[valid]
+    counts = np.bincount(cells, minlength=bins * bins).reshape(bins, bins)
+
+    return counts, get_bin_centers(x_edges, x_log), get_bin_centers(y_edges, y_log)
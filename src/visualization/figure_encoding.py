@@ -0,0 +1,161 @@
+# Fast encoding of figure payloads
+#
+# Dash encodes callback responses (and layouts) with json and the
+# PlotlyJSONEncoder, which turns every numpy array into a Python list of floats
+# first; for large traces that is most of a callback's time. Here
+#
+# - `encode_array` (or `pack_arrays`, for a whole payload) packs a numeric
+#   array as a base64 typed array, {'dtype': 'float32', 'bdata': ...} (plus
+#   'shape' for 2D arrays). That is about a third of the JSON size of float32
+#   data and decodes in the browser without parsing numbers (see unpackTrace
+#   in assets/scatterplot.js); plotly.js does not read this form itself, so
+#   only payloads assembled in the browser may use it, and
+# - `dumps` serializes everything else with orjson, which writes numpy arrays
+#   directly, falling back to the PlotlyJSONEncoder if orjson is missing.
+#
+# `register_callback` registers a Dash callback whose response is serialized by
+# `dumps`, and `benchmark_encoding` compares the encodings of a payload.
+
+import base64
+import json
+import time
+
+import dash
+import numpy as np
+import plotly
+from dash.exceptions import PreventUpdate
+
+import instrumentation
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; json with the PlotlyJSONEncoder is the fallback
+    orjson = None
+
+float32_max = np.finfo(np.float32).max
+int32_range = (np.iinfo(np.int32).min, np.iinfo(np.int32).max)
+
+
+def get_typed_array_dtype(values):
+    """
+    The smallest typed array dtype that holds `values` without losing more than float32 rounding.
+
+    Integers become int32 if they fit, floats become float32 unless they overflow it;
+    anything else is float64.
+    """
+    if values.dtype.kind in 'iub' and (len(values) == 0 or int32_range[0] <= values.min() <= values.max()
+                                       <= int32_range[1]):
+        return 'int32'
+    if values.dtype == np.float32:
+        return 'float32'
+    finite = values[np.isfinite(values)] if values.dtype.kind == 'f' else values
+    if values.dtype.kind == 'f' and (len(finite) == 0 or np.abs(finite).max() <= float32_max):
+        return 'float32'
+    return 'float64'
+
+
+def encode_array(values, dtype=None):
+    """
+    Pack a 1D or 2D numeric array as {'dtype', 'bdata'[, 'shape']}: little-endian values, base64 encoded.
+    """
+    values = np.asarray(values)
+    dtype = dtype or get_typed_array_dtype(values)
+    data = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()
+    encoded = dict(dtype=dtype, bdata=base64.b64encode(data).decode('ascii'))
+    if values.ndim > 1:
+        encoded['shape'] = list(values.shape)
+    return encoded
+
+
+def pack_arrays(value):
+    """Copy of `value` (nested dicts and lists) with its numeric numpy arrays packed by `encode_array`."""
+    if isinstance(value, dict):
+        return {key: pack_arrays(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [pack_arrays(item) for item in value]
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf' and value.ndim <= 2:
+        return encode_array(value)
+    return value
+
+
+def get_json_value(value):
+    """What orjson cannot serialize itself, in the form the PlotlyJSONEncoder would give it."""
+    if hasattr(value, 'to_plotly_json'):  # Dash components and plotly figures
+        return value.to_plotly_json()
+    if hasattr(value, 'to_numpy'):  # pandas series and indexes
+        return value.to_numpy()
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind in 'biuf':  # memory maps and non-contiguous arrays: as a plain array
+            return np.ascontiguousarray(value)
+        return value.tolist()
+    return json.loads(json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def dumps(value):
+    """Serialize `value` to JSON bytes (NaN as null, like the PlotlyJSONEncoder)."""
+    if orjson is None:
+        return json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8')
+    return orjson.dumps(value, default=get_json_value, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+def register_callback(app, output, inputs, state=()):
+    """
+    Like `app.callback`, for a single output, but the response is serialized with `dumps`.
+
+    Returns a decorator. Use it before wrapping the callback further (e.g. `ResponseCache.memoize_callback`).
+    """
+    def wrap(func):
+        app.callback(output, inputs, state)(func)
+
+        def encoded_callback(*args, outputs_list=None):
+            value = func(*args)
+            if isinstance(value, type(dash.no_update)):
+                raise PreventUpdate
+            # The response Dash builds for a single output
+            with instrumentation.time_stage('figure_encoding.dumps'):
+                return dumps(dict(response={outputs_list['id']: {outputs_list['property']: value}}, multi=True))
+
+        app.callback_map[get_callback_id(output)]['callback'] = encoded_callback
+        return func
+
+    return wrap
+
+
+def get_callback_id(output):
+    return '{}.{}'.format(output.component_id, output.component_property)
+
+
+def benchmark_encoding(payload, typed_arrays=True, repeat=5):
+    """
+    Time the encodings of `payload` (e.g. a figure dict) and report their sizes.
+
+    Parameters
+    ----------
+    payload : dict
+        as built for Dash, with numpy arrays
+    typed_arrays : bool
+        also time `pack_arrays` followed by `dumps`, which only payloads assembled in the browser may use
+    repeat : int
+        best of `repeat` timings is reported
+
+    Returns
+    -------
+    dict
+        encoding name -> dict(seconds, bytes)
+    """
+    encoders = {'json (PlotlyJSONEncoder)': lambda value: json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder)}
+    if orjson is not None:
+        encoders['orjson'] = dumps
+    if typed_arrays:
+        encoders['typed arrays + ' + ('orjson' if orjson is not None else 'json')] = \
+            lambda value: dumps(pack_arrays(value))
+
+    results = {}
+    for name, encode in encoders.items():
+        seconds = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            encoded = encode(payload)
+            seconds.append(time.perf_counter() - start_time)
+        results[name] = dict(seconds=min(seconds), bytes=len(encoded))
+    return results
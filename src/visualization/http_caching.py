@@ -0,0 +1,150 @@
+# HTTP compression and revalidation of the Dash responses
+#
+# Dash already compresses responses with flask-compress (gzip, or brotli when the
+# installed version supports it), but only after building and encoding them on
+# every request. The layouts of these apps never change once the data is
+# loaded, so they are serialized and compressed once (`precompress_layout`),
+# when the app is built or in the background, and the stored bytes are served
+# as is. Every JSON response also gets a content-hash ETag (`add_etags`), and a
+# GET whose If-None-Match still matches is answered with an empty 304.
+
+import gzip
+import hashlib
+
+import flask
+
+import app_loading
+import figure_encoding
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Compression runs once per layout, so favour size; brotli's top quality (11) takes seconds on a
+# megabyte of scatterplot data for a couple of percent
+gzip_level = 9
+brotli_quality = 9
+# Above large_body_bytes, quality 9 gains well under a percent over 5 and is ~40x slower (~20s
+# against 0.5s on 20 MB of base64 float32 arrays)
+large_body_bytes = 1024 ** 2
+large_body_brotli_quality = 5
+
+
+def get_etag(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def matches_etag(request, etag):
+    """
+    Whether the request's If-None-Match names `etag`, also in the "<etag>:<encoding>" form
+    flask-compress gives the ETags of the responses it compresses.
+    """
+    return any(tag == etag or tag.startswith(etag + ':') for tag in request.if_none_match.as_set())
+
+
+def not_modified(response):
+    """The 304 answer to a revalidation of `response`: no body, only the validator headers."""
+    headers = {name: response.headers[name] for name in ['ETag', 'Vary', 'Cache-Control'] if name in response.headers}
+    return flask.Response(status=304, headers=headers)
+
+
+def choose_encoding(accept_encoding, encodings):
+    """Pick the best of `encodings` ('br' over 'gzip') the client accepts, or 'identity'."""
+    accepted = {encoding.split(';')[0].strip() for encoding in accept_encoding.lower().split(',')}
+    for encoding in ['br', 'gzip']:
+        if encoding in encodings and encoding in accepted:
+            return encoding
+    return 'identity'
+
+
+def get_brotli_quality(body):
+    return brotli_quality if len(body) <= large_body_bytes else large_body_brotli_quality
+
+
+class PrecompressedBody:
+    """
+    A response body compressed once, up front, with every encoding available here.
+
+    `quality` is the brotli quality (None: `get_brotli_quality`, lower for large bodies).
+    """
+
+    def __init__(self, body, mimetype='application/json', quality=None):
+        self.mimetype = mimetype
+        self.etag = get_etag(body)
+        self.encodings = dict(identity=body, gzip=gzip.compress(body, compresslevel=gzip_level))
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(body, quality=quality or get_brotli_quality(body))
+
+    def make_response(self, request):
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''), self.encodings)
+        response = flask.Response(self.encodings[encoding], mimetype=self.mimetype)
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'  # cached, but revalidated with the ETag
+        if encoding == 'identity':
+            response.set_etag(self.etag)
+        else:
+            # Tagged per encoding like flask-compress does, which leaves responses that already
+            # have a Content-Encoding alone
+            response.set_etag(self.etag + ':' + encoding)
+            response.headers['Content-Encoding'] = encoding
+        if matches_etag(request, self.etag):
+            return not_modified(response)
+        return response
+
+
+def get_layout_body(app):
+    return figure_encoding.dumps(app._layout_value())
+
+
+def precompress_layout(app, name, quality=None):
+    """
+    Serve the app's layout from a copy serialized and compressed once (with brotli `quality`, see
+    `PrecompressedBody`).
+
+    The layout must not change afterwards. Returns the `app_loading.LazyData` of the
+    precompressed layout; loading it loads the app's data (`app.data`) first, so its
+    `warm_up` prepares both. Load it when the app is built (see wsgi.py) or warm it up: until
+    it is ready, requests get the layout the usual way and start precompressing it in the
+    background, so that no request waits for the compression.
+    """
+    def load():
+        app.data.get()
+        return PrecompressedBody(get_layout_body(app), quality=quality)
+
+    layout = app_loading.LazyData(name + ' layout', load, report_memory=False)
+    route = app.config.routes_pathname_prefix + '_dash-layout'
+    serve_uncompressed_layout = app.server.view_functions[route]
+
+    def serve_layout():
+        if layout.loaded:
+            return layout.get().make_response(flask.request)
+        layout.warm_up()
+        return serve_uncompressed_layout()
+
+    app.server.view_functions[route] = serve_layout
+    return layout
+
+
+def add_etags(server):
+    """
+    Give every JSON response of `server` a content-hash ETag, and answer matching GET revalidations with a 304.
+
+    Callback responses are POSTs, which browsers do not revalidate, but the ETag still lets a
+    caching proxy (or a client that keeps the previous figure) tell that nothing changed.
+    """
+
+    # Registered after flask-compress, so this runs first and hashes the uncompressed body
+    @server.after_request
+    def set_etag(response):
+        if (response.status_code != 200 or response.mimetype != 'application/json' or response.is_streamed
+                or 'Content-Encoding' in response.headers or response.get_etag()[0] is not None):
+            return response
+
+        etag = get_etag(response.get_data())
+        response.set_etag(etag)
+        if flask.request.method in ('GET', 'HEAD'):
+            response.headers['Cache-Control'] = 'no-cache'
+            if matches_etag(flask.request, etag):
+                return not_modified(response)
+        return response
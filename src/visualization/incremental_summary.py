@@ -0,0 +1,229 @@
+# Incremental per-cohort summary state for the donor barplot
+#
+# The state directory holds the fine (age bin, ylw bin) cohort summaries from
+# `quantile_sketch` (moments + quantile sketches) and a small JSON file with a
+# version counter. Delta files of new or updated donors are folded into only the
+# cohorts they touch, so a refresh costs time proportional to the delta rather
+# than the population. When a donor key column is configured, the last values of
+# every donor are kept in SQLite so that an updated donor replaces its old row.
+#
+# Delta files are applied once, by name, so they must be complete when they
+# appear: write them under a temporary name (starting with '.' or ending in
+# `partial_suffixes`) and rename them into place when done.
+
+import fcntl
+import json
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+
+import numpy as np
+
+import quantile_sketch
+
+state_file_name = 'state.json'
+summaries_file_name = 'cohorts.pkl'
+donors_file_name = 'donors.sqlite'
+lock_file_name = '.lock'
+# Delta files still being written (as are names starting with '.')
+partial_suffixes = ('.tmp', '.part')
+
+# Number of donor keys looked up per SQLite query
+key_batch_size = 500
+
+
+def _write_atomically(path, data, mode='wb'):
+    with tempfile.NamedTemporaryFile(mode, dir=os.path.dirname(path), delete=False) as output_file:
+        output_file.write(data)
+    os.replace(output_file.name, path)
+
+
+def get_state_version(state_dir):
+    """Version of the state on disk (0 if there is none); cheap enough to poll."""
+    try:
+        with open(os.path.join(state_dir, state_file_name)) as state_file:
+            return json.load(state_file)['version']
+    except FileNotFoundError:
+        return 0
+
+
+class SummaryState:
+    """
+    Fine cohort summaries plus the bookkeeping needed to apply deltas.
+
+    Use `SummaryState.open` to load or create the state, `apply_chunks` to fold in
+    categorized donor chunks and `save` to publish a new version.
+
+    `needs_seed` is True for a state started empty (none on disk, or one with other settings), until
+    it is first saved: its summaries should be seeded from the full donor file. Its version still
+    follows the one on disk, so that other processes pick up the reseeded state as a newer version.
+    """
+
+    def __init__(self, state_dir, metrics, rank_error, key_column, version=0, applied_deltas=(), summaries=None,
+                 needs_seed=False):
+        self.state_dir = state_dir
+        self.metrics = list(metrics)
+        self.rank_error = rank_error
+        self.key_column = key_column
+        self.version = version
+        self.applied_deltas = list(applied_deltas)
+        self.summaries = summaries if summaries is not None else {}
+        self.needs_seed = needs_seed
+        self._donors = None
+        self._donors_pid = None
+        # The state is loaded on one thread and refreshed on request threads
+        self._donors_lock = threading.RLock()
+
+    @classmethod
+    def open(cls, state_dir, metrics, rank_error=quantile_sketch.default_rank_error, key_column=None):
+        """Load the state in `state_dir`, or start an empty one if it does not exist or its settings differ."""
+        state_path = os.path.join(state_dir, state_file_name)
+        if os.path.exists(state_path):
+            with open(state_path) as state_file:
+                state = json.load(state_file)
+            if state['metrics'] == list(metrics) and state['rank_error'] == rank_error \
+                    and state['key_column'] == key_column:
+                with open(os.path.join(state_dir, summaries_file_name), 'rb') as summaries_file:
+                    summaries = pickle.load(summaries_file)
+                return cls(state_dir, metrics, rank_error, key_column, state['version'],
+                           state['applied_deltas'], summaries)
+
+        os.makedirs(state_dir, exist_ok=True)
+        if os.path.exists(os.path.join(state_dir, donors_file_name)):
+            os.remove(os.path.join(state_dir, donors_file_name))
+        return cls(state_dir, metrics, rank_error, key_column, get_state_version(state_dir), needs_seed=True)
+
+    @property
+    def donors(self):
+        # The connection is shared by threads (under _donors_lock) but not across a fork (e.g. into the
+        # workers of a preloading server): a child process opens its own
+        if self._donors is None or self._donors_pid != os.getpid():
+            self._donors = sqlite3.connect(os.path.join(self.state_dir, donors_file_name), check_same_thread=False)
+            self._donors_pid = os.getpid()
+            self._donors.execute("CREATE TABLE IF NOT EXISTS donors "
+                                 "(key TEXT PRIMARY KEY, age_position INTEGER, ylw_position INTEGER, metric_values BLOB)")
+        return self._donors
+
+    def _retract_previous(self, keys):
+        """Remove the earlier rows of donors that are being re-sent."""
+        previous = []
+        for start in range(0, len(keys), key_batch_size):
+            batch = keys[start:start + key_batch_size]
+            query = "SELECT age_position, ylw_position, metric_values FROM donors WHERE key IN ({})".format(
+                ",".join("?" * len(batch)))
+            previous.extend(self.donors.execute(query, batch).fetchall())
+
+        retracted = {}
+        for age_position, ylw_position, metric_values in previous:
+            retracted.setdefault((age_position, ylw_position), []).append(np.frombuffer(metric_values, np.float32))
+        for cohort, rows in retracted.items():
+            self.summaries[cohort].remove(np.vstack(rows))
+
+    def _record_donors(self, keys, age_positions, ylw_positions, values):
+        self.donors.executemany(
+            "INSERT OR REPLACE INTO donors VALUES (?, ?, ?, ?)",
+            ((key, int(age_position), int(ylw_position), row.tobytes())
+             for key, age_position, ylw_position, row in zip(keys, age_positions, ylw_positions, values)))
+
+    def apply_chunks(self, chunks):
+        """
+        Fold categorized donor chunks (see `ingest.add_cohorts`) into the cohort summaries.
+        """
+        with self._donors_lock:
+            self._apply_chunks(chunks)
+
+    def _apply_chunks(self, chunks):
+        k = quantile_sketch.get_sketch_size(self.rank_error)
+        for index, chunk in enumerate(chunks):
+            if self.key_column is not None:
+                # A donor sent twice in a chunk counts once, with its last row (as if sent in two chunks)
+                keys = chunk[self.key_column].astype(str)
+                chunk = chunk[~keys.duplicated(keep='last').to_numpy()]
+            age_positions = chunk['Age Category'].cat.codes.to_numpy()
+            ylw_positions = chunk['Years Living With Category'].cat.codes.to_numpy()
+            values = chunk[self.metrics].to_numpy(dtype=np.float32)
+
+            if self.key_column is not None:
+                keys = chunk[self.key_column].astype(str).tolist()
+                self._retract_previous(keys)
+                self._record_donors(keys, age_positions, ylw_positions, values)
+
+            quantile_sketch.merge_cohort_summaries(
+                self.summaries,
+                quantile_sketch.summarize_cohorts(age_positions, ylw_positions, values, k,
+                                                  self.version * 1000 + index))
+
+    def save(self):
+        """Write the summaries and publish them as a new version."""
+        with self._donors_lock:
+            if self._donors is not None and self._donors_pid == os.getpid():
+                self._donors.commit()
+        self.version += 1
+        self.needs_seed = False
+        _write_atomically(os.path.join(self.state_dir, summaries_file_name), pickle.dumps(self.summaries))
+        state = dict(version=self.version, applied_deltas=self.applied_deltas, metrics=self.metrics,
+                     rank_error=self.rank_error, key_column=self.key_column)
+        _write_atomically(os.path.join(self.state_dir, state_file_name), json.dumps(state), mode='w')
+
+
+def is_partial_delta(name):
+    return name.startswith('.') or name.endswith(partial_suffixes)
+
+
+def apply_pending_deltas(state, delta_dir, read_chunks):
+    """
+    Apply the delta files in `delta_dir` that have not been applied yet, oldest first.
+
+    Files starting with '.' or ending in `partial_suffixes` are being written and are left for later.
+
+    Parameters
+    ----------
+    state : SummaryState
+    delta_dir : str
+        directory that new/updated donor files are dropped into
+    read_chunks : callable
+        called with a file path; yields categorized donor chunks
+
+    Returns
+    -------
+    list of str
+        names of the delta files applied
+    """
+    if delta_dir is None or not os.path.isdir(delta_dir):
+        return []
+
+    # Serialize appliers (e.g. several app workers) on the same state
+    with open(os.path.join(state.state_dir, lock_file_name), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if get_state_version(state.state_dir) != state.version:
+            # Someone else published a newer version; start from it
+            state.__dict__.update(SummaryState.open(state.state_dir, state.metrics, state.rank_error,
+                                                    state.key_column).__dict__)
+
+        delta_paths = [entry.path for entry in os.scandir(delta_dir)
+                       if entry.is_file() and not is_partial_delta(entry.name)
+                       and entry.name not in state.applied_deltas]
+        delta_paths.sort(key=os.path.getmtime)
+        for delta_path in delta_paths:
+            state.apply_chunks(read_chunks(delta_path))
+            state.applied_deltas.append(os.path.basename(delta_path))
+        if delta_paths:
+            state.save()
+
+    return [os.path.basename(delta_path) for delta_path in delta_paths]
+
+
+def refresh_state(state, delta_dir, read_chunks):
+    """
+    Bring `state` up to date: apply pending deltas and pick up versions published by other processes.
+
+    Returns True if the summaries changed.
+    """
+    version = state.version
+    apply_pending_deltas(state, delta_dir, read_chunks)
+    if get_state_version(state.state_dir) != state.version:
+        state.__dict__.update(SummaryState.open(state.state_dir, state.metrics, state.rank_error,
+                                                state.key_column).__dict__)
+    return state.version != version
@@ -0,0 +1,156 @@
+# Chunked ingestion of aggregate-cgm-stats files
+#
+# Files are read in chunks with only the columns the apps use and explicit
+# compact dtypes (float32 values, categorical strings). Each stage is a
+# generator over chunks, so the wide, float64/object version of the file is
+# never held in memory at once.
+#
+# Anywhere a file path is accepted, a columnar store made by `convert_to_store`
+# (see convert-donor-stats.py) can be used instead; its columns are memory
+# mapped and only the requested ones are read.
+
+import os
+
+import pandas as pd
+
+import cohorts
+import columnar
+import data_cache
+import instrumentation
+
+default_chunk_size = 250000
+
+# Donor columns used for cohort binning and filtering
+age_column = 'age'
+ylw_column = 'ylw'
+category_column = 'category'
+
+# Raw metric column -> name shown on the graphs
+metric_catalog = {
+    'mean': 'Average',
+    'std': 'Standard Deviation',
+    'cv': 'Coefficient of Variation',
+    'percent.cgm < 54': 'Percent below 54',
+    'percent.70 <= cgm <= 180': 'Percent in range (70-180)',
+    'percent.180 < cgm <= 250': 'Percent between 180-250',
+    'percent.cgm > 250': 'Percent above 250',
+    'gmi': "Glucose Management Index",
+    'percent.cgm < 40': "Percent below 40",
+    'percent.cgm < 70': "Percent below 70",
+    'percent.cgm > 140': "Percent above 140",
+    'percent.cgm > 180': "Percent above 180",
+    'percent.cgm > 300': "Percent above 300",
+    'percent.cgm > 400': "Percent above 400",
+    'percent.40 <= cgm < 54': 'Percent between 40-54',
+    'percent.54 <= cgm < 70': 'Percent between 54-70',
+    'percent.70 <= cgm <= 140': 'Percent between 70-140',
+    'percent.250 < cgm <= 400': 'Percent between 250-400',
+    'avgDuration.episode.cgm < 40': 'Episodes < 40, Average Duration',
+    'avgDuration.episode.cgm < 54': 'Episodes < 54, Average Duration',
+    'avgDuration.episode.cgm < 70': 'Episodes < 70, Average Duration',
+}
+
+
+def get_raw_metric_columns(metrics):
+    """Return the raw column names of display-named metrics."""
+    raw_columns = {name: column for column, name in metric_catalog.items()}
+    return [raw_columns[metric] for metric in metrics]
+
+
+def get_dtypes(columns, string_columns=(), categorical_columns=()):
+    """
+    Compact dtypes: categorical for the donor category and `categorical_columns`, float32 for everything
+    but `string_columns`.
+    """
+    dtypes = {column: 'category' if column == category_column or column in categorical_columns else 'float32'
+              for column in columns}
+    dtypes.update({column: str for column in string_columns if column in dtypes})
+    return dtypes
+
+
+def get_available_columns(file_path, columns):
+    """Return the requested columns that exist in the file (or store), in file order."""
+    if columnar.is_frame_directory(file_path):
+        header = columnar.ColumnStore(file_path).columns
+    else:
+        header = pd.read_csv(file_path, nrows=0).columns
+    return [column for column in header if column in columns]
+
+
+def get_numeric_columns(file_path, sample_size=default_chunk_size):
+    """
+    Return the numeric columns of the file (or store), in file order: for a file, those of its first
+    `sample_size` rows that pandas reads as numbers (as `convert_to_store` detects text columns).
+    """
+    if columnar.is_frame_directory(file_path):
+        return [column['name'] for column in columnar.ColumnStore(file_path).schema['columns']
+                if column['kind'] == 'numeric']
+    sample = pd.read_csv(file_path, nrows=sample_size)
+    return [column for column in sample.columns if pd.api.types.is_numeric_dtype(sample[column].dtype)]
+
+
+def read_chunks(file_path, columns, chunk_size=default_chunk_size, string_columns=(), categorical_columns=()):
+    """
+    Yield the file in chunks of `chunk_size` rows, reading only `columns` (those present) with compact dtypes.
+    """
+    if columnar.is_frame_directory(file_path):
+        # Already compact; string columns come back as categoricals
+        yield from columnar.ColumnStore(file_path).iter_chunks(columns, chunk_size)
+        return
+
+    usecols = get_available_columns(file_path, columns)
+    reader = pd.read_csv(file_path, usecols=usecols, dtype=get_dtypes(usecols, string_columns, categorical_columns),
+                         chunksize=chunk_size)
+    for chunk in reader:
+        yield chunk
+
+
+def convert_to_store(file_path, store_dir, chunk_size=default_chunk_size):
+    """
+    Convert an aggregate-cgm-stats file into a memory-mappable columnar store.
+
+    Every column is kept: text columns (detected from the first chunk) become
+    categoricals and all others float32. The content hash of the source file is
+    recorded in the schema, so caches keyed on the store follow the source data.
+
+    Returns the number of rows converted.
+    """
+    sample = pd.read_csv(file_path, nrows=chunk_size)
+    string_columns = [column for column in sample.columns
+                      if not pd.api.types.is_numeric_dtype(sample[column].dtype)]
+    dtypes = {column: 'category' if column in string_columns else 'float32' for column in sample.columns}
+
+    chunks = pd.read_csv(file_path, dtype=dtypes, chunksize=chunk_size)
+    metadata = dict(source=os.path.basename(file_path), source_hash=data_cache.hash_file(file_path))
+    columnar.save_chunks(chunks, store_dir, metadata)
+
+    return len(columnar.ColumnStore(store_dir))
+
+
+def filter_category(chunks, category):
+    """Keep only the rows of the given donor category and drop the category column."""
+    for chunk in chunks:
+        yield chunk.loc[chunk[category_column] == category].drop(columns=[category_column])
+
+
+def add_cohorts(chunks, age_column=age_column, ylw_column=ylw_column,
+                age_bin_edges=cohorts.default_age_bin_edges, ylw_bin_edges=cohorts.default_ylw_bin_edges):
+    """Add the cohort code and label columns (see `cohorts.add_cohort_columns`) to every chunk."""
+    for chunk in chunks:
+        with instrumentation.time_stage('ingest.add_cohorts'):
+            chunk = cohorts.add_cohort_columns(chunk, age_column, ylw_column, age_bin_edges, ylw_bin_edges)
+        yield chunk
+
+
+def concat_chunks(chunks):
+    """Concatenate chunks, keeping categorical columns categorical."""
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame()
+    df = pd.concat(chunks, ignore_index=True)
+    # Categoricals with differing observed categories come back as object; restore them
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype) \
+                and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
@@ -0,0 +1,386 @@
+# Latency instrumentation of the Dash apps
+#
+# Pipeline stages (`time_stage` / `timed`) and Dash callbacks
+# (`instrument_app`) record their durations in latency histograms, which the
+# app's Flask server exposes in the Prometheus text format at /metrics, so
+# percentiles (e.g. p99) can be computed and alerted on. Callback histograms
+# are labeled by the callback output and, optionally, some of its inputs (e.g.
+# the indicator pair). Callback responses also carry a Server-Timing header
+# with the stages that ran for them, which shows up in the browser's devtools.
+#
+# With DASH_PROFILE_SLOWEST=<n> in the environment, every request is run under
+# cProfile and the profiles of the n slowest are kept, served at /profiles.
+#
+# Stages also account for memory: the RSS growth of each run and the process's
+# peak RSS after it, and, if tracemalloc is tracing (run with
+# PYTHONTRACEMALLOC=1), the Python allocations a run kept and its allocation
+# peak (Python 3.9+). Outside requests (i.e. while loading data), a stage that
+# raises the peak RSS is logged as it finishes, so the last such line before an
+# out-of-memory kill names the stage that got there; `get_memory_report`
+# summarizes every stage, and /memory serves it.
+#
+# The histograms live in the process; with several WSGI workers each one
+# reports its own.
+
+import contextlib
+import cProfile
+import functools
+import heapq
+import io
+import itertools
+import logging
+import os
+import pstats
+import re
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+import flask
+
+# Upper bounds of the histogram buckets, in seconds
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+profile_slowest = int(os.environ.get('DASH_PROFILE_SLOWEST', '0'))
+profile_lines = 40
+
+page_size = resource.getpagesize()
+# Peak RSS increases smaller than this are not logged
+peak_rss_log_bytes = 16 * 1024 ** 2
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    Counts of observed values per bucket, with their sum (Prometheus histogram semantics).
+    """
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = next((index for index, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_cumulative_counts(self):
+        return list(itertools.accumulate(self.counts))
+
+
+class MetricsRegistry:
+    """
+    Histograms by metric name and label values, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.descriptions = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, description, value, **labels):
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self._lock:
+            self.descriptions[name] = description
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def get_histogram(self, name, **labels):
+        return self.histograms.get((name, tuple(sorted((label, str(label_value))
+                                                       for label, label_value in labels.items()))))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, description in sorted(self.descriptions.items()):
+                lines += ['# HELP {} {}'.format(name, description), '# TYPE {} histogram'.format(name)]
+                for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    bounds = ['{:g}'.format(bound) for bound in histogram.buckets] + ['+Inf']
+                    for bound, count in zip(bounds, histogram.get_cumulative_counts()):
+                        lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', bound),)), count))
+                    lines.append('{}_sum{} {!r}'.format(name, format_labels(labels), histogram.sum))
+                    lines.append('{}_count{} {}'.format(name, format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join('{}="{}"'.format(name, value) for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def get_label_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+registry = MetricsRegistry()
+
+
+def get_peak_rss():
+    """Peak resident set size of this process so far, in bytes."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def get_rss():
+    """Current resident set size of this process, in bytes (the peak where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * page_size
+    except OSError:
+        return get_peak_rss()
+
+
+def format_bytes(size):
+    return '{:,.0f} MB'.format(size / 1024 ** 2)
+
+
+class StageMemory:
+    """
+    Memory use of the runs of one pipeline stage; the largest of each measure over the runs.
+
+    `traced_kept_bytes` and `traced_peak_bytes` (Python allocations kept at the end of a run, and
+    the peak of them during it, above the start) are None unless tracemalloc was tracing.
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.rss_increase_bytes = 0
+        self.peak_rss_bytes = 0
+        self.traced_kept_bytes = None
+        self.traced_peak_bytes = None
+
+    def add(self, rss_increase, peak_rss, traced_kept=None, traced_peak=None):
+        self.runs += 1
+        self.rss_increase_bytes = max(self.rss_increase_bytes, rss_increase)
+        self.peak_rss_bytes = max(self.peak_rss_bytes, peak_rss)
+        if traced_kept is not None:
+            self.traced_kept_bytes = max(self.traced_kept_bytes or 0, traced_kept)
+        if traced_peak is not None:
+            self.traced_peak_bytes = max(self.traced_peak_bytes or 0, traced_peak)
+
+    def describe(self):
+        description = 'RSS +{} (process peak {})'.format(format_bytes(self.rss_increase_bytes),
+                                                         format_bytes(self.peak_rss_bytes))
+        if self.traced_kept_bytes is not None:
+            description += ', allocations kept {}'.format(format_bytes(self.traced_kept_bytes))
+        if self.traced_peak_bytes is not None:
+            description += ', allocation peak +{}'.format(format_bytes(self.traced_peak_bytes))
+        return description
+
+
+stage_memory = {}
+_memory_lock = threading.Lock()
+_logged_peak_rss = 0
+# [traced bytes at the start, peak traced bytes so far] of the stages running, with tracemalloc
+_traced_stages = []
+
+
+def _start_traced_stage():
+    if not tracemalloc.is_tracing():
+        return None
+    with _memory_lock:
+        current, peak = tracemalloc.get_traced_memory()
+        entry = [current, current]
+        if hasattr(tracemalloc, 'reset_peak'):
+            # The peak is process wide: fold it into the enclosing stages before restarting it
+            for traced_stage in _traced_stages:
+                traced_stage[1] = max(traced_stage[1], peak)
+            tracemalloc.reset_peak()
+        else:
+            entry[1] = None
+        _traced_stages.append(entry)
+        return entry
+
+
+def _finish_traced_stage(entry):
+    if entry is None:
+        return None, None
+    with _memory_lock:
+        _traced_stages.remove(entry)
+        if not tracemalloc.is_tracing():
+            return None, None
+        current, peak = tracemalloc.get_traced_memory()
+        if entry[1] is None:
+            return current - entry[0], None
+        peak = max(entry[1], peak)
+        for traced_stage in _traced_stages:
+            traced_stage[1] = max(traced_stage[1], peak)
+        return current - entry[0], peak - entry[0]
+
+
+def record_stage_memory(stage, rss_increase, peak_rss, traced_kept=None, traced_peak=None):
+    global _logged_peak_rss
+    with _memory_lock:
+        if stage not in stage_memory:
+            stage_memory[stage] = StageMemory()
+        stage_memory[stage].add(rss_increase, peak_rss, traced_kept, traced_peak)
+        log_peak = not flask.has_request_context() and peak_rss >= _logged_peak_rss + peak_rss_log_bytes
+        if log_peak:
+            _logged_peak_rss = peak_rss
+    if log_peak:
+        logger.info("Peak RSS %s after %s", format_bytes(peak_rss), stage)
+
+
+def get_memory_report():
+    """One line per pipeline stage run so far, with its memory use (see `StageMemory`)."""
+    with _memory_lock:
+        lines = ['{} ({} runs): {}'.format(stage, memory.runs, memory.describe())
+                 for stage, memory in sorted(stage_memory.items())]
+    return '\n'.join(['Memory by stage (current RSS {}):'.format(format_bytes(get_rss()))] + lines)
+
+
+@contextlib.contextmanager
+def time_stage(stage):
+    """
+    Time the block as pipeline stage `stage` (e.g. 'barplot.summarize'), and account for its memory.
+
+    Within a request the stage is also reported in the response's Server-Timing header.
+    """
+    start_rss = get_rss()
+    traced_entry = _start_traced_stage()
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start_time
+        registry.observe('dash_stage_seconds', "Duration of pipeline stages.", seconds, stage=stage)
+        if flask.has_request_context() and 'stage_timings' in flask.g:
+            flask.g.stage_timings.append((stage, seconds))
+        record_stage_memory(stage, get_rss() - start_rss, get_peak_rss(), *_finish_traced_stage(traced_entry))
+
+
+def timed(stage):
+    """Decorator timing every call of a function as pipeline stage `stage`."""
+    def decorate(func):
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            with time_stage(stage):
+                return func(*args, **kwargs)
+        return timed_func
+    return decorate
+
+
+def get_server_timing(stage_timings, total_seconds):
+    # Server-Timing metric names are tokens; the stage names go in the descriptions
+    entries = ['stage{};dur={:.3f};desc="{}"'.format(index, seconds * 1000, stage)
+               for index, (stage, seconds) in enumerate(stage_timings)]
+    return ', '.join(entries + ['total;dur={:.3f}'.format(total_seconds * 1000)])
+
+
+class SlowestProfiles:
+    """
+    The cProfile reports of the `n` slowest requests seen.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self._heap = []  # (seconds, sequence, description, report), fastest first
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, seconds, description, profile):
+        with self._lock:
+            if len(self._heap) >= self.n and seconds <= self._heap[0][0]:
+                return
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(profile_lines)
+        with self._lock:
+            heapq.heappush(self._heap, (seconds, next(self._sequence), description, report.getvalue()))
+            if len(self._heap) > self.n:
+                heapq.heappop(self._heap)
+
+    def render(self):
+        with self._lock:
+            slowest = sorted(self._heap, reverse=True)
+        return '\n'.join('{:.3f}s {}\n{}'.format(seconds, description, report)
+                         for seconds, _, description, report in slowest)
+
+
+def get_callback_labels(body, label_inputs):
+    """Labels of a callback request: its output and the values of the inputs in `label_inputs[output]`."""
+    output = body.get('output', '')
+    labels = dict(callback=output)
+    input_values = {item.get('id'): item.get('value') for item in body.get('inputs', [])}
+    for input_id in label_inputs.get(output, []):
+        labels[get_label_name(input_id)] = input_values.get(input_id)
+    return labels
+
+
+def instrument_app(app, label_inputs=None):
+    """
+    Time every request to `app`, add Server-Timing headers to callback responses, and serve /metrics
+    and /memory.
+
+    Parameters
+    ----------
+    app : dash.Dash
+    label_inputs : dict, optional
+        callback output (e.g. 'graph.figure') -> input ids whose values label its latency histogram;
+        keep to inputs with few distinct values
+    """
+    label_inputs = label_inputs or {}
+    server = app.server
+    callback_path = app.config.routes_pathname_prefix + '_dash-update-component'
+    profiles = SlowestProfiles(profile_slowest) if profile_slowest > 0 else None
+
+    @server.before_request
+    def start_request():
+        flask.g.request_start_time = time.perf_counter()
+        flask.g.stage_timings = []
+        if profiles is not None:
+            flask.g.profile = cProfile.Profile()
+            flask.g.profile.enable()
+
+    # Registered after Dash's own hooks (compression, ETags), so this runs before them
+    @server.after_request
+    def finish_request(response):
+        if 'request_start_time' not in flask.g:
+            return response
+        seconds = time.perf_counter() - flask.g.request_start_time
+        description = flask.request.path
+
+        if flask.request.path == callback_path:
+            labels = get_callback_labels(flask.request.get_json(silent=True) or {}, label_inputs)
+            registry.observe('dash_callback_seconds', "Duration of Dash callback requests.", seconds, **labels)
+            response.headers['Server-Timing'] = get_server_timing(flask.g.stage_timings, seconds)
+            description = ' '.join('{}={}'.format(name, value) for name, value in labels.items())
+        else:
+            registry.observe('dash_request_seconds', "Duration of other requests.", seconds,
+                             path=flask.request.url_rule.rule if flask.request.url_rule else 'unmatched')
+
+        profile = flask.g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+            profiles.add(seconds, description, profile)
+        return response
+
+    @server.teardown_request
+    def stop_profile(exception):
+        # After an unhandled exception after_request is skipped; don't leave the profiler running
+        profile = flask.g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+
+    @server.route('/metrics')
+    def metrics():
+        return flask.Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    @server.route('/memory')
+    def memory():
+        return flask.Response(get_memory_report(), mimetype='text/plain')
+
+    if profiles is not None:
+        @server.route('/profiles')
+        def slowest_profiles():
+            return flask.Response(profiles.render(), mimetype='text/plain')
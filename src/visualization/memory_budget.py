@@ -0,0 +1,100 @@
+# Memory budgets for loading the apps' data
+#
+# With a budget (`max_memory` in the app configs, --max-memory on the command
+# line), each app projects the memory its loading stages would take from the
+# size of the input, before reading it, and picks a plan that fits: the whole
+# file in memory when it can, otherwise chunked ingestion (smaller chunks and
+# fewer worker processes as needed) that does not keep the donor frames. An app
+# that cannot fit even that refuses to start with a MemoryError saying why,
+# instead of being killed halfway through loading.
+#
+# The projections are per value (rows x columns read) and were measured on the
+# synthetic files of synthetic_donor_stats.py; instrumentation.get_memory_report
+# shows what the stages actually took.
+
+import gzip
+import os
+import re
+
+import columnar
+from instrumentation import format_bytes
+
+# Peak memory per value read (float32 columns) of building from a frame of the whole file,
+# including the csv parser, cohort columns and summaries or sorted copies
+in_memory_bytes_per_value = 24
+# Peak memory per value of one chunk in flight (parsing, cohort columns, arrays, sketches)
+chunk_bytes_per_value = 48
+# Memory taken by loading besides the data (modules imported, parser and summary state)
+loading_overhead_bytes = 32 * 1024 ** 2
+# Memory of a worker process besides its chunks
+worker_overhead_bytes = 64 * 1024 ** 2
+# Chunks are not made smaller than this
+min_chunk_size = 10000
+
+sample_rows = 20000
+size_units = dict(b=1, k=1024, m=1024 ** 2, g=1024 ** 3, t=1024 ** 4)
+
+
+def parse_memory_size(size):
+    """
+    Bytes of a memory size given as a number of bytes or a string such as '512M', '4G' or '1.5GiB'.
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([bkmgt]?)(i?b)?\s*', size.lower())
+    if match is None:
+        raise ValueError("Invalid memory size: {!r}".format(size))
+    return int(float(match.group(1)) * size_units[match.group(2) or 'b'])
+
+
+def estimate_rows(file_path):
+    """
+    Number of rows of a donor stats file or store; for csv files, projected from the bytes per row
+    of the first `sample_rows` rows (after compression, for .gz files).
+    """
+    if columnar.is_frame_directory(file_path):
+        return len(columnar.ColumnStore(file_path))
+
+    with open(file_path, 'rb') as raw_file:
+        lines = gzip.GzipFile(fileobj=raw_file) if file_path.endswith('.gz') else raw_file
+        lines.readline()  # header
+        rows = 0
+        for _ in lines:
+            rows += 1
+            if rows == sample_rows:
+                # (the position runs ahead by the read buffer, a few kB)
+                return int(os.path.getsize(file_path) * rows / raw_file.tell())
+    return rows
+
+
+def get_in_memory_bytes(rows, columns):
+    """Projected peak memory of building from the whole file (`columns` read) in memory."""
+    return loading_overhead_bytes + rows * columns * in_memory_bytes_per_value
+
+
+def get_chunked_bytes(chunk_size, columns, workers=1):
+    """
+    Projected peak memory of chunked ingestion: the chunk being read, plus, with several workers,
+    each worker process with its chunk.
+    """
+    chunk_bytes = chunk_size * columns * chunk_bytes_per_value
+    if workers > 1:
+        return loading_overhead_bytes + chunk_bytes + workers * (worker_overhead_bytes + chunk_bytes)
+    return loading_overhead_bytes + chunk_bytes
+
+
+def plan_chunks(available, columns, chunk_size, workers=1):
+    """
+    The largest (chunk size, workers), up to the ones given, whose chunked ingestion fits in `available`
+    bytes: fewer workers first, down to reading in-process, then smaller chunks.
+
+    Raises MemoryError if even `min_chunk_size` rows in-process do not fit.
+    """
+    while workers > 1 and get_chunked_bytes(chunk_size, columns, workers) > available:
+        workers -= 1
+    while chunk_size > min_chunk_size and get_chunked_bytes(chunk_size, columns, workers) > available:
+        chunk_size = max(chunk_size // 2, min_chunk_size)
+    if get_chunked_bytes(chunk_size, columns, workers) > available:
+        raise MemoryError("Chunks of {:,} rows need {} but only {} of the memory budget is left".format(
+            chunk_size, format_bytes(get_chunked_bytes(chunk_size, columns)), format_bytes(max(available, 0))))
+    return chunk_size, workers
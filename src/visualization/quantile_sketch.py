@@ -0,0 +1,354 @@
+# Approximate, mergeable summaries for the donor barplot
+#
+# Each (age cohort, ylw cohort) pair keeps exact moments (count/mean/M2/min/max)
+# and a KLL quantile sketch per metric. Chunks of the donor file are summarized
+# in a process pool and merged, and the age, ylw and age x ylw groupings are
+# built by merging the fine cohorts, so memory stays bounded by the sketch size
+# rather than the number of donors.
+
+import collections
+import concurrent.futures
+import os
+
+import numpy as np
+import pandas as pd
+
+import cohorts
+from summary_metrics import default_percentiles, get_stat_names, percentile_label
+
+default_rank_error = 0.005
+
+# The groupings fine (age bin, ylw bin) cohorts can be merged into
+default_groupings = ['Age Category', 'Years Living With Category', 'Age and Years Living With Category']
+
+# Compactor capacities shrink geometrically by this factor per level below the top (KLL paper's c)
+capacity_decay = 2 / 3
+
+
+def get_sketch_size(rank_error=default_rank_error):
+    """Sketch size `k` giving roughly `rank_error` normalized rank error per quantile."""
+    return max(int(np.ceil(2.0 / rank_error)), 8)
+
+
+class QuantileSketch:
+    """
+    KLL quantile sketch over float values with vectorized batch updates.
+
+    Items at level h stand for 2**h input values. A level over its capacity is
+    sorted and every other item (random offset) is promoted to the next level.
+    """
+
+    def __init__(self, k=get_sketch_size(), seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.RandomState(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * capacity_decay ** depth)), 2)
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                leftover = items[len(items) - len(items) % 2:]
+                promoted = items[self._rng.randint(2):len(items) - len(leftover):2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.levels[level] = leftover
+            level += 1
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+
+    def quantiles(self, percentiles, removed=None):
+        """
+        Approximate values at `percentiles` (in [0, 1]); NaN if the sketch is empty.
+
+        Like `describe`, values are linearly interpolated between the closest ranks: an item of
+        weight w stands for w consecutive ranks and sits at the middle one, so a sketch that has
+        not compacted yet gives exactly the `describe` percentiles.
+
+        Items of a `removed` sketch count with negative weight, so values retracted
+        after being added (updated donors) drop out of the rank function.
+        """
+        sketches = [self] if removed is None else [self, removed]
+        signs = [1, -1]
+        n = self.n - (removed.n if removed is not None else 0)
+        if n <= 0:
+            return np.full(len(percentiles), np.nan)
+        items = np.concatenate([items for sketch in sketches for items in sketch.levels])
+        weights = np.concatenate([np.full(len(level_items), sign * 2 ** level)
+                                  for sketch, sign in zip(sketches, signs)
+                                  for level, level_items in enumerate(sketch.levels)])
+        order = np.argsort(items, kind='mergesort')
+        # Negative weights can make the cumulative weight dip; keep it monotone, and keep only the
+        # items that still add weight
+        cumulative_weights = np.maximum.accumulate(np.cumsum(weights[order]))
+        item_weights = np.diff(cumulative_weights, prepend=0)
+        kept = item_weights > 0
+        # 0-based rank of the middle of each item's ranks
+        item_ranks = cumulative_weights[kept] - (item_weights[kept] + 1) / 2
+        return np.interp(np.asarray(percentiles) * (n - 1), item_ranks, items[order][kept])
+
+
+class CohortSummary:
+    """Moments and quantile sketches of every metric for one cohort."""
+
+    def __init__(self, n_metrics, k=get_sketch_size(), seed=None):
+        self.count = np.zeros(n_metrics)
+        self.mean = np.zeros(n_metrics)
+        self.m2 = np.zeros(n_metrics)
+        self.min = np.full(n_metrics, np.nan)
+        self.max = np.full(n_metrics, np.nan)
+        # Independent compaction offsets per sketch so errors do not add up when cohorts are merged
+        seeds = np.random.RandomState(seed).randint(2 ** 31, size=n_metrics)
+        self.sketches = [QuantileSketch(k, sketch_seed) for sketch_seed in seeds]
+        # Sketches of retracted values, created on the first `remove`
+        self.removed_sketches = None
+
+    def _merge_moments(self, count, mean, m2, minimum, maximum):
+        # Chan et al. pairwise update
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self.mean
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0)
+            self.m2 = np.where(total > 0, self.m2 + m2 + delta ** 2 * self.count * count / total, 0)
+        self.count = total
+        self.min = np.fmin(self.min, minimum)
+        self.max = np.fmax(self.max, maximum)
+
+    def update(self, values):
+        """Add a (rows x metrics) block of values."""
+        values = np.asarray(values, dtype=float)
+        count = np.sum(~np.isnan(values), axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            total = np.nansum(values, axis=0)
+            mean = np.where(count > 0, total / np.maximum(count, 1), 0)
+            m2 = np.nansum((values - mean) ** 2, axis=0)
+        has_values = count > 0
+        minimum = np.full(values.shape[1], np.nan)
+        maximum = np.full(values.shape[1], np.nan)
+        minimum[has_values] = np.nanmin(values[:, has_values], axis=0)
+        maximum[has_values] = np.nanmax(values[:, has_values], axis=0)
+        self._merge_moments(count, mean, m2, minimum, maximum)
+        for column, sketch in enumerate(self.sketches):
+            sketch.update(values[:, column])
+
+    def _create_removed_sketches(self):
+        # Seeded from the sketches they shadow, so that the summaries stay reproducible
+        return [QuantileSketch(sketch.k, sketch._rng.randint(2 ** 31)) for sketch in self.sketches]
+
+    def remove(self, values):
+        """
+        Retract a (rows x metrics) block of values that was previously added.
+
+        Count, mean and std are updated exactly; min and max keep covering every value ever
+        added, and quantiles treat the retracted values as negative weights.
+        """
+        values = np.asarray(values, dtype=float)
+        count = np.sum(~np.isnan(values), axis=0)
+        remaining = self.count - count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, np.nansum(values, axis=0) / np.maximum(count, 1), 0)
+            m2 = np.nansum((values - mean) ** 2, axis=0)
+            remaining_mean = np.where(remaining > 0, (self.count * self.mean - count * mean) / remaining, 0)
+            delta = mean - remaining_mean
+            remaining_m2 = np.where(remaining > 0, self.m2 - m2 - delta ** 2 * remaining * count / self.count, 0)
+        self.count = remaining
+        self.mean = remaining_mean
+        self.m2 = np.maximum(remaining_m2, 0)
+
+        if self.removed_sketches is None:
+            self.removed_sketches = self._create_removed_sketches()
+        for column, sketch in enumerate(self.removed_sketches):
+            sketch.update(values[:, column])
+
+    def merge(self, other):
+        self._merge_moments(other.count, other.mean, other.m2, other.min, other.max)
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+        if other.removed_sketches is not None:
+            if self.removed_sketches is None:
+                self.removed_sketches = self._create_removed_sketches()
+            for sketch, other_sketch in zip(self.removed_sketches, other.removed_sketches):
+                sketch.merge(other_sketch)
+
+    def describe(self, percentiles=default_percentiles):
+        """Return stats in `get_stat_names` order, shape (stats, metrics)."""
+        stats = np.full((len(percentiles) + 5, len(self.count)), np.nan)
+        stats[0] = self.count
+        has_values = self.count > 0
+        stats[1, has_values] = self.mean[has_values]
+        has_spread = self.count > 1
+        stats[2, has_spread] = np.sqrt(self.m2[has_spread] / (self.count[has_spread] - 1))
+        stats[3] = self.min
+        removed_sketches = self.removed_sketches or [None] * len(self.sketches)
+        for column, (sketch, removed) in enumerate(zip(self.sketches, removed_sketches)):
+            stats[4:-1, column] = sketch.quantiles(percentiles, removed)
+        stats[-1] = self.max
+        return stats
+
+
+def summarize_cohorts(age_positions, ylw_positions, values, k=get_sketch_size(), seed=None):
+    """
+    Summarize a chunk of donors by fine (age position, ylw position) cohort.
+
+    Positions are 0-based bin positions with -1 for missing (categorical codes).
+    Returns a dict of (age position, ylw position) -> CohortSummary.
+    """
+    age_positions = np.asarray(age_positions, dtype=np.int64)
+    ylw_positions = np.asarray(ylw_positions, dtype=np.int64)
+    n_ylw_keys = ylw_positions.max(initial=0) + 2
+    keys = (age_positions + 1) * n_ylw_keys + (ylw_positions + 1)
+    order = np.argsort(keys, kind='mergesort')
+    group_keys, starts = np.unique(keys[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+
+    seeds = np.random.RandomState(seed).randint(2 ** 31, size=len(group_keys))
+    summaries = {}
+    for key, start, end, cohort_seed in zip(group_keys, starts, ends, seeds):
+        summary = CohortSummary(values.shape[1], k, cohort_seed)
+        summary.update(values[order[start:end]])
+        summaries[(int(key // n_ylw_keys) - 1, int(key % n_ylw_keys) - 1)] = summary
+    return summaries
+
+
+def merge_cohort_summaries(summaries, other):
+    """Merge `other` into `summaries` (both dicts of cohort -> CohortSummary)."""
+    for cohort, summary in other.items():
+        if cohort in summaries:
+            summaries[cohort].merge(summary)
+        else:
+            summaries[cohort] = summary
+    return summaries
+
+
+def _summarize_chunk_arrays(chunk, metrics):
+    return (chunk['Age Category'].cat.codes.to_numpy(),
+            chunk['Years Living With Category'].cat.codes.to_numpy(),
+            chunk[metrics].to_numpy(dtype=np.float32))
+
+
+def summarize_chunks(chunks, metrics, rank_error=default_rank_error, workers=None, seed=0):
+    """
+    Summarize categorized donor chunks (see `ingest.add_cohorts`) in a process pool.
+
+    At most two chunks per worker are in flight, so memory is bounded by the chunk size.
+    Returns the merged dict of fine cohort -> CohortSummary.
+    """
+    k = get_sketch_size(rank_error)
+    workers = workers or os.cpu_count() or 1
+    summaries = {}
+
+    if workers == 1:
+        for index, chunk in enumerate(chunks):
+            merge_cohort_summaries(summaries,
+                                   summarize_cohorts(*_summarize_chunk_arrays(chunk, metrics), k, seed + index))
+        return summaries
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # Merged in chunk order (merges compact the sketches), so the summaries do not depend on
+        # which worker finishes first
+        pending = collections.deque()
+        for index, chunk in enumerate(chunks):
+            pending.append(executor.submit(summarize_cohorts, *_summarize_chunk_arrays(chunk, metrics), k,
+                                           seed + index))
+            if len(pending) >= 2 * workers:
+                merge_cohort_summaries(summaries, pending.popleft().result())
+        while pending:
+            merge_cohort_summaries(summaries, pending.popleft().result())
+
+    return summaries
+
+
+def get_cohort_codes(age_position, ylw_position):
+    """
+    Cohort codes (as `cohorts.add_cohort_columns` numbers them) of a fine cohort in every grouping;
+    None where the cohort has no code (missing age or ylw).
+    """
+    return {
+        'Age Category': age_position + 1 if age_position >= 0 else None,
+        'Years Living With Category': ylw_position + 1 if ylw_position >= 0 else None,
+        'Age and Years Living With Category': (age_position + 1) * cohorts.age_ylw_multiplier + ylw_position + 1
+        if age_position >= 0 and ylw_position >= 0 else None,
+    }
+
+
+def build_approximate_summary_metrics_table(summaries, metrics, groupings=default_groupings,
+                                            percentiles=default_percentiles, seed=0):
+    """
+    Build the `summary_metrics_table` layout (see `summary_metrics.build_summary_metrics_table`)
+    from fine cohort summaries, merging them into the cohorts of `groupings` (any of `default_groupings`).
+
+    The merged sketches are seeded from `seed`, so the same summaries always give the same table.
+    """
+    unknown = [grouping for grouping in groupings if grouping not in default_groupings]
+    if unknown:
+        raise ValueError("Fine cohort summaries cannot be grouped by {}".format(", ".join(unknown)))
+
+    grouped = {grouping: {} for grouping in groupings}
+    for (age_position, ylw_position) in sorted(summaries):
+        summary = summaries[(age_position, ylw_position)]
+        for grouping, code in get_cohort_codes(age_position, ylw_position).items():
+            if code is None or grouping not in grouped:
+                continue
+            if code not in grouped[grouping]:
+                cohort_seed = (seed * len(default_groupings) + default_groupings.index(grouping)) * 2 ** 16 + code
+                grouped[grouping][code] = CohortSummary(len(metrics), summary.sketches[0].k,
+                                                        cohort_seed % 2 ** 32)
+            grouped[grouping][code].merge(summary)
+
+    keys = []
+    rows = []
+    for grouping in groupings:
+        for code in sorted(grouped[grouping]):
+            key = dict.fromkeys(groupings, np.nan)
+            key[grouping] = code
+            keys.append(key)
+            rows.append(grouped[grouping][code].describe(percentiles).T.ravel())
+
+    stat_names = get_stat_names(percentiles)
+    columns = ["{}.{}".format(metric, stat) for metric in metrics for stat in stat_names]
+    data = np.vstack(rows) if rows else np.empty((0, len(columns)))
+    summary_table = pd.concat([pd.DataFrame(keys, columns=groupings, dtype=float),
+                               pd.DataFrame(data, columns=columns)], axis=1)
+    return summary_table
+
+
+def compare_summary_tables(approximate_table, exact_table, metrics, groupings=default_groupings,
+                           percentiles=default_percentiles):
+    """
+    Report how far approximate percentiles are from exact ones.
+
+    Returns one row per (metric, percentile) with the largest absolute error over all
+    cohorts, and that error relative to the metric's exact range (max - min).
+    """
+    merged = pd.merge(exact_table, approximate_table, on=groupings, suffixes=('', '.approximate'))
+    report = []
+    for metric in metrics:
+        metric_range = (merged[metric + '.max'] - merged[metric + '.min']).max()
+        for percentile in percentiles:
+            column = "{}.{}".format(metric, percentile_label(percentile))
+            error = (merged[column + '.approximate'] - merged[column]).abs().max()
+            report.append(dict(metric=metric, percentile=percentile, max_abs_error=error,
+                               max_relative_error=error / metric_range if metric_range else np.nan))
+    return pd.DataFrame(report)
@@ -0,0 +1,86 @@
+# Memoization of Dash callback responses
+#
+# Serialized callback responses are cached in memory, keyed by the callback's
+# (normalized) inputs plus a dataset version, and evicted least-recently-used
+# first once they pass a byte budget. Caching the serialized JSON means a hit
+# skips both building the figure and encoding it, which is most of the cost for
+# large scatterplots. Hit/miss/eviction counters show how well it works.
+
+import functools
+import threading
+from collections import OrderedDict
+
+default_max_bytes = 256 * 1024 ** 2
+
+
+class ResponseCache:
+    """
+    Byte-bounded LRU cache of serialized callback responses.
+    """
+
+    def __init__(self, max_bytes=default_max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+    def put(self, key, response):
+        size = len(response)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (response, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return dict(entries=len(self._entries), bytes=self.bytes, max_bytes=self.max_bytes,
+                        hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        hit_rate=self.hits / requests if requests else 0.0)
+
+    def memoize_callback(self, app, output, version, normalize=lambda *args: args):
+        """
+        Serve repeated requests to the Dash callback of `output` (e.g. 'graph.figure') from the cache.
+
+        Must be called after the callback is registered. Responses are keyed by
+        `normalize(*input_and_state_values)` and `version`, a value or a callable
+        returning the current dataset version; responses for other versions are
+        never returned. Callbacks that raise `PreventUpdate` are not cached.
+        """
+        entry = app.callback_map[output]
+        callback = entry['callback']
+
+        @functools.wraps(callback)
+        def memoized(*args, **kwargs):
+            key = (output, version() if callable(version) else version, normalize(*args))
+            response = self.get(key)
+            if response is None:
+                response = callback(*args, **kwargs)
+                self.put(key, response)
+            return response
+
+        entry['callback'] = memoized
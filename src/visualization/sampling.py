@@ -0,0 +1,60 @@
+# Stratified sampling of donors for point displays
+#
+# Every row gets a random priority key from a seeded generator and each stratum
+# keeps the rows with the smallest keys, which is the result a priority
+# reservoir sampler would reach when streaming the rows. Computing it once at
+# load time keeps the sample stable across callbacks.
+
+import numpy as np
+
+
+def get_priority_keys(n, seed=0):
+    return np.random.RandomState(seed).random_sample(n)
+
+
+def get_stratum_quotas(stratum_sizes, sample_size):
+    """
+    Split `sample_size` over strata in proportion to their sizes (largest remainders), capped by the sizes.
+    """
+    stratum_sizes = np.asarray(stratum_sizes, dtype=np.int64)
+    total = stratum_sizes.sum()
+    if total <= sample_size:
+        return stratum_sizes
+    shares = stratum_sizes * sample_size / total
+    quotas = np.floor(shares).astype(np.int64)
+    remaining = sample_size - quotas.sum()
+    quotas[np.argsort(quotas - shares, kind='mergesort')[:remaining]] += 1
+    return np.minimum(quotas, stratum_sizes)
+
+
+def stratified_sample(strata, sample_size, seed=0):
+    """
+    Sample at most `sample_size` row positions, allocated over strata in proportion to their sizes.
+
+    Parameters
+    ----------
+    strata : np.ndarray
+        non-negative integer stratum of every row
+    sample_size : int
+    seed : int
+        seed of the priority keys; the same seed gives the same sample
+
+    Returns
+    -------
+    np.ndarray
+        sorted row positions of the sample
+    """
+    strata = np.asarray(strata, dtype=np.int64)
+    if len(strata) <= sample_size:
+        return np.arange(len(strata))
+
+    keys = get_priority_keys(len(strata), seed)
+    order = np.lexsort((keys, strata))  # by stratum, then by priority key
+    sorted_strata = strata[order]
+    stratum_values, starts, sizes = np.unique(sorted_strata, return_index=True, return_counts=True)
+    quotas = get_stratum_quotas(sizes, sample_size)
+
+    # Rank of each row within its stratum; keep the quota of smallest keys
+    stratum_index = np.searchsorted(stratum_values, sorted_strata)
+    ranks = np.arange(len(order)) - starts[stratum_index]
+    return np.sort(order[ranks < quotas[stratum_index]])
@@ -0,0 +1,651 @@
+# Dash app factory for the donor scatterplot
+#
+# `create_app(config)` builds the app without reading any data. The dataset is
+# loaded on the first request (or by a warm-up thread) and the callbacks that
+# depend on it are registered then, before the browser asks for them. Modules
+# that import pandas are only imported by the loader, so creating the app (and
+# starting a worker) stays cheap.
+
+import base64
+import functools
+import logging
+import time
+
+import dash
+import dash_core_components as dcc
+import dash_html_components as html
+import flask
+import numpy as np
+from dash.dependencies import ClientsideFunction, Input, Output, State
+
+import app_loading
+import cohort_filters
+import figure_encoding
+import http_caching
+import instrumentation
+import response_cache
+import sampling
+
+logger = logging.getLogger(__name__)
+
+default_config = dict(
+    # './data/2019-07-17-aggregate-cgm-stats.csv', or a store made by convert-donor-stats.py
+    file_path=None,
+    # Formatted frames are cached here (None: data_cache.default_cache_dir)
+    cache_dir=None,
+    # Donor category plotted
+    category="age-ylw",
+    # Replace the age slider with multi-select filters of the donors by filter_dimensions (age bin,
+    # ylw bin, donor category, or any other categorical donor column), resolved through bitmaps of
+    # the rows of every value (see cohort_bitmaps.py). With the 'category' dimension every donor
+    # category is loaded and `category` is the one picked at first. Uses server callbacks.
+    cohort_filters=False,
+    filter_dimensions=['Age Category', 'Years Living With Category', 'category'],
+    # Above density_threshold donors in the selected age category, show either a 2D density
+    # heatmap of density_bins x density_bins cells ('density') or a stratified sample of
+    # sample_size donors ('sample') instead of one marker per donor
+    large_category_display='density',
+    density_threshold=100000,
+    density_bins=100,
+    sample_size=20000,
+    sample_by_ylw=True,
+    # With callback_mode = 'clientside', the values of every indicator (any of them can be picked
+    # for an axis) in every age category are sent to the browser once, in the layout (see
+    # assets/scatterplot.js), and axis/age changes never reach the server. Falls back to server
+    # callbacks if they take more than clientside_data_bytes or an age category is shown as a
+    # density heatmap. The budget is kept small since the whole layout is compressed and sent
+    # before the first plot is drawn.
+    callback_mode='server',
+    clientside_data_bytes=4 * 1024 ** 2,
+    # Traces already served are kept serialized (up to figure_cache_bytes) and reused for
+    # repeated inputs; GET /figure-cache-stats reports the cache counters
+    figure_cache_bytes=response_cache.default_max_bytes,
+    # Serve the indicator arrays from read-only memory maps of the cached frame, so that processes
+    # started from the same cache (e.g. WSGI workers, see wsgi.py) share one copy in the page cache
+    shared_memory=False,
+    # Build the cached frame chunk by chunk (of chunk_size rows; None: ingest.default_chunk_size)
+    # straight to disk, without ever holding all of it in memory
+    chunked_build=False,
+    chunk_size=None,
+    # Memory budget of the process (bytes, or e.g. '4G'). If the frame would not fit in memory,
+    # shared_memory (and if needed chunked_build, with smaller chunks) is turned on; if even that
+    # does not fit, create_app raises a MemoryError. See memory_budget.py
+    max_memory=None,
+    # Serve the layout serialized and compressed (gzip, brotli) once, and give JSON responses
+    # content-hash ETags so that unchanged layouts are revalidated with an empty 304. The layout is
+    # compressed with warm_up (or see wsgi.py), or else in the background after the first request;
+    # layout_brotli_quality=None picks a lower quality for large layouts (see http_caching.py)
+    http_caching=True,
+    layout_brotli_quality=None,
+    # Record latency histograms of the pipeline stages and callbacks (served at /metrics) and add
+    # Server-Timing headers to callback responses; see instrumentation.py
+    instrument=True,
+    # Load the data in a background thread as soon as the app is created
+    warm_up=False,
+    external_stylesheets=['https://codepen.io/chriddyp/pen/bWLwgP.css'],
+)
+
+
+# Functions
+@instrumentation.timed('scatterplot.read_and_format_data')
+def read_and_format_data(file_path, category="age-ylw", dimension_columns=()):
+    import cohorts
+    import ingest
+
+    # Read the numeric columns chunk by chunk with compact dtypes, keeping only the category's rows
+    # (every row, with category None) and the categorical dimension_columns
+    columns = get_read_columns(file_path, dimension_columns)
+    chunks = ingest.read_chunks(file_path, columns, categorical_columns=dimension_columns)
+    if category is not None:
+        chunks = ingest.filter_category(chunks, category)
+    df = ingest.concat_chunks(chunks)
+
+    df['Age Category'] = cohorts.get_category(df['age'], cohorts.default_age_bin_edges)
+
+    # Keep the data wide (one float32 column per indicator), with the rows of each
+    # age category stored contiguously so a callback can slice instead of scan
+    return cohorts.sort_by_cohort(df, 'Age Category')
+
+
+def get_read_columns(file_path, dimension_columns=()):
+    # Every numeric column of the file is an indicator: the catalog metrics, and the describe
+    # statistics (count, min, 25%, ...) too
+    import ingest
+
+    columns = [ingest.age_column, ingest.category_column]
+    columns += [column for column in ingest.get_numeric_columns(file_path) if column not in columns]
+    return columns + [column for column in dimension_columns if column not in columns]
+
+
+def write_formatted_data(file_path, directory, category="age-ylw", chunk_size=None, dimension_columns=()):
+    """
+    Write the frame of `read_and_format_data` to a columnar store in `directory`, chunk by chunk.
+    """
+    import cohorts
+    import columnar
+    import ingest
+
+    # Categories of the dimension columns, collected by the counting pass
+    dimension_categories = {column: set() for column in dimension_columns}
+    read_columns = get_read_columns(file_path, dimension_columns)
+
+    def get_chunks(columns):
+        # The age category (derived from age) and the dimension categories are all the counting pass needs
+        counting = columns is not None
+        if counting:
+            columns = [ingest.age_column, ingest.category_column] + list(dimension_columns)
+        else:
+            columns = read_columns
+        chunks = ingest.read_chunks(file_path, columns, chunk_size or ingest.default_chunk_size,
+                                    categorical_columns=dimension_columns)
+        if category is not None:
+            chunks = ingest.filter_category(chunks, category)
+        for chunk in chunks:
+            chunk['Age Category'] = cohorts.get_category(chunk['age'], cohorts.default_age_bin_edges)
+            for column in dimension_columns:
+                if counting:
+                    dimension_categories[column].update(chunk[column].cat.categories)
+                else:
+                    # Every chunk must have the same categories
+                    chunk[column] = chunk[column].cat.set_categories(sorted(dimension_categories[column]))
+            yield chunk
+
+    with instrumentation.time_stage('scatterplot.write_formatted_data'):
+        columnar.save_sorted_chunks(get_chunks, directory, 'Age Category')
+
+
+def get_dimension_columns(config):
+    # Donor columns kept for the cohort filters (besides age and ylw, which are binned)
+    import cohort_bitmaps
+
+    return cohort_bitmaps.get_categorical_columns(config['filter_dimensions']) if config['cohort_filters'] else []
+
+
+def get_read_category(config):
+    # The donor category whose rows are loaded; None (every category) when it is a filter dimension
+    import ingest
+
+    return None if ingest.category_column in get_dimension_columns(config) else config['category']
+
+
+def get_cache_config(config):
+    import cohorts
+
+    return dict(app='scatterplot',
+                age_bin_edges=cohorts.default_age_bin_edges,
+                category=get_read_category(config),
+                dimension_columns=get_dimension_columns(config),
+                indicators='numeric columns')
+
+
+def apply_memory_budget(config):
+    """
+    Return `config` with a loading plan that fits in its `max_memory` budget (see memory_budget.py).
+
+    Raises MemoryError if even a chunked build cannot fit.
+    """
+    import data_cache
+    import ingest
+    import memory_budget
+
+    max_memory = memory_budget.parse_memory_size(config['max_memory'])
+    available = max_memory - instrumentation.get_rss()
+    file_path = config['file_path']
+    cached = data_cache.is_cached(file_path, get_cache_config(config), ['df'],
+                                  config['cache_dir'] or data_cache.default_cache_dir)
+
+    # Every row may be in the category; the frame holds the numeric columns (age among them), the age
+    # category and the columns of the cohort filters
+    columns = len(get_read_columns(file_path, get_dimension_columns(config)))
+    rows = memory_budget.estimate_rows(file_path)
+    frame_bytes = rows * (columns * 4 + 1)
+    build_bytes = 0 if cached else memory_budget.get_in_memory_bytes(rows, columns)
+    if not config['shared_memory'] and max(frame_bytes, build_bytes) > available:
+        logger.warning("The ~%s donor frame needs ~%s to load, over the %s left of the memory budget; "
+                       "serving it from memory maps", "{:,}".format(rows),
+                       instrumentation.format_bytes(max(frame_bytes, build_bytes)),
+                       instrumentation.format_bytes(available))
+        config = dict(config, shared_memory=True)
+
+    # With memory maps the frame is paged in from the cache as needed; the browser's copy of the
+    # indicator values (callback_mode 'clientside') is held in memory
+    if config['shared_memory']:
+        available -= config['clientside_data_bytes'] if config['callback_mode'] == 'clientside' else 0
+        if not cached and not config['chunked_build'] and build_bytes > available:
+            logger.warning("Building the cache of the ~%s donor frame in memory needs ~%s; building it chunk "
+                           "by chunk", "{:,}".format(rows), instrumentation.format_bytes(build_bytes))
+            config = dict(config, chunked_build=True)
+        if not cached and config['chunked_build']:
+            chunk_size, _ = memory_budget.plan_chunks(available, columns,
+                                                      config['chunk_size'] or ingest.default_chunk_size)
+            config = dict(config, chunk_size=chunk_size)
+        elif available < 0:
+            raise MemoryError("The scatterplot needs more than the {} memory budget".format(
+                instrumentation.format_bytes(max_memory)))
+    return config
+
+
+def encode_values(values):
+    return base64.b64encode(np.ascontiguousarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+
+def create_marker_trace(x, y, text):
+    return dict(
+        x=x,
+        y=y,
+        text=text,
+        mode='markers',
+        marker={
+            'size': 10,
+            'opacity': 0.5,
+            'line': {'width': 0.5, 'color': 'white'}
+        }
+    )
+
+
+def create_density_trace(x, y, x_log, y_log, bins):
+    import density
+
+    counts, x_centers, y_centers = density.histogram2d(x, y, x_log, y_log, bins)
+    return dict(
+        type='heatmap',
+        x=x_centers,
+        y=y_centers,
+        z=np.where(counts > 0, counts, np.nan),  # leave empty cells blank
+        colorscale='Viridis',
+        colorbar={'title': 'Donors'},
+        hovertemplate='%{z} donors<extra></extra>'
+    )
+
+
+def get_point_count_text(shown, donors, display):
+    if display == 'density':
+        return "Showing the density of {:,} donors".format(donors)
+    if display == 'sample':
+        return "Showing {:,} of {:,} donors (stratified sample)".format(shown, donors)
+    return "Showing all {:,} donors".format(donors)
+
+
+class ScatterData:
+    """
+    The scatterplot dataset: one array per indicator, rows grouped by age category, and with the
+    cohort filters a `cohort_bitmaps.BitmapIndex` of the rows.
+    """
+
+    def __init__(self, config):
+        import cohorts
+        import data_cache
+
+        self.config = config
+        file_path = config['file_path']
+        cache_dir = config['cache_dir'] or data_cache.default_cache_dir
+
+        # The formatted frame is cached on disk, keyed by the file contents and this configuration
+        cache_config = get_cache_config(config)
+
+        # With shared_memory, df is a memory-mapped columnar.ColumnStore of the cached frame
+        category = get_read_category(config)
+        dimension_columns = get_dimension_columns(config)
+        if config['chunked_build']:
+            def build_frames(path):
+                return dict(df=lambda directory: write_formatted_data(path, directory, category, config['chunk_size'],
+                                                                      dimension_columns))
+        else:
+            def build_frames(path):
+                return dict(df=read_and_format_data(path, category, dimension_columns))
+        self.df = data_cache.load_or_build_frames(file_path, cache_config, build_frames, ['df'],
+                                                  cache_dir=cache_dir, as_stores=config['shared_memory'])['df']
+        self.version = data_cache.get_cache_key(file_path, cache_config, cache_dir)
+
+        # Every column besides age, its category and the filter columns is an indicator
+        self.indicators = [column for column in self.df.columns
+                           if column not in ['age', 'Age Category'] + dimension_columns]
+        if config['shared_memory']:
+            self.indicator_values = {indicator: self.df.column(indicator) for indicator in self.indicators}
+            self.ages = self.df.column('age')
+            self.age_slices = cohorts.get_cohort_slices(self.df.series('Age Category'))
+        else:
+            self.indicator_values = {indicator: self.df[indicator].to_numpy() for indicator in self.indicators}
+            self.ages = self.df['age'].to_numpy()
+            self.age_slices = cohorts.get_cohort_slices(self.df['Age Category'])
+        self.no_values = np.empty(0, dtype=np.float32)
+
+        self.cohort_index = None
+        self.initial_selection = {}
+        if config['cohort_filters']:
+            import cohort_bitmaps
+
+            self.cohort_index = cohort_bitmaps.BitmapIndex.from_frame(self.df, config['filter_dimensions'])
+            self.initial_selection = self.get_initial_selection()
+
+        # Samples of the age categories are fixed at load; samples of cohort selections are drawn per selection
+        sample = config['large_category_display'] == 'sample'
+        self.category_samples = self.get_category_samples() if sample and not config['cohort_filters'] else {}
+        # Cohort selections are only resolved on the server
+        clientside = config['callback_mode'] == 'clientside' and not config['cohort_filters']
+        self.clientside_data = self.build_clientside_data() if clientside else None
+
+    def get_values(self, indicator, rows):
+        return self.indicator_values[indicator][rows] if indicator in self.indicator_values else self.no_values
+
+    @instrumentation.timed('scatterplot.get_category_samples')
+    def get_category_samples(self):
+        # Fixed samples (row positions) of the large age categories, stratified by ylw bin if requested
+        samples = {}
+        for age_category, rows in self.age_slices.items():
+            donors = rows.stop - rows.start
+            if donors > self.config['density_threshold']:
+                samples[age_category] = rows.start + sampling.stratified_sample(self.get_strata(rows),
+                                                                                self.config['sample_size'],
+                                                                                seed=age_category)
+        return samples
+
+    def get_strata(self, rows):
+        # Sampling strata of rows: their ylw bin if sample_by_ylw is set
+        import cohorts
+
+        ylw = self.get_values('ylw', rows)
+        if not self.config['sample_by_ylw']:
+            return np.zeros(len(ylw), dtype=np.int64)
+        return cohorts.get_bin_positions(ylw, cohorts.default_ylw_bin_edges).astype(np.int64) + 1
+
+    def get_display(self, age_value):
+        # (rows or row positions to plot, donors in the category, display mode)
+        rows = self.age_slices.get(age_value, slice(0, 0))
+        donors = rows.stop - rows.start
+        if donors <= self.config['density_threshold']:
+            return rows, donors, 'markers'
+        if self.config['large_category_display'] == 'sample':
+            return self.category_samples[age_value], donors, 'sample'
+        return rows, donors, 'density'
+
+    def get_point_count_text(self, age_value):
+        rows, donors, display = self.get_display(age_value)
+        return get_point_count_text(len(rows) if display == 'sample' else donors, donors, display)
+
+    def get_initial_selection(self):
+        # The oldest age category, as the age slider starts with, and the configured donor category
+        import ingest
+
+        selection = {}
+        if 'Age Category' in self.cohort_index.dimensions:
+            selection['Age Category'] = self.cohort_index.get_values('Age Category')[-1:]
+        if ingest.category_column in self.cohort_index.dimensions \
+                and self.config['category'] in self.cohort_index.get_values(ingest.category_column):
+            selection[ingest.category_column] = [self.config['category']]
+        return selection
+
+    def get_selection(self, combine, *values):
+        return cohort_filters.get_selection(self.cohort_index.dimensions, combine, *values)
+
+    def get_selection_display(self, selection, combine):
+        # (bitmap of the donors selected, their number, display mode); rows are read with get_selection_rows
+        bitmap = self.cohort_index.select(selection, combine)
+        donors = len(bitmap)
+        if donors <= self.config['density_threshold']:
+            return bitmap, donors, 'markers'
+        if self.config['large_category_display'] == 'sample':
+            return bitmap, donors, 'sample'
+        return bitmap, donors, 'density'
+
+    def get_selection_rows(self, bitmap, display):
+        rows = bitmap.to_rows()
+        if display == 'sample':
+            rows = rows[sampling.stratified_sample(self.get_strata(rows), self.config['sample_size'])]
+        return rows
+
+    def get_selection_point_count_text(self, combine, *values):
+        bitmap, donors, display = self.get_selection_display(*self.get_selection(combine, *values))
+        # The sample drawn can be smaller than sample_size (quotas are capped by the strata sizes)
+        shown = len(self.get_selection_rows(bitmap, display)) if display == 'sample' else donors
+        return get_point_count_text(shown, donors, display)
+
+    @instrumentation.timed('scatterplot.build_clientside_data')
+    def build_clientside_data(self):
+        categories = {}
+        data_bytes = 0
+        for age_category in self.age_slices:
+            rows, _, display = self.get_display(age_category)
+            if display == 'density':
+                logger.warning("Age categories are shown as density heatmaps; using server callbacks")
+                return None
+            # base64 encoded float32 indicator and age columns
+            data_bytes += len(self.ages[rows]) * 4 * (len(self.indicators) + 1) * 4 // 3
+            if data_bytes > self.config['clientside_data_bytes']:
+                logger.warning("Indicator data exceeds clientside_data_bytes; using server callbacks")
+                return None
+            columns = {indicator: encode_values(self.get_values(indicator, rows)) for indicator in self.indicators}
+            columns['age'] = encode_values(self.ages[rows])
+            categories[str(age_category)] = dict(columns=columns, text=self.get_point_count_text(age_category))
+        return dict(indicators=self.indicators, age_column='age', categories=categories)
+
+    def normalize_trace_inputs(self, xaxis_column_name, yaxis_column_name, age_value, density_axes):
+        # Axis types only change the trace of density heatmaps
+        _, _, display = self.get_display(age_value)
+        return (xaxis_column_name, yaxis_column_name, None if age_value is None else int(age_value),
+                tuple(density_axes or (False, False)) if display == 'density' else None)
+
+    @instrumentation.timed('scatterplot.update_trace')
+    def update_trace(self, xaxis_column_name, yaxis_column_name, age_value, density_axes):
+        rows, _, display = self.get_display(age_value)
+        return self.build_trace(xaxis_column_name, yaxis_column_name, rows, display, density_axes)
+
+    def normalize_selection_trace_inputs(self, xaxis_column_name, yaxis_column_name, density_axes, combine,
+                                         *values_and_axis_types):
+        # Axis types only change the trace of density heatmaps
+        *values, xaxis_type, yaxis_type = values_and_axis_types
+        selection, combine = self.get_selection(combine, *values)
+        _, _, display = self.get_selection_display(selection, combine)
+        return (xaxis_column_name, yaxis_column_name, cohort_filters.normalize_selection(selection, combine),
+                (xaxis_type == 'Log', yaxis_type == 'Log') if display == 'density' else None)
+
+    @instrumentation.timed('scatterplot.update_selection_trace')
+    def update_selection_trace(self, xaxis_column_name, yaxis_column_name, density_axes, combine,
+                               *values_and_axis_types):
+        # density_axes only triggers the rebinning of a density heatmap; the axis types are the current ones
+        *values, xaxis_type, yaxis_type = values_and_axis_types
+        bitmap, _, display = self.get_selection_display(*self.get_selection(combine, *values))
+        rows = self.get_selection_rows(bitmap, display)
+        return self.build_trace(xaxis_column_name, yaxis_column_name, rows, display,
+                                (xaxis_type == 'Log', yaxis_type == 'Log'))
+
+    def build_trace(self, xaxis_column_name, yaxis_column_name, rows, display, density_axes):
+        x = self.get_values(xaxis_column_name, rows)
+        y = self.get_values(yaxis_column_name, rows)
+
+        if display == 'density':
+            x_log, y_log = density_axes or (False, False)
+            trace = create_density_trace(x, y, x_log, y_log, self.config['density_bins'])
+        else:
+            trace = create_marker_trace(x, y, self.ages[rows] if yaxis_column_name in self.indicator_values
+                                        else self.no_values)
+        # The figure is assembled in the browser (assets/scatterplot.js), which unpacks typed arrays
+        return figure_encoding.pack_arrays(trace)
+
+
+# Create Dash App
+def create_layout(data):
+    available_indicators = data.indicators
+
+    # Browser side state used by the callbacks (see register_callbacks)
+    stores = [dcc.Store(id='scatter-trace')]
+    if data.clientside_data is not None:
+        stores.append(dcc.Store(id='scatter-data', data=data.clientside_data))
+    else:
+        stores.append(dcc.Store(id='density-axes'))
+    if data.clientside_data is None and data.cohort_index is None:
+        displays = {str(age_category): data.get_display(age_category)[2] for age_category in data.age_slices}
+        stores.append(dcc.Store(id='category-displays', data=displays))
+
+    return html.Div([
+        html.Div([
+
+            html.Div([
+                dcc.Dropdown(
+                    id='xaxis-column',
+                    options=[{'label': i, 'value': i} for i in available_indicators],
+                    value='mean'
+                ),
+                dcc.RadioItems(
+                    id='xaxis-type',
+                    options=[{'label': i, 'value': i} for i in ['Linear', 'Log']],
+                    value='Linear',
+                    labelStyle={'display': 'inline-block'}
+                )
+            ],
+                style={'width': '48%', 'display': 'inline-block'}),
+
+            html.Div([
+                dcc.Dropdown(
+                    id='yaxis-column',
+                    options=[{'label': i, 'value': i} for i in available_indicators],
+                    value='gmi'
+                ),
+                dcc.RadioItems(
+                    id='yaxis-type',
+                    options=[{'label': i, 'value': i} for i in ['Linear', 'Log']],
+                    value='Linear',
+                    labelStyle={'display': 'inline-block'}
+                )
+            ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'})
+        ]),
+
+        dcc.Graph(id='indicator-graphic'),
+
+        html.Div(id='point-count', style={'textAlign': 'right', 'fontSize': 'small'}),
+
+        create_cohort_controls(data)
+    ] + stores)
+
+
+def create_cohort_controls(data):
+    # The age slider, or with the cohort filters their dropdowns
+    import cohorts
+
+    if data.cohort_index is not None:
+        return cohort_filters.create_filter_controls(data.cohort_index, data.initial_selection)
+
+    age_labels = cohorts.get_bin_labels(cohorts.default_age_bin_edges)
+    age_categories = [age_category for age_category, rows in data.age_slices.items() if rows.stop > rows.start]
+    # With no donors in the category, every age bin is shown on a disabled slider (and plots nothing)
+    disabled = not age_categories
+    if disabled:
+        age_categories = list(range(1, len(age_labels) + 1))
+    return dcc.Slider(
+        id='age--slider',
+        min=min(age_categories),
+        max=max(age_categories),
+        value=max(age_categories),
+        marks={int(age_category): age_labels[age_category - 1] for age_category in age_categories},
+        step=None,
+        disabled=disabled
+    )
+
+
+# Define Interactivity
+#
+# The trace (in the 'scatter-trace' store) only depends on the indicators and the age category;
+# the figure is assembled in the browser (assets/scatterplot.js) from the trace and the axis
+# types, so a Linear/Log toggle only changes the layout. Density heatmaps are binned on the axis
+# scales, so for those the axis types reach the trace callback through the 'density-axes' store.
+# With the cohort filters the trace is built on the server from the rows of the selection; the
+# axis types reach it through the same store, set only while the trace is a heatmap, and are
+# otherwise read as State (responses are cached without them unless the trace is a heatmap).
+def register_callbacks(app, data, figure_cache):
+    app.clientside_callback(
+        ClientsideFunction(namespace='scatterplot', function_name='update_figure'),
+        Output('indicator-graphic', 'figure'),
+        [Input('scatter-trace', 'data'),
+         Input('xaxis-type', 'value'),
+         Input('yaxis-type', 'value')],
+        [State('xaxis-column', 'value'),
+         State('yaxis-column', 'value')])
+
+    if data.cohort_index is not None:
+        filter_inputs = cohort_filters.get_filter_inputs(data.cohort_index.dimensions)
+        app.clientside_callback(
+            ClientsideFunction(namespace='scatterplot', function_name='update_selection_density_axes'),
+            Output('density-axes', 'data'),
+            [Input('xaxis-type', 'value'),
+             Input('yaxis-type', 'value')],
+            [State('scatter-trace', 'data')])
+        figure_encoding.register_callback(app, Output('scatter-trace', 'data'),
+                                          [Input('xaxis-column', 'value'),
+                                           Input('yaxis-column', 'value'),
+                                           Input('density-axes', 'data')] + filter_inputs,
+                                          [State('xaxis-type', 'value'),
+                                           State('yaxis-type', 'value')])(data.update_selection_trace)
+        app.callback(Output('point-count', 'children'), filter_inputs)(data.get_selection_point_count_text)
+        figure_cache.memoize_callback(app, 'scatter-trace.data', data.version, data.normalize_selection_trace_inputs)
+    elif data.clientside_data is not None:
+        app.clientside_callback(
+            ClientsideFunction(namespace='scatterplot', function_name='update_trace'),
+            Output('scatter-trace', 'data'),
+            [Input('xaxis-column', 'value'),
+             Input('yaxis-column', 'value'),
+             Input('age--slider', 'value')],
+            [State('scatter-data', 'data')])
+        app.clientside_callback(
+            ClientsideFunction(namespace='scatterplot', function_name='update_point_count'),
+            Output('point-count', 'children'),
+            [Input('age--slider', 'value')],
+            [State('scatter-data', 'data')])
+    else:
+        app.clientside_callback(
+            ClientsideFunction(namespace='scatterplot', function_name='update_density_axes'),
+            Output('density-axes', 'data'),
+            [Input('xaxis-type', 'value'),
+             Input('yaxis-type', 'value'),
+             Input('age--slider', 'value')],
+            [State('category-displays', 'data')])
+        figure_encoding.register_callback(app, Output('scatter-trace', 'data'),
+                                          [Input('xaxis-column', 'value'),
+                                           Input('yaxis-column', 'value'),
+                                           Input('age--slider', 'value'),
+                                           Input('density-axes', 'data')])(data.update_trace)
+        app.callback(Output('point-count', 'children'),
+                     [Input('age--slider', 'value')])(data.get_point_count_text)
+        figure_cache.memoize_callback(app, 'scatter-trace.data', data.version, data.normalize_trace_inputs)
+
+
+def create_app(config=None):
+    """
+    Create the scatterplot app for `config` (see `default_config`) without loading any data.
+
+    The data is loaded by the first page request, or in the background right away
+    if `warm_up` is set; `app.data.get()` returns it. With a `max_memory` budget the
+    loading plan is fitted to it first, and a MemoryError is raised if it cannot fit.
+    """
+    start_time = time.perf_counter()
+    config = dict(default_config, **(config or {}))
+    if config['max_memory']:
+        config = apply_memory_budget(config)
+
+    # Dash would otherwise call the layout function (and load the data) to validate callbacks up front
+    app = dash.Dash(__name__, external_stylesheets=config['external_stylesheets'],
+                    suppress_callback_exceptions=True)
+    figure_cache = response_cache.ResponseCache(config['figure_cache_bytes'])
+
+    # The callbacks depend on the data (clientside or not), so they are registered once it is loaded
+    app.data = app_loading.LazyData('scatterplot', lambda: ScatterData(config),
+                                    on_load=lambda data: register_callbacks(app, data, figure_cache))
+    cached_layout = functools.lru_cache(maxsize=1)(create_layout)
+    app.layout = lambda: cached_layout(app.data.get())
+
+    @app.server.route('/figure-cache-stats')
+    def figure_cache_stats():
+        return flask.jsonify(figure_cache.stats())
+
+    # The layout is fixed once the data is loaded: serve it serialized and compressed once
+    app.precompressed_layout = http_caching.precompress_layout(app, 'scatterplot', config['layout_brotli_quality']) \
+        if config['http_caching'] else None
+    if config['http_caching']:
+        http_caching.add_etags(app.server)
+
+    if config['instrument']:
+        instrumentation.instrument_app(app, label_inputs={'scatter-trace.data': ['xaxis-column', 'yaxis-column']})
+
+    app_loading.report_startup('scatterplot', start_time)
+    if config['warm_up']:
+        (app.precompressed_layout or app.data).warm_up()
+    return app
@@ -0,0 +1,241 @@
+# Summary engine for the donor barplot
+#
+# Builds the `summary_metrics_table` (count/mean/std/min/percentiles/max for every
+# metric and every cohort grouping) in one sort-based pass per grouping, instead of
+# one `groupby().describe()` + `pd.merge` per (metric, grouping) pair.
+#
+# The sorted values of every cohort can be kept as well (`CohortValues`), so that
+# any other percentile is an index lookup per cohort rather than a recompute.
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+default_percentiles = [.10, .25, .5, .75, .90]
+
+
+def percentile_label(percentile):
+    """Return the `describe`-style column suffix for a percentile (0.1 -> '10%')."""
+    return "{:g}%".format(100 * percentile)
+
+
+def get_stat_names(percentiles=default_percentiles):
+    """Return the per-metric statistic suffixes in `describe` order."""
+    return ['count', 'mean', 'std', 'min'] + [percentile_label(p) for p in percentiles] + ['max']
+
+
+def interpolate_percentiles(sorted_values, counts, percentiles):
+    """
+    Linearly interpolated percentiles of NaN-last, column-sorted values.
+
+    Parameters
+    ----------
+    sorted_values : np.ndarray
+        2d array (rows x metrics) sorted along axis 0 with NaNs at the end of each column
+    counts : np.ndarray
+        number of non-NaN values in each column
+    percentiles : list of float
+        percentiles in [0, 1]
+
+    Returns
+    -------
+    np.ndarray
+        array of shape (len(percentiles), metrics); NaN where a column has no values
+    """
+    counts = np.asarray(counts)
+    n_columns = sorted_values.shape[1]
+    result = np.full((len(percentiles), n_columns), np.nan)
+    has_values = counts > 0
+    if not has_values.any():
+        return result
+
+    columns = np.flatnonzero(has_values)
+    last = counts[columns] - 1
+    for index, percentile in enumerate(percentiles):
+        position = percentile * last
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, last)
+        fraction = position - lower
+        lower_values = sorted_values[lower, columns]
+        upper_values = sorted_values[upper, columns]
+        result[index, columns] = lower_values + (upper_values - lower_values) * fraction
+
+    return result
+
+
+def describe_block(values, percentiles=default_percentiles):
+    """
+    Compute the `describe` statistics for every column of a 2d block at once.
+
+    Returns an array of shape (len(get_stat_names(percentiles)), columns).
+    """
+    return describe_sorted_block(np.sort(values, axis=0), percentiles)  # NaNs sort to the end
+
+
+def describe_sorted_block(sorted_values, percentiles=default_percentiles):
+    """`describe_block` of a block already sorted along axis 0 with NaNs at the end of each column."""
+    counts = np.sum(~np.isnan(sorted_values), axis=0)
+
+    stats = np.full((len(percentiles) + 5, sorted_values.shape[1]), np.nan)
+    stats[0] = counts
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        stats[1] = np.nanmean(sorted_values, axis=0, dtype=np.float64)
+        stats[2] = np.where(counts > 1, np.nanstd(sorted_values, axis=0, ddof=1, dtype=np.float64), np.nan)
+
+    has_values = counts > 0
+    columns = np.flatnonzero(has_values)
+    stats[3, columns] = sorted_values[0, columns]
+    stats[4:-1] = interpolate_percentiles(sorted_values, counts, percentiles)
+    stats[-1, columns] = sorted_values[counts[columns] - 1, columns]
+
+    return stats
+
+
+def iterate_groups(keys):
+    """
+    Sort rows by a grouping key once and yield (group value, row positions) per group.
+
+    Rows with a missing key are skipped, matching `groupby` semantics.
+    """
+    keys = np.asarray(keys, dtype=float)
+    valid_rows = np.flatnonzero(~np.isnan(keys))
+    order = valid_rows[np.argsort(keys[valid_rows], kind='mergesort')]
+    sorted_keys = keys[order]
+    group_values, starts = np.unique(sorted_keys, return_index=True)
+    ends = np.append(starts[1:], len(sorted_keys))
+    for group_value, start, end in zip(group_values, starts, ends):
+        yield group_value, order[start:end]
+
+
+class CohortValues:
+    """
+    The sorted values of every metric in every cohort (row) of a summary metrics table, for
+    percentiles in constant time per cohort.
+
+    The donors of each row are stored back to back, row i spanning `starts[i]` to
+    `starts[i + 1]`, and each metric's values are sorted within the row with NaNs last: the
+    sorted, NaN-free values of metric m in row i are
+    `values[m][starts[i]:starts[i] + counts[m][i]]`.
+
+    Parameters
+    ----------
+    values : dict
+        metric -> 1d array (or memory map) of the sorted values of all rows
+    starts : np.ndarray
+        first position of every row
+    counts : dict
+        metric -> number of values (non-NaN) of every row
+    """
+
+    start_column = 'row start'
+
+    def __init__(self, values, starts, counts):
+        self.values = values
+        self.starts = np.asarray(starts)
+        self.counts = {metric: np.asarray(metric_counts) for metric, metric_counts in counts.items()}
+
+    @property
+    def metrics(self):
+        return list(self.values)
+
+    def percentiles(self, metric, percentiles):
+        """
+        Linearly interpolated percentiles (in [0, 1]) of `metric` in every row, as `describe` computes them.
+
+        Returns an array of shape (len(percentiles), rows); NaN where a row has no values.
+        """
+        counts = self.counts[metric]
+        result = np.full((len(percentiles), len(counts)), np.nan)
+        rows = np.flatnonzero(counts > 0)
+        starts = self.starts[rows]
+        last = counts[rows] - 1
+        for index, percentile in enumerate(percentiles):
+            position = percentile * last
+            lower = np.floor(position).astype(np.int64)
+            upper = np.minimum(lower + 1, last)
+            fraction = position - lower
+            lower_values = self.values[metric][starts + lower]
+            upper_values = self.values[metric][starts + upper]
+            result[index, rows] = lower_values + (upper_values - lower_values) * fraction
+        return result
+
+    def to_frames(self):
+        """Frames to cache: cohort_values (one column per metric) and cohort_counts (plus the row starts)."""
+        counts = pd.DataFrame(self.counts)
+        counts[self.start_column] = self.starts
+        return dict(cohort_values=pd.DataFrame(self.values), cohort_counts=counts)
+
+    @classmethod
+    def from_frames(cls, cohort_values, cohort_counts):
+        """Rebuild from `to_frames` frames; `cohort_values` may be a memory-mapped `columnar.ColumnStore`."""
+        metrics = [column for column in cohort_counts.columns if column != cls.start_column]
+        if isinstance(cohort_values, pd.DataFrame):
+            values = {metric: cohort_values[metric].to_numpy() for metric in metrics}
+        else:
+            values = {metric: cohort_values.column(metric) for metric in metrics}
+        return cls(values, cohort_counts[cls.start_column].to_numpy(),
+                   {metric: cohort_counts[metric].to_numpy() for metric in metrics})
+
+
+def build_summary_metrics_table(df, metrics, groupings, percentiles=default_percentiles, keep_values=False):
+    """
+    Summarize every metric for every cohort of every grouping.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        donor level data containing the metric and grouping columns
+    metrics : list of str
+        metric columns to summarize
+    groupings : list of str
+        cohort code columns; each grouping contributes one row per cohort, with the
+        other grouping columns left as NaN
+    percentiles : list of float
+        percentiles to compute, as for `DataFrame.describe`
+    keep_values : bool
+        also return the sorted values of every cohort, as `CohortValues` matching the table's rows
+
+    Returns
+    -------
+    pd.DataFrame
+        the grouping columns followed by `<metric>.<stat>` columns (and the `CohortValues`, with `keep_values`)
+    """
+    stat_names = get_stat_names(percentiles)
+    values = df[metrics].to_numpy()  # keeps compact (e.g. float32) metric dtypes
+
+    groups = [(grouping, group_value, positions) for grouping in groupings
+              for group_value, positions in iterate_groups(df[grouping].to_numpy(dtype=float))]
+    starts = np.cumsum([0] + [len(positions) for _, _, positions in groups])
+    # Every group's block is sorted in place here, and kept if asked for
+    sorted_values = np.empty((starts[-1] if keep_values else 0, len(metrics)), dtype=values.dtype)
+
+    keys = []
+    rows = []
+    for index, (grouping, group_value, positions) in enumerate(groups):
+        key = dict.fromkeys(groupings, np.nan)
+        key[grouping] = group_value
+        keys.append(key)
+        if keep_values:
+            block = sorted_values[starts[index]:starts[index + 1]]
+            block[:] = values[positions]
+            block.sort(axis=0)
+            stats = describe_sorted_block(block, percentiles)
+        else:
+            stats = describe_block(values[positions], percentiles)
+        # (stats x metrics) -> metric-major row matching the column order below
+        rows.append(stats.T.ravel())
+
+    columns = ["{}.{}".format(metric, stat) for metric in metrics for stat in stat_names]
+    data = np.vstack(rows) if rows else np.empty((0, len(columns)))
+    summary_table = pd.DataFrame(data, columns=columns)
+    summary_table = pd.concat([pd.DataFrame(keys, columns=groupings), summary_table], axis=1)
+
+    if keep_values:
+        counts = {metric: summary_table[metric + '.count'].to_numpy(dtype=np.int64) for metric in metrics}
+        cohort_values = CohortValues({metric: sorted_values[:, column] for column, metric in enumerate(metrics)},
+                                     starts[:-1], counts)
+        return summary_table, cohort_values
+    return summary_table
@@ -0,0 +1,184 @@
+# Synthetic aggregate-cgm-stats files for benchmarks and tests
+#
+# Donors are generated with the columns of 2019-07-17-aggregate-cgm-stats.csv:
+# the `describe` statistics of each donor's readings (count, mean, std, min,
+# 25%, 50%, 75%, max) and the other metrics the apps read (see
+# ingest.metric_catalog), with values that hang together: each donor's CGM
+# readings follow a log-normal distribution with the donor's mean and
+# coefficient of variation, clipped to the 40-400 mg/dL sensor range, and every
+# statistic is derived from it. Missing values follow the patterns of the real
+# file: unknown ages or diagnosis dates, donors without enough data for any
+# metric, and no episode durations when a donor had no episodes.
+#
+# Rows are generated in fixed blocks seeded by (seed, block), so a file depends
+# only on the number of donors and the seed.
+
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+
+import ingest
+
+default_seed = 0
+default_donor_counts = [10000, 100000, 1000000, 10000000]
+block_size = 100000
+
+# Missing value rates
+missing_age_rate = 0.03
+missing_ylw_rate = 0.12
+missing_metrics_rate = 0.01
+
+# Thresholds (mg/dL) of the percent-of-time columns
+below_thresholds = [40, 54, 70]
+above_thresholds = [140, 180, 250, 300, 400]
+
+# Sensor range (mg/dL) and readings per day
+reading_range = (40, 400)
+readings_per_day = 288
+
+# `describe` statistics of the readings, before the other metric columns
+reading_stat_columns = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+reading_percentiles = {'25%': .25, '50%': .5, '75%': .75}
+
+
+def get_normal_cdf(z):
+    # Tanh approximation of the standard normal CDF (absolute error below 2e-4)
+    return 0.5 * (1 + np.tanh(np.sqrt(2 / np.pi) * (z + 0.044715 * z ** 3)))
+
+
+def get_percent_below(threshold, log_mean, log_std):
+    return 100 * get_normal_cdf((np.log(threshold) - log_mean) / log_std)
+
+
+def get_normal_quantile(p):
+    # Inverse of the standard normal CDF (Acklam's rational approximation, relative error below 1.2e-9)
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02,
+         -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01,
+         -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00,
+         4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00]
+    p = np.asarray(p, dtype=float)
+    tail = np.minimum(p, 1 - p)
+    q = np.sqrt(-2 * np.log(np.where(tail < 0.02425, tail, 0.5)))
+    tail_z = (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) \
+        / ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1)
+    r = (p - 0.5) ** 2
+    central_z = (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * (p - 0.5) \
+        / (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1)
+    return np.where(tail < 0.02425, np.where(p < 0.5, tail_z, -tail_z), central_z)
+
+
+def get_reading_quantile(p, log_mean, log_std):
+    return np.clip(np.exp(log_mean + log_std * get_normal_quantile(p)), *reading_range)
+
+
+def generate_block(donors, seed=default_seed, block=0):
+    """
+    Generate `donors` rows of donor stats.
+
+    Returns
+    -------
+    pd.DataFrame
+        hashid, age, ylw, category, the `reading_stat_columns` and the other ingest.metric_catalog columns
+    """
+    random_state = np.random.RandomState([seed, block])
+
+    hashid = np.char.mod('%016x', random_state.randint(0, 2 ** 62, donors, dtype=np.int64))
+    age = np.clip(np.round(random_state.gamma(2.2, 11, donors)), 1, 90)
+    ylw = np.round(age * random_state.beta(1.5, 2.5, donors), 1)
+    age[random_state.random_sample(donors) < missing_age_rate] = np.nan
+    ylw[random_state.random_sample(donors) < missing_ylw_rate] = np.nan
+    category = np.where(np.isnan(age), 'unknown', np.where(np.isnan(ylw), 'age', 'age-ylw'))
+
+    # Each donor's readings are log-normal with this mean and coefficient of variation
+    mean = random_state.lognormal(np.log(160), 0.17, donors)
+    cv = np.clip(random_state.normal(0.35, 0.07, donors), 0.12, 0.7)
+    std = mean * cv
+    log_std = np.sqrt(np.log(1 + cv ** 2))
+    log_mean = np.log(mean) - log_std ** 2 / 2
+
+    # From two weeks to a year of data, with gaps
+    count = np.round(random_state.randint(14, 366, donors) * readings_per_day * random_state.uniform(0.6, 1, donors))
+
+    below = {threshold: get_percent_below(threshold, log_mean, log_std) for threshold in below_thresholds}
+    above = {threshold: 100 - get_percent_below(threshold, log_mean, log_std) for threshold in above_thresholds}
+    columns = {
+        'count': count,
+        'mean': mean,
+        'std': std,
+        # The expected extremes of `count` readings
+        'min': get_reading_quantile(1 / (count + 1), log_mean, log_std),
+        'max': get_reading_quantile(count / (count + 1), log_mean, log_std),
+        'cv': cv,
+        'percent.cgm < 54': below[54],
+        'percent.70 <= cgm <= 180': 100 - below[70] - above[180],
+        'percent.180 < cgm <= 250': above[180] - above[250],
+        'percent.cgm > 250': above[250],
+        'gmi': 3.31 + 0.02392 * mean,
+        'percent.cgm < 40': below[40],
+        'percent.cgm < 70': below[70],
+        'percent.cgm > 140': above[140],
+        'percent.cgm > 180': above[180],
+        'percent.cgm > 300': above[300],
+        'percent.cgm > 400': above[400],
+        'percent.40 <= cgm < 54': below[54] - below[40],
+        'percent.54 <= cgm < 70': below[70] - below[54],
+        'percent.70 <= cgm <= 140': 100 - below[70] - above[140],
+        'percent.250 < cgm <= 400': above[250] - above[400],
+    }
+
+    for column, percentile in reading_percentiles.items():
+        columns[column] = get_reading_quantile(percentile, log_mean, log_std)
+
+    # Episodes are more likely (and longer) the more time is spent below the threshold
+    for threshold in below_thresholds:
+        percent = below[threshold]
+        duration = 15 + random_state.lognormal(np.log(10 + percent), 0.5, donors)
+        duration[random_state.random_sample(donors) < np.exp(-2 * percent)] = np.nan
+        columns['avgDuration.episode.cgm < {}'.format(threshold)] = duration
+
+    # (4 decimals keep the csv compact and fast to write)
+    metric_columns = reading_stat_columns + [column for column in ingest.metric_catalog
+                                             if column not in reading_stat_columns]
+    metrics = pd.DataFrame(columns)[metric_columns].round(4)
+    metrics[random_state.random_sample(donors) < missing_metrics_rate] = np.nan
+
+    donor_columns = pd.DataFrame({'hashid': hashid, 'age': age, 'ylw': ylw, 'category': category})
+    return pd.concat([donor_columns, metrics], axis=1)
+
+
+def generate_chunks(donors, seed=default_seed):
+    """Yield `donors` rows of donor stats in blocks of `block_size` rows."""
+    for block, start in enumerate(range(0, donors, block_size)):
+        yield generate_block(min(block_size, donors - start), seed, block)
+
+
+def write_donor_stats(file_path, donors, seed=default_seed):
+    """
+    Write `donors` rows of donor stats to a csv file (gzip compressed if `file_path` ends in .gz).
+    """
+    if file_path.endswith('.gz'):
+        csv_file = gzip.open(file_path, 'wt', compresslevel=1, newline='')  # fast, at some cost in size
+    else:
+        csv_file = open(file_path, 'w', newline='')
+    with csv_file:
+        for index, chunk in enumerate(generate_chunks(donors, seed)):
+            chunk.to_csv(csv_file, header=index == 0, index=False)
+
+
+def get_donor_stats_file(data_dir, donors, seed=default_seed):
+    """
+    Path of the synthetic file of `donors` rows in `data_dir`, written first if it does not exist yet.
+    """
+    file_name = 'synthetic-donor-stats-{}-seed{}.csv.gz'.format(donors, seed)
+    file_path = os.path.join(data_dir, file_name)
+    if not os.path.exists(file_path):
+        os.makedirs(data_dir, exist_ok=True)
+        partial_path = os.path.join(data_dir, '.partial-' + file_name)
+        write_donor_stats(partial_path, donors, seed)
+        os.replace(partial_path, file_path)
+    return file_path
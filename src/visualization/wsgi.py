@@ -0,0 +1,44 @@
+# WSGI entry point for serving the apps with several worker processes, e.g.
+#
+#   gunicorn --chdir src/visualization --workers 4 --preload --bind 0.0.0.0:8050 wsgi:application
+#
+# Settings come from environment variables:
+#   DASH_APP           'scatterplot' (default) or 'barplot'
+#   DONOR_DATA_FILE    donor stats csv, or a store made by convert-donor-stats.py
+#   DONOR_CACHE_DIR    cache directory (default: data_cache.default_cache_dir)
+#   DONOR_MAX_MEMORY   memory budget, e.g. 4G (see memory_budget.py); leave room for the workers
+#   DONOR_BOOTSTRAP_RESAMPLES
+#                      barplot confidence interval resamples, 0 for none (see barplot_app.default_config)
+#
+# The data and the precompressed layout are loaded here, at import. With
+# --preload that happens once, in the master, before the workers are forked.
+# The scatterplot arrays are memory maps of the cached frame (shared_memory), so
+# the workers share one copy of them through the page cache instead of each
+# holding its own; without --preload the first worker builds the cache and the
+# others wait for it and map it.
+
+import logging
+import os
+
+import barplot_app
+import scatterplot_app
+
+logging.basicConfig(level=logging.INFO, format='%(process)d %(name)s: %(message)s')
+
+app_factories = dict(barplot=barplot_app.create_app, scatterplot=scatterplot_app.create_app)
+
+app_name = os.environ.get('DASH_APP', 'scatterplot')
+config = dict(cache_dir=os.environ.get('DONOR_CACHE_DIR'), max_memory=os.environ.get('DONOR_MAX_MEMORY'))
+if 'DONOR_DATA_FILE' in os.environ:
+    config['file_path'] = os.environ['DONOR_DATA_FILE']
+if app_name == 'scatterplot':
+    config['shared_memory'] = True
+if app_name == 'barplot' and 'DONOR_BOOTSTRAP_RESAMPLES' in os.environ:
+    config['bootstrap_resamples'] = int(os.environ['DONOR_BOOTSTRAP_RESAMPLES'])
+
+app = app_factories[app_name](config)
+app.data.get()
+if app.precompressed_layout is not None:
+    app.precompressed_layout.get()
+
+application = app.server
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The app modules import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'visualization'))
+
+import synthetic_donor_stats  # noqa: E402
+
+test_donors = 20000
+
+
+@pytest.fixture(scope='session')
+def donor_stats_file(tmp_path_factory):
+    """A synthetic aggregate-cgm-stats file of `test_donors` donors."""
+    return synthetic_donor_stats.get_donor_stats_file(str(tmp_path_factory.mktemp('donor-stats')), test_donors)
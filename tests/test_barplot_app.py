@@ -0,0 +1,108 @@
+import json
+
+import plotly.graph_objs as go
+import pytest
+
+import barplot_app
+import cohort_filters
+
+
+def get_barplot_config(donor_stats_file, tmp_path_factory, bootstrap_resamples=50, **config):
+    return dict(barplot_app.default_config, file_path=donor_stats_file, summary_workers=1,
+                bootstrap_resamples=bootstrap_resamples, cache_dir=str(tmp_path_factory.mktemp('cache')),
+                http_caching=False, instrument=False, **config)
+
+
+def get_figure(response):
+    assert response.status_code == 200
+    return json.loads(response.get_data())['response']['barplot']['figure']
+
+
+def post_callback(client, x_metric, y_metric, band, combine='and', selection=None):
+    # (every input is sent, as the browser does; band None: no band control)
+    inputs = [dict(id='x-metric', property='value', value=x_metric),
+              dict(id='y-metric', property='value', value=y_metric)]
+    if band is not None:
+        inputs.append(dict(id='band', property='value', value=band))
+    inputs.append(dict(id=cohort_filters.combine_id, property='value', value=combine))
+    for dimension in barplot_app.default_config['filter_dimensions']:
+        inputs.append(dict(id=cohort_filters.get_filter_id(dimension), property='value',
+                           value=(selection or {}).get(dimension, [])))
+    body = dict(output='barplot.figure', outputs=dict(id='barplot', property='figure'), changedPropIds=[],
+                inputs=inputs)
+    return client.post('/_dash-update-component', json=body)
+
+
+@pytest.fixture(scope='module')
+def callback_client(donor_stats_file, tmp_path_factory):
+    app = barplot_app.create_app(get_barplot_config(donor_stats_file, tmp_path_factory, cohort_filters=True))
+    client = app.server.test_client()
+    client.get('/_dash-layout')
+    client.get('/_dash-dependencies')
+    return client
+
+
+def test_static_figure_conforms_to_the_schema(donor_stats_file, tmp_path_factory):
+    app = barplot_app.create_app(get_barplot_config(donor_stats_file, tmp_path_factory, use_callbacks=False))
+    layout = json.loads(app.server.test_client().get('/_dash-layout').get_data())
+
+    go.Figure(layout['props']['children'][0]['props']['figure'])
+
+
+def test_default_config_draws_confidence_intervals(donor_stats_file, tmp_path_factory):
+    config = get_barplot_config(donor_stats_file, tmp_path_factory,
+                                bootstrap_resamples=barplot_app.default_config['bootstrap_resamples'])
+    app = barplot_app.create_app(config)
+    client = app.server.test_client()
+    client.get('/_dash-layout')
+    client.get('/_dash-dependencies')
+    figure = get_figure(post_callback(client, barplot_app.x_starting_metric, barplot_app.y_metrics[0],
+                                      list(barplot_app.default_band)))
+
+    error_bars = [trace['error_x'] for trace in figure['data'] if trace.get('error_x')]
+    # The median and both band edges
+    assert len(error_bars) == 3
+    assert all(min(bars['array']) >= 0 and min(bars['arrayminus']) >= 0 for bars in error_bars)
+
+
+def test_figures_without_band_control(donor_stats_file, tmp_path_factory):
+    app = barplot_app.create_app(get_barplot_config(donor_stats_file, tmp_path_factory, band_control=False,
+                                                    cohort_filters=True))
+    client = app.server.test_client()
+    client.get('/_dash-layout')
+    client.get('/_dash-dependencies')
+
+    go.Figure(get_figure(post_callback(client, barplot_app.x_starting_metric, barplot_app.y_metrics[0], None)))
+    go.Figure(get_figure(post_callback(client, barplot_app.x_starting_metric, barplot_app.y_metrics[0], None, 'or',
+                                       {'category': ['age-ylw']})))
+
+
+@pytest.mark.parametrize('y_metric', barplot_app.y_metrics)
+@pytest.mark.parametrize('x_metric', barplot_app.x_metrics)
+def test_callback_figures_conform_to_the_schema(callback_client, x_metric, y_metric):
+    go.Figure(get_figure(post_callback(callback_client, x_metric, y_metric, list(barplot_app.default_band))))
+
+
+@pytest.mark.parametrize('y_metric', barplot_app.y_metrics)
+def test_band_and_selection_figures_conform_to_the_schema(callback_client, y_metric):
+    go.Figure(get_figure(post_callback(callback_client, barplot_app.x_starting_metric, y_metric, [2.5, 97.5])))
+    go.Figure(get_figure(post_callback(callback_client, barplot_app.x_starting_metric, y_metric, [5, 95], 'or',
+                                       {'Age Category': [2, 3], 'category': ['age-ylw']})))
+
+
+def test_band_edge_intervals_are_bootstrapped_once(donor_stats_file, tmp_path_factory, monkeypatch):
+    import bootstrap
+
+    data = barplot_app.BarplotData(get_barplot_config(donor_stats_file, tmp_path_factory))
+    calls = []
+    bootstrap_cohort_values = bootstrap.bootstrap_cohort_values
+    monkeypatch.setattr(bootstrap, 'bootstrap_cohort_values',
+                        lambda *args, **kwargs: calls.append(args[1]) or bootstrap_cohort_values(*args, **kwargs))
+
+    metric = barplot_app.x_starting_metric
+    tables = [data.add_band_intervals(data.get_band_table(metric, band), metric, band)
+              for band in [(2.5, 97.5), (2.5, 97.5), (2.5, 95)]]
+
+    assert calls == [[.025], [.975], [.95]]
+    assert tables[0].equals(tables[1])
+    assert set(bootstrap.get_interval_columns(metric, .95)) <= set(tables[2].columns)
@@ -0,0 +1,41 @@
+import numpy as np
+
+import bootstrap
+from summary_metrics import CohortValues
+
+percentiles = [.1, .5, .9]
+
+
+def get_cohort_values():
+    # Cohorts below and above index_matrix_max_size, so that both resampling methods are used
+    random_state = np.random.RandomState(0)
+    sizes = [0, 1, 30, bootstrap.index_matrix_max_size, 5000]
+    values, counts = {}, {}
+    for metric in ['Average', 'Percent below 54']:
+        blocks = [np.sort(random_state.lognormal(5, 0.3, size)).astype(np.float32) for size in sizes]
+        values[metric] = np.concatenate(blocks)
+        counts[metric] = np.array(sizes)
+    return CohortValues(values, np.cumsum([0] + sizes[:-1]), counts)
+
+
+def test_intervals_cover_the_estimates():
+    cohort_values = get_cohort_values()
+    intervals = bootstrap.bootstrap_cohort_values(cohort_values, percentiles, resamples=500, workers=1)
+
+    for metric, metric_intervals in intervals.items():
+        estimates = cohort_values.percentiles(metric, percentiles)
+        assert np.isnan(metric_intervals[:, :, 0]).all()
+        low, high = metric_intervals[:, :, 1:]
+        assert (low <= estimates[:, 1:] + 1e-6).all() and (estimates[:, 1:] <= high + 1e-6).all()
+        # Intervals narrow as cohorts grow
+        widths = high - low
+        assert (widths[:, -1] < widths[:, 2]).all()
+
+
+def test_intervals_do_not_depend_on_the_workers():
+    cohort_values = get_cohort_values()
+    single = bootstrap.bootstrap_cohort_values(cohort_values, percentiles, resamples=200, workers=1)
+    pooled = bootstrap.bootstrap_cohort_values(cohort_values, percentiles, resamples=200, workers=2)
+
+    for metric in single:
+        np.testing.assert_array_equal(single[metric], pooled[metric])
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import cohort_bitmaps
+import scatterplot_app
+from cohort_bitmaps import Bitmap, container_size
+
+# Sizes with a partial last container, and densities giving empty, array, bitset and full containers
+sizes = [1, 1000, 3 * container_size + 123]
+densities = [0, 0.01, 0.5, 0.99, 1]
+
+
+def get_mask(random_state, size):
+    # Each container gets its own density
+    densities_by_row = np.repeat(random_state.choice(densities, size // container_size + 1), container_size)[:size]
+    return random_state.random_sample(size) < densities_by_row
+
+
+@pytest.mark.parametrize('size', sizes)
+def test_bitmap_operations_match_masks(size):
+    random_state = np.random.RandomState(size)
+    for _ in range(20):
+        mask, other_mask = get_mask(random_state, size), get_mask(random_state, size)
+        bitmap, other = Bitmap.from_mask(mask), Bitmap.from_mask(other_mask)
+
+        np.testing.assert_array_equal(bitmap.to_mask(), mask)
+        np.testing.assert_array_equal((bitmap & other).to_mask(), mask & other_mask)
+        np.testing.assert_array_equal((bitmap | other).to_mask(), mask | other_mask)
+        np.testing.assert_array_equal((~bitmap).to_mask(), ~mask)
+        assert len(bitmap) == mask.sum()
+        np.testing.assert_array_equal(bitmap.to_rows(), np.flatnonzero(mask))
+
+
+def test_bitmaps_of_different_sizes_do_not_combine():
+    with pytest.raises(ValueError):
+        Bitmap.full(10) & Bitmap.full(11)
+
+
+@pytest.fixture(scope='module')
+def donors(donor_stats_file):
+    return scatterplot_app.read_and_format_data(donor_stats_file, None, ['category'])
+
+
+@pytest.mark.parametrize('combine', ['and', 'or'])
+def test_selection_matches_pandas(donors, combine):
+    dimensions = ['Age Category', 'Years Living With Category', 'category']
+    index = cohort_bitmaps.BitmapIndex.from_frame(donors, dimensions)
+    selection = {'Age Category': [2, 4], 'Years Living With Category': [1], 'category': ['age-ylw']}
+
+    age_category = pd.Series(cohort_bitmaps.get_dimension_codes(donors, 'Age Category')[0] + 1)
+    ylw_category = pd.Series(cohort_bitmaps.get_dimension_codes(donors, 'Years Living With Category')[0] + 1)
+    matches = [age_category.isin([2, 4]), ylw_category.isin([1]), donors['category'].isin(['age-ylw'])]
+    expected = np.logical_and.reduce(matches) if combine == 'and' else np.logical_or.reduce(matches)
+
+    np.testing.assert_array_equal(index.select(selection, combine).to_mask(), expected)
+    assert len(index.select({}, combine)) == len(donors)
+
+
+def test_unknown_dimension(donors):
+    with pytest.raises(ValueError):
+        cohort_bitmaps.BitmapIndex.from_frame(donors, ['insulin pump'])
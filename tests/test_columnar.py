@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+import cohorts
+import columnar
+import ingest
+import scatterplot_app
+
+
+def test_frame_round_trip(tmp_path):
+    df = pd.DataFrame({'value': np.array([1.5, np.nan, 3], dtype=np.float32),
+                       'count': [1, 2, 3],
+                       'category': pd.Categorical(['a', None, 'b']),
+                       'name': ['x', 'y', 'x']})
+    columnar.save_frame(df, str(tmp_path))
+
+    expected = df.assign(name=df['name'].astype('category'))
+    pd.testing.assert_frame_equal(columnar.load_frame(str(tmp_path)), expected)
+    store = columnar.ColumnStore(str(tmp_path))
+    pd.testing.assert_frame_equal(store.take(np.array([2, 0]), ['value', 'category']),
+                                  expected.loc[[2, 0], ['value', 'category']].reset_index(drop=True))
+
+
+def test_converted_store_reads_like_the_file(donor_stats_file, tmp_path):
+    store_dir = str(tmp_path / 'store')
+    columns = [ingest.age_column, ingest.category_column] + list(ingest.metric_catalog)
+    rows = ingest.convert_to_store(donor_stats_file, store_dir, chunk_size=3000)
+
+    from_file = ingest.concat_chunks(ingest.read_chunks(donor_stats_file, columns))
+    from_store = ingest.concat_chunks(ingest.read_chunks(store_dir, columns, chunk_size=7000))
+    assert rows == len(from_file)
+    pd.testing.assert_frame_equal(from_store, from_file, check_categorical=False)
+
+
+def test_sorted_chunks_match_sorting_in_memory(donor_stats_file, tmp_path):
+    dimension_columns = [ingest.category_column]
+    expected = scatterplot_app.read_and_format_data(donor_stats_file, None, dimension_columns)
+    scatterplot_app.write_formatted_data(donor_stats_file, str(tmp_path), None, chunk_size=3000,
+                                         dimension_columns=dimension_columns)
+    saved = columnar.load_frame(str(tmp_path))
+
+    assert list(saved.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(saved, expected, check_categorical=False)
+    assert cohorts.get_cohort_slices(saved['Age Category']) == cohorts.get_cohort_slices(expected['Age Category'])
@@ -0,0 +1,24 @@
+import logging
+
+import pandas as pd
+
+import data_cache
+
+
+def test_cache_reports_are_logged_not_printed(tmp_path, capsys, caplog):
+    file_path = tmp_path / 'donors.csv'
+    file_path.write_text('age,mean\n10,150\n')
+    cache_dir = str(tmp_path / 'cache')
+
+    def build_frames(path):
+        return dict(df=pd.read_csv(path))
+
+    with caplog.at_level(logging.INFO, logger=data_cache.__name__):
+        for _ in range(2):
+            frames = data_cache.load_or_build_frames(str(file_path), dict(app='test'), build_frames, ['df'],
+                                                     cache_dir=cache_dir)
+
+    assert frames['df']['mean'].tolist() == [150]
+    assert capsys.readouterr().out == ''
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages[0].startswith('Built and cached df') and messages[1].startswith('Loaded cached df')
@@ -0,0 +1,45 @@
+import numpy as np
+
+import density
+
+
+def test_counts_match_numpy_histogram2d():
+    random_state = np.random.RandomState(0)
+    x = random_state.normal(150, 30, 10000)
+    y = random_state.uniform(0, 100, 10000)
+
+    counts, x_centers, y_centers = density.histogram2d(x, y, bins=20)
+    expected, x_edges, y_edges = np.histogram2d(x, y, bins=20)
+
+    # (rows are y bins, as a heatmap expects)
+    np.testing.assert_array_equal(counts, expected.T)
+    np.testing.assert_allclose(x_centers, (x_edges[:-1] + x_edges[1:]) / 2)
+    np.testing.assert_allclose(y_centers, (y_edges[:-1] + y_edges[1:]) / 2)
+
+
+def test_log_axes_bin_in_log_space_and_drop_unusable_values():
+    x = np.array([1, 10, 100, 1000, 0, -5, np.nan])
+    y = np.ones(len(x))
+
+    counts, x_centers, _ = density.histogram2d(x, y, x_log=True, bins=3)
+
+    # Decades are equally wide on a log axis; 0, -5 and NaN cannot be placed
+    assert counts.sum() == 4
+    np.testing.assert_array_equal(counts.sum(axis=0), [1, 1, 2])
+    np.testing.assert_allclose(np.log10(x_centers), [.5, 1.5, 2.5])
+
+
+def test_the_maximum_falls_in_the_last_bin():
+    edges = density.get_bin_edges(np.array([0., 1., 2.]), bins=2)
+
+    np.testing.assert_array_equal(density.get_bin_positions(np.array([0., 1.5, 2., 3.]), edges), [0, 1, 1, -1])
+
+
+def test_constant_values_get_one_unit_wide_edges():
+    np.testing.assert_allclose(density.get_bin_edges(np.array([5., 5.]), bins=2), [4.5, 5, 5.5])
+
+
+def test_no_usable_values_give_empty_grids():
+    counts, x_centers, y_centers = density.histogram2d(np.array([-1., 0.]), np.array([1., 2.]), x_log=True)
+
+    assert counts.shape == (0, 0) and len(x_centers) == 0 and len(y_centers) == 0
@@ -0,0 +1,87 @@
+import base64
+import json
+
+import dash
+import dash_core_components as dcc
+import dash_html_components as html
+import numpy as np
+import pandas as pd
+import pytest
+from dash.dependencies import Input, Output
+from plotly.utils import PlotlyJSONEncoder
+
+import figure_encoding
+
+
+def decode_array(encoded):
+    # (as unpackTrace in assets/scatterplot.js does)
+    values = np.frombuffer(base64.b64decode(encoded['bdata']), dtype=np.dtype(encoded['dtype']).newbyteorder('<'))
+    return values.reshape(encoded['shape']) if 'shape' in encoded else values
+
+
+@pytest.mark.parametrize('values, dtype', [
+    (np.array([1.5, np.nan, -2.25], dtype=np.float32), 'float32'),
+    (np.array([0.1, 1e30, np.inf]), 'float32'),
+    (np.array([1e300, 2.0]), 'float64'),
+    (np.array([3, -4, 2 ** 31 - 1]), 'int32'),
+    (np.array([2 ** 40, 1]), 'float64'),
+    (np.array([True, False]), 'int32'),
+    (np.arange(6, dtype=np.int64).reshape(2, 3), 'int32'),
+])
+def test_typed_arrays_round_trip(values, dtype):
+    encoded = figure_encoding.encode_array(values)
+
+    assert encoded['dtype'] == dtype
+    np.testing.assert_allclose(decode_array(encoded), values, rtol=1e-7 if dtype == 'float32' else 0)
+
+
+def test_pack_arrays_packs_only_numeric_arrays():
+    packed = figure_encoding.pack_arrays(dict(x=np.arange(3.0), text=np.array(['a', 'b']),
+                                              marker=dict(size=10), data=[np.ones(2, dtype=np.int32)]))
+
+    np.testing.assert_array_equal(decode_array(packed['x']), np.arange(3.0))
+    assert packed['text'].tolist() == ['a', 'b']
+    assert packed['marker'] == dict(size=10)
+    np.testing.assert_array_equal(decode_array(packed['data'][0]), [1, 1])
+
+
+@pytest.mark.parametrize('with_orjson', [True, False])
+def test_dumps_matches_the_plotly_encoding(with_orjson, monkeypatch):
+    if not with_orjson:
+        monkeypatch.setattr(figure_encoding, 'orjson', None)
+    value = dict(x=np.array([1.5, np.nan]), y=pd.Series([1, 2]), z=np.arange(4)[::2], text=np.array(['a']),
+                 component=html.Div('a'))
+
+    assert json.loads(figure_encoding.dumps(value)) == json.loads(json.dumps(value, cls=PlotlyJSONEncoder))
+    assert json.loads(figure_encoding.dumps(value))['x'] == [1.5, None]
+
+
+def test_registered_callback_responses_are_encoded_by_dumps():
+    app = dash.Dash(__name__)
+    app.layout = html.Div([dcc.Input(id='count', value=2), dcc.Graph(id='graph')])
+
+    @figure_encoding.register_callback(app, Output('graph', 'figure'), [Input('count', 'value')])
+    def update_graph(count):
+        if count is None:
+            return dash.no_update
+        return dict(data=[dict(x=np.arange(count, dtype=np.float32))])
+
+    # The callback is left callable as it was defined; Dash calls the encoding wrapper
+    assert update_graph(1) == dict(data=[dict(x=np.arange(1, dtype=np.float32))])
+    assert app.callback_map[figure_encoding.get_callback_id(Output('graph', 'figure'))]['callback'] \
+        is not update_graph
+
+    client = app.server.test_client()
+    client.get('/_dash-layout')
+    client.get('/_dash-dependencies')
+
+    def post(count):
+        return client.post('/_dash-update-component', json=dict(
+            output='graph.figure', outputs=dict(id='graph', property='figure'), changedPropIds=['count.value'],
+            inputs=[dict(id='count', property='value', value=count)]))
+
+    response = post(2)
+    assert response.status_code == 200
+    assert json.loads(response.get_data()) == dict(response=dict(graph=dict(figure=dict(data=[dict(x=[0.0, 1.0])]))),
+                                                   multi=True)
+    assert post(None).status_code == 204
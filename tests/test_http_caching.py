@@ -0,0 +1,28 @@
+import json
+
+import http_caching
+import scatterplot_app
+
+
+def test_large_bodies_get_a_lower_brotli_quality():
+    assert http_caching.get_brotli_quality(b'{}') == http_caching.brotli_quality
+    assert http_caching.get_brotli_quality(b' ' * (http_caching.large_body_bytes + 1)) \
+        == http_caching.large_body_brotli_quality
+
+
+def test_layout_is_precompressed_in_the_background(donor_stats_file, tmp_path):
+    app = scatterplot_app.create_app(dict(file_path=donor_stats_file, cache_dir=str(tmp_path / 'cache'),
+                                          instrument=False))
+    client = app.server.test_client()
+
+    # The first request gets the layout without waiting for its compression
+    response = client.get('/_dash-layout')
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    layout = json.loads(response.get_data())
+
+    app.precompressed_layout.warm_up().join()
+    response = client.get('/_dash-layout', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag']
+    assert json.loads(app.precompressed_layout.get().encodings['identity']) == layout
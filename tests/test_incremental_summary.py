@@ -0,0 +1,155 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import barplot_app
+import incremental_summary
+import quantile_sketch
+import synthetic_donor_stats
+from summary_metrics import build_summary_metrics_table
+
+
+def get_incremental_config(donor_stats_file, tmp_path, metrics):
+    return dict(barplot_app.default_config, file_path=donor_stats_file, summary_mode='incremental',
+                metrics=metrics, cache_dir=str(tmp_path / 'cache'), incremental_state_dir=str(tmp_path / 'state'),
+                delta_dir=None, summary_workers=1)
+
+
+def test_changed_settings_reseed_the_state(donor_stats_file, tmp_path):
+    metrics = [barplot_app.count_metric, 'Coefficient of Variation']
+    first = barplot_app.BarplotData(get_incremental_config(donor_stats_file, tmp_path, metrics))
+    version = first.summary_state.version
+
+    other_metrics = metrics + ['Percent below 54']
+    second = barplot_app.BarplotData(get_incremental_config(donor_stats_file, tmp_path, other_metrics))
+
+    assert len(second.summary_metrics_table) == len(first.summary_metrics_table)
+    assert second.summary_metrics_table['Percent below 54.count'].sum() > 0
+    # Other processes see the reseeded state as a newer version
+    assert second.summary_state.version > version
+    assert not second.summary_state.needs_seed
+
+
+def test_open_with_other_settings_needs_seed(tmp_path):
+    state_dir = str(tmp_path)
+    state = incremental_summary.SummaryState.open(state_dir, ['Average'])
+    assert state.needs_seed
+    state.save()
+
+    assert not incremental_summary.SummaryState.open(state_dir, ['Average']).needs_seed
+    assert incremental_summary.SummaryState.open(state_dir, ['Average', 'Standard Deviation']).needs_seed
+    assert incremental_summary.SummaryState.open(state_dir, ['Average'], rank_error=0.01).needs_seed
+    assert incremental_summary.SummaryState.open(state_dir, ['Average'], quantile_sketch.default_rank_error,
+                                                 key_column='hashid').needs_seed
+
+
+def test_deltas_match_summarizing_the_final_donors(tmp_path):
+    metrics = [barplot_app.count_metric, 'Coefficient of Variation', 'Average']
+    config = dict(barplot_app.default_config, metrics=metrics, donor_key_column='hashid')
+    base = synthetic_donor_stats.generate_block(20000, seed=0)
+    # Updated donors (some moving to other cohorts) and new ones
+    updated = synthetic_donor_stats.generate_block(2000, seed=1).assign(hashid=base['hashid'][:2000].to_numpy())
+    new = synthetic_donor_stats.generate_block(3000, seed=2)
+    delta_dir = tmp_path / 'deltas'
+    delta_dir.mkdir()
+    base.to_csv(tmp_path / 'base.csv', index=False)
+    updated.to_csv(delta_dir / 'updated.csv', index=False)
+    new.to_csv(delta_dir / 'new.csv', index=False)
+    final = pd.concat([updated, base[2000:], new], ignore_index=True)
+    final.to_csv(tmp_path / 'final.csv', index=False)
+
+    def read_chunks(file_path):
+        return barplot_app.read_user_stats_chunks(file_path, dict(config, chunk_size=4000))
+
+    state = incremental_summary.SummaryState.open(str(tmp_path / 'state'), metrics, key_column='hashid')
+    state.apply_chunks(read_chunks(str(tmp_path / 'base.csv')))
+    state.save()
+    applied = incremental_summary.apply_pending_deltas(state, str(delta_dir), read_chunks)
+    assert sorted(applied) == ['new.csv', 'updated.csv']
+    assert incremental_summary.apply_pending_deltas(state, str(delta_dir), read_chunks) == []
+
+    groupings = config['groupings']
+    incremental_table = quantile_sketch.build_approximate_summary_metrics_table(state.summaries, metrics, groupings)
+    exact_table = build_summary_metrics_table(barplot_app.read_user_stats(str(tmp_path / 'final.csv'), config),
+                                              metrics, groupings)
+    assert len(incremental_table) == len(exact_table)
+    for metric in metrics:
+        np.testing.assert_array_equal(incremental_table[metric + '.count'], exact_table[metric + '.count'])
+        for stat in ['mean', 'std']:
+            column = "{}.{}".format(metric, stat)
+            np.testing.assert_allclose(incremental_table[column], exact_table[column], rtol=1e-4)
+    # Retracted values count negatively in the sketches, which loosens their error bound
+    report = quantile_sketch.compare_summary_tables(incremental_table, exact_table, metrics, groupings)
+    assert report['max_relative_error'].max() <= 0.02
+
+
+def test_deltas_apply_on_another_thread_than_the_load(tmp_path):
+    metrics = [barplot_app.count_metric, 'Coefficient of Variation']
+    config = dict(barplot_app.default_config, metrics=metrics, donor_key_column='hashid')
+    base = synthetic_donor_stats.generate_block(2000, seed=0)
+    base.to_csv(tmp_path / 'base.csv', index=False)
+    delta_dir = tmp_path / 'deltas'
+    delta_dir.mkdir()
+    base[:100].to_csv(delta_dir / 'updated.csv', index=False)
+
+    def read_chunks(file_path):
+        return barplot_app.read_user_stats_chunks(file_path, config)
+
+    def load():
+        state = incremental_summary.SummaryState.open(str(tmp_path / 'state'), metrics, key_column='hashid')
+        state.apply_chunks(read_chunks(str(tmp_path / 'base.csv')))
+        state.save()
+        states.append(state)
+
+    # (as the loader thread does, with the deltas applied on a request thread)
+    states = []
+    loader = threading.Thread(target=load)
+    loader.start()
+    loader.join()
+    counts = sum(summary.count for summary in states[0].summaries.values())
+    # The re-sent donors replace their rows
+    assert incremental_summary.refresh_state(states[0], str(delta_dir), read_chunks)
+    np.testing.assert_array_equal(sum(summary.count for summary in states[0].summaries.values()), counts)
+
+
+def test_a_donor_sent_twice_in_a_chunk_counts_once(tmp_path):
+    metrics = [barplot_app.count_metric, 'Coefficient of Variation', 'Average']
+    config = dict(barplot_app.default_config, metrics=metrics, donor_key_column='hashid')
+    base = synthetic_donor_stats.generate_block(2000, seed=0)
+    updated = synthetic_donor_stats.generate_block(100, seed=1).assign(hashid=base['hashid'][:100].to_numpy())
+    pd.concat([base, updated], ignore_index=True).to_csv(tmp_path / 'donors.csv', index=False)
+    final = pd.concat([updated, base[100:]], ignore_index=True)
+    final.to_csv(tmp_path / 'final.csv', index=False)
+
+    state = incremental_summary.SummaryState.open(str(tmp_path / 'state'), metrics, key_column='hashid')
+    state.apply_chunks(barplot_app.read_user_stats_chunks(str(tmp_path / 'donors.csv'), config))
+
+    groupings = config['groupings']
+    incremental_table = quantile_sketch.build_approximate_summary_metrics_table(state.summaries, metrics, groupings)
+    exact_table = build_summary_metrics_table(barplot_app.read_user_stats(str(tmp_path / 'final.csv'), config),
+                                              metrics, groupings)
+    for metric in metrics:
+        np.testing.assert_array_equal(incremental_table[metric + '.count'], exact_table[metric + '.count'])
+        np.testing.assert_allclose(incremental_table[metric + '.mean'], exact_table[metric + '.mean'], rtol=1e-4)
+
+
+def test_deltas_being_written_are_left_for_later(tmp_path):
+    metrics = [barplot_app.count_metric, 'Coefficient of Variation']
+    config = dict(barplot_app.default_config, metrics=metrics)
+    delta_dir = tmp_path / 'deltas'
+    delta_dir.mkdir()
+    block = synthetic_donor_stats.generate_block(100, seed=0)
+    for name in ['new.csv.part', 'new.csv.tmp', '.new.csv']:
+        block.to_csv(delta_dir / name, index=False)
+
+    def read_chunks(file_path):
+        return barplot_app.read_user_stats_chunks(file_path, config)
+
+    state = incremental_summary.SummaryState.open(str(tmp_path / 'state'), metrics)
+    assert incremental_summary.apply_pending_deltas(state, str(delta_dir), read_chunks) == []
+
+    os.rename(delta_dir / 'new.csv.part', delta_dir / 'new.csv')
+    assert incremental_summary.apply_pending_deltas(state, str(delta_dir), read_chunks) == ['new.csv']
+    assert state.applied_deltas == ['new.csv']
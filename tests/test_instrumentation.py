@@ -0,0 +1,67 @@
+import logging
+
+import pytest
+
+import instrumentation
+
+
+def test_peak_rss_is_logged_not_printed(capsys, caplog):
+    with caplog.at_level(logging.INFO, logger=instrumentation.__name__):
+        instrumentation.record_stage_memory('test.stage', 0, instrumentation.get_peak_rss() + 2 ** 40)
+
+    assert capsys.readouterr().out == ''
+    assert any('after test.stage' in record.getMessage() for record in caplog.records)
+
+
+def test_histograms_render_in_the_prometheus_text_format():
+    registry = instrumentation.MetricsRegistry()
+    for seconds in [0.002, 0.02, 0.02, 130]:
+        registry.observe('test_seconds', "Test durations.", seconds, stage='a "quoted"\\stage')
+
+    lines = registry.render().splitlines()
+    labels = 'stage="a \\"quoted\\"\\\\stage"'
+    assert lines[:2] == ['# HELP test_seconds Test durations.', '# TYPE test_seconds histogram']
+    assert 'test_seconds_bucket{{{},le="0.001"}} 0'.format(labels) in lines
+    assert 'test_seconds_bucket{{{},le="0.0025"}} 1'.format(labels) in lines
+    assert 'test_seconds_bucket{{{},le="0.025"}} 3'.format(labels) in lines
+    assert 'test_seconds_bucket{{{},le="120"}} 3'.format(labels) in lines
+    assert 'test_seconds_bucket{{{},le="+Inf"}} 4'.format(labels) in lines
+    sum_line = 'test_seconds_sum{{{}}} '.format(labels)
+    assert [float(line[len(sum_line):]) for line in lines if line.startswith(sum_line)] == [pytest.approx(130.042)]
+    assert lines[-1] == 'test_seconds_count{{{}}} 4'.format(labels)
+
+
+def test_server_timing_lists_the_stages_then_the_total():
+    header = instrumentation.get_server_timing([('app.read', 0.0125), ('app.plot', 0.5)], 0.75)
+
+    assert header == 'stage0;dur=12.500;desc="app.read", stage1;dur=500.000;desc="app.plot", total;dur=750.000'
+
+
+def test_instrumented_callbacks_report_their_stages():
+    import dash
+    import dash_core_components as dcc
+    import dash_html_components as html
+    from dash.dependencies import Input, Output
+
+    app = dash.Dash(__name__)
+    app.layout = html.Div([dcc.Input(id='text', value='a'), html.Div(id='echo')])
+
+    @app.callback(Output('echo', 'children'), [Input('text', 'value')])
+    def echo(text):
+        with instrumentation.time_stage('test.echo'):
+            return text
+
+    instrumentation.instrument_app(app, label_inputs={'echo.children': ['text']})
+    client = app.server.test_client()
+    client.get('/_dash-layout')
+    response = client.post('/_dash-update-component', json=dict(
+        output='echo.children', outputs=dict(id='echo', property='children'), changedPropIds=['text.value'],
+        inputs=[dict(id='text', property='value', value='b')]))
+
+    assert response.status_code == 200
+    assert response.headers['Server-Timing'].startswith('stage0;dur=')
+    assert 'desc="test.echo"' in response.headers['Server-Timing']
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'dash_callback_seconds_count{callback="echo.children",text="b"} 1' in metrics
+    assert 'dash_stage_seconds_count{stage="test.echo"}' in metrics
+    assert 'dash_request_seconds_count{path="/_dash-layout"}' in metrics
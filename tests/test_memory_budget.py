@@ -0,0 +1,69 @@
+import gzip
+
+import numpy as np
+import pytest
+
+import memory_budget
+import scatterplot_app
+
+
+@pytest.mark.parametrize('size, expected', [
+    (1024, 1024),
+    (1.5e3, 1500),
+    ('512', 512),
+    ('512M', 512 * 1024 ** 2),
+    ('4g', 4 * 1024 ** 3),
+    (' 1.5GiB ', int(1.5 * 1024 ** 3)),
+    ('2 kb', 2048),
+    ('1T', 1024 ** 4),
+])
+def test_parse_memory_size(size, expected):
+    assert memory_budget.parse_memory_size(size) == expected
+
+
+@pytest.mark.parametrize('size', ['', 'G', '4X', '-1G', 'four gigs'])
+def test_invalid_memory_sizes_are_rejected(size):
+    with pytest.raises(ValueError):
+        memory_budget.parse_memory_size(size)
+
+
+def test_estimate_rows(tmp_path):
+    values = np.random.RandomState(0).uniform(0, 400, (50000, 8))
+    lines = [','.join('c{}'.format(column) for column in range(8))] + [','.join(map(str, row)) for row in values]
+    csv_path = tmp_path / 'donors.csv'
+    csv_path.write_text('\n'.join(lines[:1001]) + '\n')
+    gz_path = tmp_path / 'donors.csv.gz'
+    with gzip.open(gz_path, 'wt') as gz_file:
+        gz_file.write('\n'.join(lines) + '\n')
+
+    # Files up to sample_rows rows are counted; larger ones projected from their first rows
+    assert memory_budget.estimate_rows(str(csv_path)) == 1000
+    assert memory_budget.estimate_rows(str(gz_path)) == pytest.approx(50000, rel=0.1)
+
+
+def test_plan_chunks_keeps_what_fits():
+    available = memory_budget.get_chunked_bytes(100000, 20, workers=4)
+
+    assert memory_budget.plan_chunks(available, 20, 100000, workers=4) == (100000, 4)
+
+
+def test_plan_chunks_drops_workers_before_shrinking_chunks():
+    columns = 20
+    assert memory_budget.plan_chunks(memory_budget.get_chunked_bytes(100000, columns, workers=2), columns,
+                                     100000, workers=4) == (100000, 2)
+    assert memory_budget.plan_chunks(memory_budget.get_chunked_bytes(25000, columns), columns,
+                                     100000, workers=4) == (25000, 1)
+
+
+def test_plan_chunks_raises_memory_error_below_the_smallest_chunk():
+    columns = 20
+    available = memory_budget.get_chunked_bytes(memory_budget.min_chunk_size, columns) - 1
+
+    with pytest.raises(MemoryError, match='memory budget'):
+        memory_budget.plan_chunks(available, columns, 100000, workers=4)
+
+
+def test_app_over_its_budget_refuses_to_start(donor_stats_file, tmp_path):
+    with pytest.raises(MemoryError):
+        scatterplot_app.create_app(dict(file_path=donor_stats_file, cache_dir=str(tmp_path / 'cache'),
+                                        max_memory='1M', instrument=False))
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import barplot_app
+import quantile_sketch
+from summary_metrics import build_summary_metrics_table, default_percentiles, describe_block
+
+percentiles = np.linspace(0.01, 0.99, 99)
+
+
+def get_rank_errors(values, estimates, percentiles):
+    sorted_values = np.sort(values)
+    return np.abs(np.searchsorted(sorted_values, estimates) / len(values) - percentiles)
+
+
+def test_quantiles_match_describe_before_compaction():
+    values = np.random.RandomState(0).lognormal(0, 1, 300)
+    sketch = quantile_sketch.QuantileSketch(seed=0)
+    sketch.update(values)
+
+    np.testing.assert_allclose(sketch.quantiles(default_percentiles),
+                               describe_block(values[:, None], default_percentiles)[4:-1, 0])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_quantiles_within_rank_error(seed):
+    values = np.random.RandomState(seed).lognormal(0, 1, 100000)
+    sketch = quantile_sketch.QuantileSketch(seed=seed)
+    for chunk in np.array_split(values, 37):
+        sketch.update(chunk)
+
+    # The KLL bound holds with high probability rather than always, hence the margin
+    assert get_rank_errors(values, sketch.quantiles(percentiles), percentiles).max() \
+        <= 2 * quantile_sketch.default_rank_error
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_merged_quantiles_within_rank_error(seed):
+    values = np.random.RandomState(seed).normal(0, 1, 100000)
+    sketches = [quantile_sketch.QuantileSketch(seed=seed * 100 + part) for part in range(8)]
+    for sketch, chunk in zip(sketches, np.array_split(values, 8)):
+        sketch.update(chunk)
+    for sketch in sketches[1:]:
+        sketches[0].merge(sketch)
+
+    assert get_rank_errors(values, sketches[0].quantiles(percentiles), percentiles).max() \
+        <= 2 * quantile_sketch.default_rank_error
+
+
+def test_removed_values_drop_out():
+    random_state = np.random.RandomState(0)
+    kept = random_state.normal(0, 1, 50000)
+    removed = random_state.normal(3, 1, 20000)
+    summary = quantile_sketch.CohortSummary(1, seed=0)
+    summary.update(np.concatenate([kept, removed])[:, None])
+    summary.remove(removed[:, None])
+
+    stats = summary.describe(percentiles)
+    assert stats[0, 0] == len(kept)
+    assert stats[1, 0] == pytest.approx(kept.mean())
+    assert stats[2, 0] == pytest.approx(kept.std(ddof=1))
+    assert get_rank_errors(kept, stats[4:-1, 0], percentiles).max() <= 4 * quantile_sketch.default_rank_error
+
+
+@pytest.fixture(scope='module')
+def approximate_config(donor_stats_file):
+    return dict(barplot_app.default_config, file_path=donor_stats_file, summary_workers=1)
+
+
+def summarize_approximately(config, groupings):
+    metrics = config['metrics']
+    summaries = quantile_sketch.summarize_chunks(barplot_app.read_user_stats_chunks(config['file_path'], config),
+                                                 metrics, workers=config['summary_workers'])
+    return quantile_sketch.build_approximate_summary_metrics_table(summaries, metrics, groupings)
+
+
+def test_approximate_table_close_to_exact(approximate_config):
+    metrics = approximate_config['metrics']
+    groupings = approximate_config['groupings']
+    approximate_table = summarize_approximately(approximate_config, groupings)
+    exact_table = build_summary_metrics_table(barplot_app.read_user_stats(approximate_config['file_path'],
+                                                                          approximate_config), metrics, groupings)
+
+    assert len(approximate_table) == len(exact_table)
+    count_columns = [metric + '.count' for metric in metrics]
+    pd.testing.assert_frame_equal(approximate_table[groupings + count_columns], exact_table[groupings + count_columns],
+                                  check_dtype=False)
+    report = quantile_sketch.compare_summary_tables(approximate_table, exact_table, metrics, groupings)
+    assert report['max_relative_error'].max() <= 0.01
+
+
+def test_approximate_table_is_reproducible(approximate_config):
+    groupings = approximate_config['groupings']
+    pd.testing.assert_frame_equal(summarize_approximately(approximate_config, groupings),
+                                  summarize_approximately(approximate_config, groupings))
+
+
+def test_approximate_table_has_the_groupings_asked_for(approximate_config):
+    table = summarize_approximately(approximate_config, ['Years Living With Category'])
+
+    assert 'Age Category' not in table
+    assert table['Years Living With Category'].notna().all()
+    with pytest.raises(ValueError):
+        summarize_approximately(approximate_config, ['category'])
@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+from response_cache import ResponseCache
+
+
+def test_least_recently_used_responses_are_evicted_past_the_budget():
+    cache = ResponseCache(max_bytes=10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb')
+    assert cache.get('a') == b'aaaa'
+    cache.put('c', b'cccc')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'aaaa' and cache.get('c') == b'cccc'
+    assert cache.bytes == 8
+    assert cache.stats()['evictions'] == 1
+
+
+def test_responses_over_the_budget_are_not_cached():
+    cache = ResponseCache(max_bytes=4)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbbb')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'aaaa'
+
+
+def test_replacing_a_response_keeps_the_byte_count():
+    cache = ResponseCache(max_bytes=10)
+    cache.put('a', b'aaaa')
+    cache.put('a', b'aa')
+
+    assert cache.bytes == 2
+    assert cache.stats()['entries'] == 1
+
+
+def test_stats_count_hits_and_misses():
+    cache = ResponseCache()
+    cache.put('a', b'a')
+    cache.get('a')
+    cache.get('a')
+    cache.get('b')
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+    assert stats['hit_rate'] == 2 / 3
+
+    cache.clear()
+    assert cache.get('a') is None
+    assert cache.stats()['bytes'] == 0
+
+
+def test_memoized_callback_is_keyed_by_normalized_inputs_and_version():
+    calls = []
+
+    def callback(x, y):
+        calls.append((x, y))
+        return '{}-{}'.format(x, y).encode()
+
+    app = SimpleNamespace(callback_map={'graph.figure': dict(callback=callback)})
+    version = ['v1']
+    cache = ResponseCache()
+    # The second input makes no difference to the response
+    cache.memoize_callback(app, 'graph.figure', lambda: version[0], lambda x, y: x)
+    memoized = app.callback_map['graph.figure']['callback']
+
+    assert memoized(1, 'a') == b'1-a'
+    assert memoized(1, 'b') == b'1-a'
+    version[0] = 'v2'
+    assert memoized(1, 'b') == b'1-b'
+    assert calls == [(1, 'a'), (1, 'b')]
@@ -0,0 +1,88 @@
+import scatterplot_app
+
+
+def get_scatter_config(donor_stats_file, tmp_path, **config):
+    return dict(scatterplot_app.default_config, file_path=donor_stats_file, cache_dir=str(tmp_path / 'cache'),
+                **config)
+
+
+def test_selection_point_count_is_the_sample_drawn(donor_stats_file, tmp_path):
+    data = scatterplot_app.ScatterData(get_scatter_config(donor_stats_file, tmp_path, cohort_filters=True,
+                                                          large_category_display='sample', density_threshold=1000,
+                                                          sample_size=999))
+    values = [[] for _ in data.cohort_index.dimensions]
+    bitmap, donors, display = data.get_selection_display(*data.get_selection('and', *values))
+    rows = data.get_selection_rows(bitmap, display)
+
+    assert display == 'sample'
+    assert data.get_selection_point_count_text('and', *values) == scatterplot_app.get_point_count_text(
+        len(rows), donors, display)
+
+
+def test_clientside_data_within_budget(donor_stats_file, tmp_path):
+    config = get_scatter_config(donor_stats_file, tmp_path, callback_mode='clientside')
+    data = scatterplot_app.ScatterData(config)
+    assert data.clientside_data is not None
+    assert set(data.clientside_data['indicators']) == set(data.indicators)
+
+    data = scatterplot_app.ScatterData(dict(config, clientside_data_bytes=1024))
+    assert data.clientside_data is None
+
+
+def test_age_slider_without_donors(donor_stats_file, tmp_path):
+    data = scatterplot_app.ScatterData(get_scatter_config(donor_stats_file, tmp_path, category='no-such-category'))
+    slider = scatterplot_app.create_cohort_controls(data)
+
+    assert slider.disabled
+    assert data.get_point_count_text(slider.value) == scatterplot_app.get_point_count_text(0, 0, 'markers')
+
+
+def test_every_numeric_column_is_an_indicator(donor_stats_file, tmp_path):
+    import pandas as pd
+
+    header = pd.read_csv(donor_stats_file, nrows=100)
+    numeric_columns = [column for column in header.columns
+                       if pd.api.types.is_numeric_dtype(header[column].dtype) and column != 'age']
+    for shared_memory in [False, True]:
+        data = scatterplot_app.ScatterData(get_scatter_config(donor_stats_file, tmp_path,
+                                                              shared_memory=shared_memory))
+        assert data.indicators == numeric_columns
+        assert {'count', 'min', '25%', '50%', '75%', 'max'} <= set(data.indicators)
+
+
+def test_selection_axis_types_are_not_server_inputs(donor_stats_file, tmp_path):
+    import json
+
+    import cohort_filters
+
+    app = scatterplot_app.create_app(get_scatter_config(donor_stats_file, tmp_path, cohort_filters=True,
+                                                        density_threshold=1000, http_caching=False,
+                                                        instrument=False))
+    client = app.server.test_client()
+    client.get('/_dash-layout')
+    dependencies = {dependency['output']: dependency for dependency in
+                    json.loads(client.get('/_dash-dependencies').get_data())}
+    trace_inputs = [item['id'] for item in dependencies['scatter-trace.data']['inputs']]
+    assert 'xaxis-type' not in trace_inputs and 'density-axes' in trace_inputs
+
+    def post_trace(xaxis_type):
+        # Every donor is selected, so the trace is a density heatmap
+        dimensions = app.data.get().cohort_index.dimensions
+        inputs = [dict(id='xaxis-column', property='value', value='mean'),
+                  dict(id='yaxis-column', property='value', value='std'),
+                  dict(id='density-axes', property='data', value=[xaxis_type == 'Log', False]),
+                  dict(id=cohort_filters.combine_id, property='value', value='and')]
+        inputs += [dict(id=cohort_filters.get_filter_id(dimension), property='value', value=[])
+                   for dimension in dimensions]
+        state = [dict(id='xaxis-type', property='value', value=xaxis_type),
+                 dict(id='yaxis-type', property='value', value='Linear')]
+        body = dict(output='scatter-trace.data', outputs=dict(id='scatter-trace', property='data'),
+                    changedPropIds=['density-axes.data'], inputs=inputs, state=state)
+        response = client.post('/_dash-update-component', json=body)
+        assert response.status_code == 200
+        return json.loads(response.get_data())['response']['scatter-trace']['data']
+
+    linear, log = post_trace('Linear'), post_trace('Log')
+    assert linear['type'] == log['type'] == 'heatmap'
+    # Density heatmaps are binned on the axis scales
+    assert linear['x'] != log['x']
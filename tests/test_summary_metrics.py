@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import barplot_app
+from summary_metrics import CohortValues, build_summary_metrics_table, default_percentiles, get_stat_names
+
+metrics = ['Average', 'Percent below 54', 'Episodes < 54, Average Duration']
+groupings = barplot_app.default_config['groupings']
+
+
+@pytest.fixture(scope='module')
+def user_stats_df(donor_stats_file):
+    config = dict(barplot_app.default_config, metrics=metrics + ['Coefficient of Variation'])
+    return barplot_app.read_user_stats(donor_stats_file, config)
+
+
+def test_summary_table_matches_describe(user_stats_df):
+    summary_table = build_summary_metrics_table(user_stats_df, metrics, groupings)
+
+    for grouping in groupings:
+        rows = summary_table[summary_table[grouping].notna()].set_index(grouping)
+        for metric in metrics:
+            expected = user_stats_df.astype({grouping: float}).groupby(grouping)[metric] \
+                .describe(percentiles=default_percentiles)
+            expected.columns = ["{}.{}".format(metric, stat) for stat in get_stat_names()]
+            # Cohorts without values of the metric have a count of 0 here and no row in groupby
+            actual = rows.loc[expected.index, expected.columns]
+            pd.testing.assert_frame_equal(actual, expected, check_names=False, rtol=1e-5)
+
+
+def test_cohort_values_give_the_table_percentiles(user_stats_df):
+    summary_table, cohort_values = build_summary_metrics_table(user_stats_df, metrics, groupings, keep_values=True)
+    cohort_values = CohortValues.from_frames(**cohort_values.to_frames())
+
+    for metric in metrics:
+        expected = summary_table[["{}.{:g}%".format(metric, 100 * p) for p in default_percentiles]].to_numpy().T
+        np.testing.assert_allclose(cohort_values.percentiles(metric, default_percentiles), expected, rtol=1e-6)
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+import ingest
+import synthetic_donor_stats
+
+
+def test_block_has_the_aggregate_cgm_stats_columns():
+    block = synthetic_donor_stats.generate_block(1000)
+
+    assert list(block.columns[:4]) == ['hashid', 'age', 'ylw', 'category']
+    assert list(block.columns[4:12]) == synthetic_donor_stats.reading_stat_columns
+    assert set(ingest.metric_catalog) <= set(block.columns)
+
+
+def test_reading_stats_hang_together():
+    block = synthetic_donor_stats.generate_block(1000).dropna(subset=['mean'])
+    stats = block[['min', '25%', '50%', '75%', 'max']].to_numpy()
+
+    assert (np.diff(stats, axis=1) >= 0).all()
+    assert (stats >= synthetic_donor_stats.reading_range[0]).all()
+    assert (stats <= synthetic_donor_stats.reading_range[1]).all()
+    assert (block['count'] > 0).all()
+
+
+def test_blocks_are_deterministic():
+    pd.testing.assert_frame_equal(synthetic_donor_stats.generate_block(100, seed=3, block=2),
+                                  synthetic_donor_stats.generate_block(100, seed=3, block=2))